@@ -1,68 +1,289 @@
 from __future__ import annotations
 
+import json
+import math
+import time
 from dataclasses import dataclass
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, timezone
+from typing import Callable
 
 from psycopg_pool import AsyncConnectionPool
 
 from . import db
+from .ingest import PowerReading
+from .logger import log
+from .metrics import ALERTS_FIRED
+from .rolling import AGG_LAST, AGGREGATES, RollingAggregate
+from .stream import BroadcastHub
+
+OP_ABOVE = ">="
+OP_BELOW = "<="
+
+
+def _phase_values(reading: PowerReading, suffix: str) -> list[float]:
+    values = (
+        getattr(reading, f"phase_a_{suffix}"),
+        getattr(reading, f"phase_b_{suffix}"),
+        getattr(reading, f"phase_c_{suffix}"),
+    )
+    return [v for v in values if v is not None]
+
+
+def _max_of(suffix: str) -> Callable[[PowerReading], float | None]:
+    def get(reading: PowerReading) -> float | None:
+        values = _phase_values(reading, suffix)
+        return max(values) if values else None
+
+    return get
+
+
+def _min_of(suffix: str) -> Callable[[PowerReading], float | None]:
+    def get(reading: PowerReading) -> float | None:
+        values = _phase_values(reading, suffix)
+        return min(values) if values else None
+
+    return get
+
+
+def _current_imbalance_pct(reading: PowerReading) -> float | None:
+    # Largest deviation from the mean phase current, as a percentage of the mean.
+    values = _phase_values(reading, "current_a")
+    if len(values) < 2:
+        return None
+    mean = sum(values) / len(values)
+    if mean <= 0:
+        return None
+    return max(abs(v - mean) for v in values) * 100.0 / mean
+
+
+def _field(name: str) -> Callable[[PowerReading], float | None]:
+    def get(reading: PowerReading) -> float | None:
+        return getattr(reading, name)
+
+    return get
+
+
+METRICS: dict[str, Callable[[PowerReading], float | None]] = {
+    **{
+        name: _field(name)
+        for name in (
+            "total_power_w",
+            "phase_a_power_w",
+            "phase_b_power_w",
+            "phase_c_power_w",
+            "phase_a_voltage_v",
+            "phase_b_voltage_v",
+            "phase_c_voltage_v",
+            "phase_a_current_a",
+            "phase_b_current_a",
+            "phase_c_current_a",
+        )
+    },
+    "max_phase_power_w": _max_of("power_w"),
+    "max_phase_current_a": _max_of("current_a"),
+    "min_voltage_v": _min_of("voltage_v"),
+    "max_voltage_v": _max_of("voltage_v"),
+    "current_imbalance_pct": _current_imbalance_pct,
+}
+
+
+def register_metrics(getters: dict[str, Callable[[PowerReading], float | None]]) -> None:
+    # Stateful components (e.g. the load baseline) expose derived metrics; register before rules are built.
+    METRICS.update(getters)
+
+
+@dataclass(frozen=True)
+class AlertRule:
+    name: str
+    metric: str
+    threshold: float
+    op: str = OP_ABOVE
+    sustain_seconds: int = 0
+    cooldown_seconds: int = 900
+    trigger: bool = False
+    aggregate: str = AGG_LAST
+    window_seconds: int = 0
+
+    def __post_init__(self) -> None:
+        if self.metric not in METRICS:
+            raise ValueError(f"alert rule {self.name!r}: unknown metric {self.metric!r}")
+        if self.op not in (OP_ABOVE, OP_BELOW):
+            raise ValueError(f"alert rule {self.name!r}: op must be '>=' or '<='")
+        if self.aggregate not in AGGREGATES:
+            raise ValueError(f"alert rule {self.name!r}: aggregate must be one of {', '.join(AGGREGATES)}")
+        if self.aggregate != AGG_LAST and self.window_seconds <= 0:
+            raise ValueError(f"alert rule {self.name!r}: {self.aggregate} needs window_seconds > 0")
 
 
 @dataclass
-class AlertConfig:
-    threshold_w: float
-    sustain_seconds: int
-    cooldown_seconds: int
+class AlertFired:
+    rule: AlertRule
+    ts: datetime
+    value: float
+
+
+def parse_rules(value: str | None) -> list[AlertRule]:
+    if not value or not value.strip():
+        return []
+    items = json.loads(value)
+    if not isinstance(items, list):
+        raise ValueError("ALERT_RULES must be a JSON list of rule objects")
+    return [AlertRule(**item) for item in items]
+
+
+def merge_rules(*groups: list[AlertRule]) -> list[AlertRule]:
+    # Later groups override earlier ones by rule name.
+    merged: dict[str, AlertRule] = {}
+    for group in groups:
+        for rule in group:
+            merged[rule.name] = rule
+    return list(merged.values())
+
+
+async def load_db_rules(pool: AsyncConnectionPool) -> list[AlertRule]:
+    rules = []
+    for name, metric, op, threshold, sustain, cooldown, trigger, aggregate, window in await db.fetch_alert_rules(pool):
+        try:
+            rules.append(
+                AlertRule(
+                    name,
+                    metric,
+                    float(threshold),
+                    op,
+                    int(sustain),
+                    int(cooldown),
+                    bool(trigger),
+                    aggregate or AGG_LAST,
+                    int(window or 0),
+                )
+            )
+        except ValueError as exc:
+            log("alert.rule.invalid", rule=name, error=str(exc))
+    return rules
 
 
 class AlertEngine:
-    def __init__(self, config: AlertConfig, pool: AsyncConnectionPool) -> None:
-        self._config = config
+    def __init__(
+        self,
+        rules: list[AlertRule],
+        pool: AsyncConnectionPool,
+        hub: BroadcastHub | None = None,
+        persist_seconds: float = 30.0,
+    ) -> None:
         self._pool = pool
-        self._over_threshold_since: datetime | None = None
-        self._cooldown_until: datetime | None = None
-
-    async def load_state(self, alert_type: str) -> None:
-        state = await db.get_alert_state(self._pool, alert_type)
-        if state:
-            self._cooldown_until = state.cooldown_until_ts
-
-    async def process(self, alert_type: str, total_power_w: float | None) -> bool:
-        now = datetime.now(timezone.utc)
-        if total_power_w is None:
-            await db.upsert_alert_state(
-                self._pool,
-                alert_type,
-                active=False,
-                last_triggered_ts=None,
-                cooldown_until_ts=self._cooldown_until,
-            )
-            return False
-
-        if total_power_w >= self._config.threshold_w:
-            if self._over_threshold_since is None:
-                self._over_threshold_since = now
-            sustained = (now - self._over_threshold_since).total_seconds() >= self._config.sustain_seconds
-            cooling_down = self._cooldown_until is not None and now < self._cooldown_until
-            if sustained and not cooling_down:
-                self._cooldown_until = now + timedelta(seconds=self._config.cooldown_seconds)
-                self._over_threshold_since = None
-                await db.upsert_alert_state(
-                    self._pool,
-                    alert_type,
-                    active=True,
-                    last_triggered_ts=now,
-                    cooldown_until_ts=self._cooldown_until,
-                )
-                return True
-        else:
-            self._over_threshold_since = None
-
-        await db.upsert_alert_state(
-            self._pool,
-            alert_type,
-            active=total_power_w >= self._config.threshold_w,
-            last_triggered_ts=None,
-            cooldown_until_ts=self._cooldown_until,
+        self._hub = hub
+        self._persist_seconds = persist_seconds
+        self._last_persist = 0.0
+        self.rules = list(rules)
+
+        # Each distinct metric is read once per sample and each distinct (metric, aggregate,
+        # window) series is updated once; rules index into the shared value rows.
+        metric_names = list(dict.fromkeys(rule.metric for rule in self.rules))
+        self._getters = [METRICS[name] for name in metric_names]
+        self._values: list[float | None] = [None] * len(metric_names)
+        series_keys = list(
+            dict.fromkeys((rule.metric, rule.aggregate, rule.window_seconds) for rule in self.rules)
         )
-        return False
+        self._series = [
+            (
+                metric_names.index(metric),
+                None if aggregate == AGG_LAST else RollingAggregate(aggregate, window),
+            )
+            for metric, aggregate, window in series_keys
+        ]
+        self._series_values: list[float | None] = [None] * len(series_keys)
+        self._plan = [
+            (
+                series_keys.index((rule.metric, rule.aggregate, rule.window_seconds)),
+                rule.op == OP_BELOW,
+                rule.threshold,
+                rule.sustain_seconds,
+            )
+            for rule in self.rules
+        ]
+        count = len(self.rules)
+        self._over_since = [math.nan] * count
+        self._cooldown_until = [0.0] * count
+        self._active = [False] * count
+        self._dirty = [False] * count
+        # Trigger times not yet written to alert_state (kept across deferred or failed persists).
+        self._fired_ts: dict[str, datetime] = {}
+
+    async def load_state(self) -> None:
+        states = await db.get_alert_states(self._pool)
+        for i, rule in enumerate(self.rules):
+            state = states.get(rule.name)
+            if state is None:
+                continue
+            self._active[i] = bool(state.active)
+            if state.cooldown_until_ts is not None:
+                self._cooldown_until[i] = state.cooldown_until_ts.timestamp()
+
+    async def process(self, reading: PowerReading, persist: bool = True) -> list[AlertFired]:
+        now = reading.ts.timestamp()
+        values = self._values
+        for i, getter in enumerate(self._getters):
+            values[i] = getter(reading)
+        series_values = self._series_values
+        for i, (index, window) in enumerate(self._series):
+            series_values[i] = values[index] if window is None else window.push(now, values[index])
+
+        over_since = self._over_since
+        active = self._active
+        dirty = self._dirty
+        fired: list[AlertFired] = []
+        for i, (index, below, threshold, sustain) in enumerate(self._plan):
+            value = series_values[index]
+            hit = value is not None and (value <= threshold if below else value >= threshold)
+            if hit != active[i]:
+                active[i] = hit
+                dirty[i] = True
+            if not hit:
+                over_since[i] = math.nan
+                continue
+            if math.isnan(over_since[i]):
+                over_since[i] = now
+            if now - over_since[i] >= sustain and now >= self._cooldown_until[i]:
+                rule = self.rules[i]
+                self._cooldown_until[i] = now + rule.cooldown_seconds
+                over_since[i] = math.nan
+                dirty[i] = True
+                fired.append(AlertFired(rule, reading.ts, value))
+
+        for alert in fired:
+            ALERTS_FIRED.inc(alert.rule.name)
+            self._fired_ts[alert.rule.name] = alert.ts
+            if self._hub is not None:
+                self._hub.publish_alert(alert.ts, alert.rule.name, alert.value)
+        # Cooldowns are flushed right away; plain active/inactive flips are batched. persist=False
+        # (database down) keeps the state dirty until a later sample can write it.
+        if persist and (fired or time.monotonic() - self._last_persist >= self._persist_seconds):
+            await self.persist()
+        return fired
+
+    async def persist(self) -> None:
+        self._last_persist = time.monotonic()
+        fired_ts = self._fired_ts
+        rows = []
+        for i, rule in enumerate(self.rules):
+            if not self._dirty[i]:
+                continue
+            cooldown = self._cooldown_until[i]
+            rows.append(
+                {
+                    "type": rule.name,
+                    "active": self._active[i],
+                    "last_triggered_ts": fired_ts.get(rule.name),
+                    "cooldown_until_ts": datetime.fromtimestamp(cooldown, tz=timezone.utc) if cooldown else None,
+                }
+            )
+        if not rows:
+            return
+        try:
+            await db.upsert_alert_states(self._pool, rows)
+        except Exception as exc:  # noqa: BLE001
+            log("alert.state.persist_error", rules=len(rows), error=str(exc))
+            return
+        for i in range(len(self.rules)):
+            self._dirty[i] = False
+        self._fired_ts = {}
@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Any, Awaitable, Callable
+
+from aiohttp import web
+from psycopg_pool import AsyncConnectionPool
+
+from .compare import PricingPool, compare_tariffs, load_shape
+from .db import fetch_energy_series, fetch_local_daily, fetch_power_series, get_newest_power_bucket
+from .health import HealthState
+from .ingest import parse_ts
+from .lttb import lttb_indices
+from .rollups import RollupLevel, choose_level
+from .tariffs import device_zone
+
+POWER_COLUMNS = ["ts", "avg_total_power_w", "min_total_power_w", "max_total_power_w",
+                 "avg_phase_a_power_w", "avg_phase_b_power_w", "avg_phase_c_power_w", "samples"]
+ENERGY_COLUMNS = ["ts", "energy_wh", "avg_power_w", "samples"]
+DAILY_COLUMNS = ["local_day", "timezone", "energy_wh", "samples"]
+
+DEFAULT_RANGE = timedelta(hours=24)
+DEFAULT_DAYS = 31
+DEFAULT_COMPARE_RANGE = timedelta(days=30)
+
+
+class BadRequest(ValueError):
+    pass
+
+
+class Busy(RuntimeError):
+    pass
+
+
+def _json_value(value: Any) -> Any:
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+class QueryCache:
+    def __init__(self, max_entries: int) -> None:
+        self._max_entries = max(0, int(max_entries))
+        self._entries: OrderedDict[tuple[Any, ...], tuple[tuple[Any, ...], str, bytes]] = OrderedDict()
+
+    def get(self, key: tuple[Any, ...], watermark: tuple[Any, ...]) -> tuple[str, bytes] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] != watermark:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1], entry[2]
+
+    def put(self, key: tuple[Any, ...], watermark: tuple[Any, ...], body: bytes) -> str:
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        if self._max_entries:
+            self._entries[key] = (watermark, etag, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+        return etag
+
+
+class QueryApi:
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        health: HealthState,
+        power_levels: list[RollupLevel],
+        energy_levels: list[RollupLevel],
+        default_device: Callable[[], str | None],
+        cache_entries: int,
+        max_points: int,
+        tariff_shape_dir: str | None = None,
+        tariff_workers: int | None = None,
+        default_timezone: Callable[[], str | None] | None = None,
+    ) -> None:
+        self._pool = pool
+        self._health = health
+        self._power_levels = power_levels
+        self._energy_levels = energy_levels
+        self._default_device = default_device
+        self._default_timezone = default_timezone or (lambda: None)
+        self._cache = QueryCache(cache_entries)
+        self._max_points = max(3, int(max_points))
+        self._tariff_shape_dir = tariff_shape_dir
+        self._pricing = PricingPool(tariff_workers)
+        # One comparison at a time; overlapping requests get 429 instead of queueing on the workers.
+        self._compare_lock = asyncio.Lock()
+
+    def register(self, app: web.Application) -> None:
+        app.router.add_get("/api/power", self.power)
+        app.router.add_get("/api/energy", self.energy)
+        app.router.add_get("/api/daily", self.daily)
+        app.router.add_get("/api/tariffs/compare", self.compare_tariffs)
+
+    async def power(self, request: web.Request) -> web.Response:
+        health = self._health
+
+        async def watermark(device_id: str, params: dict[str, Any]) -> tuple[Any, ...]:
+            level = choose_level(self._power_levels, params["start"], params["end"], params["max_points"])
+            if level is not self._power_levels[0]:
+                # Rollup buckets only change (or expire) when the rollup loop runs.
+                return (level.name, health.last_rollup_run)
+            # The newest bucket in range changes as live polls land in it; older ones only through spool
+            # replay or retention. A range that ended earlier keeps its entry across polls.
+            newest = await get_newest_power_bucket(self._pool, device_id, params["start"], params["end"])
+            return (level.name, newest, health.spool_pending, health.last_retention_run)
+
+        async def build(device_id: str, params: dict[str, Any]) -> dict[str, Any]:
+            start_ts, end_ts, max_points = params["start"], params["end"], params["max_points"]
+            level, rows = await fetch_power_series(
+                self._pool, self._power_levels, device_id, start_ts, end_ts, max_points
+            )
+            rows = self._downsample(rows, value_index=1, max_points=max_points)
+            return {"level": level.name, "columns": POWER_COLUMNS, "points": rows}
+
+        return await self._respond(request, "power", watermark, self._range_params, build)
+
+    async def energy(self, request: web.Request) -> web.Response:
+        health = self._health
+        # Bumped by the interval loop and the gap filler whenever they store intervals.
+        watermark = (health.last_interval_ingest, health.last_rollup_run)
+
+        async def build(device_id: str, params: dict[str, Any]) -> dict[str, Any]:
+            start_ts, end_ts, max_points = params["start"], params["end"], params["max_points"]
+            level, rows = await fetch_energy_series(
+                self._pool, self._energy_levels, device_id, params["channel"], start_ts, end_ts, max_points
+            )
+            rows = self._downsample(rows, value_index=2, max_points=max_points)
+            return {"level": level.name, "columns": ENERGY_COLUMNS, "points": rows}
+
+        return await self._respond(request, "energy", watermark, self._energy_params, build)
+
+    async def daily(self, request: web.Request) -> web.Response:
+        watermark = (self._health.last_interval_ingest,)
+
+        async def build(device_id: str, params: dict[str, Any]) -> dict[str, Any]:
+            rows = await fetch_local_daily(
+                self._pool, device_id, params["channel"], params["start"], params["end"]
+            )
+            return {"columns": DAILY_COLUMNS, "points": rows}
+
+        return await self._respond(request, "daily", watermark, self._day_params, build)
+
+    async def compare_tariffs(self, request: web.Request) -> web.Response:
+        watermark = (self._health.last_interval_ingest,)
+
+        async def build(device_id: str, params: dict[str, Any]) -> dict[str, Any]:
+            if self._compare_lock.locked():
+                raise Busy("a tariff comparison is already running")
+            async with self._compare_lock:
+                shape = await load_shape(
+                    self._pool,
+                    device_id,
+                    params["channel"],
+                    params["start"],
+                    params["end"],
+                    hourly=params["resolution"] == "hour",
+                    cache_dir=self._tariff_shape_dir,
+                )
+                results = await compare_tariffs(
+                    self._pool, shape, list(params["tariffs"]) or None, pricing=self._pricing
+                )
+            return {"tariffs": [cost.as_dict() for cost in results]}
+
+        return await self._respond(request, "tariffs", watermark, self._compare_params, build)
+
+    async def _respond(
+        self,
+        request: web.Request,
+        kind: str,
+        watermark: tuple[Any, ...] | Callable[[str, dict[str, Any]], Awaitable[tuple[Any, ...]]],
+        parse: Callable[[web.Request], dict[str, Any]],
+        build: Callable[[str, dict[str, Any]], Awaitable[dict[str, Any]]],
+    ) -> web.Response:
+        try:
+            device_id = request.query.get("device_id") or self._default_device()
+            if not device_id:
+                raise BadRequest("device_id is required")
+            params = parse(request)
+        except BadRequest as exc:
+            return web.json_response({"status": "bad_request", "error": str(exc)}, status=400)
+
+        if callable(watermark):
+            watermark = await watermark(device_id, params)
+        key = (kind, device_id, *sorted(params.items()))
+        cached = self._cache.get(key, watermark)
+        if cached is None:
+            try:
+                built = await build(device_id, params)
+            except Busy as exc:
+                return web.json_response(
+                    {"status": "busy", "error": str(exc)}, status=429, headers={"Retry-After": "5"}
+                )
+            payload = {
+                "device_id": device_id,
+                **{name: _json_value(value) for name, value in params.items()},
+                **built,
+            }
+            if "points" in payload:
+                payload["points"] = [[_json_value(v) for v in row] for row in payload["points"]]
+            body = json.dumps(payload, separators=(",", ":")).encode()
+            etag = self._cache.put(key, watermark, body)
+        else:
+            etag, body = cached
+
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag in [tag.strip() for tag in request.headers.get("If-None-Match", "").split(",")]:
+            return web.Response(status=304, headers=headers)
+        return web.Response(body=body, content_type="application/json", headers=headers)
+
+    def close(self) -> None:
+        self._pricing.close()
+
+    def _range_params(self, request: web.Request) -> dict[str, Any]:
+        query = request.query
+        end_ts = self._parse_ts(query.get("end")) or datetime.now(timezone.utc)
+        start_ts = self._parse_ts(query.get("start")) or end_ts - DEFAULT_RANGE
+        if start_ts >= end_ts:
+            raise BadRequest("start must be < end")
+        # Relative ranges are snapped to the minute so refreshes share cache entries.
+        if "end" not in query:
+            end_ts = end_ts.replace(second=0, microsecond=0) + timedelta(minutes=1)
+            if "start" not in query:
+                start_ts = end_ts - DEFAULT_RANGE
+        return {
+            "start": start_ts,
+            "end": end_ts,
+            "max_points": self._parse_int(query.get("max_points"), self._max_points, 3, self._max_points),
+        }
+
+    def _energy_params(self, request: web.Request) -> dict[str, Any]:
+        params = self._range_params(request)
+        params["channel"] = self._parse_int(request.query.get("channel"), 3, 0, 3)
+        return params
+
+    def _compare_params(self, request: web.Request) -> dict[str, Any]:
+        query = request.query
+        end_ts = self._parse_ts(query.get("end")) or datetime.now(timezone.utc).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
+        start_ts = self._parse_ts(query.get("start")) or end_ts - DEFAULT_COMPARE_RANGE
+        if start_ts >= end_ts:
+            raise BadRequest("start must be < end")
+        resolution = query.get("resolution", "hour")
+        if resolution not in ("hour", "minute"):
+            raise BadRequest("resolution must be 'hour' or 'minute'")
+        tariffs = tuple(sorted(name.strip() for name in query.get("tariffs", "").split(",") if name.strip()))
+        return {
+            "start": start_ts,
+            "end": end_ts,
+            "resolution": resolution,
+            "channel": self._parse_int(query.get("channel"), 3, 0, 3),
+            "tariffs": tariffs,
+        }
+
+    def _day_params(self, request: web.Request) -> dict[str, Any]:
+        query = request.query
+        try:
+            # Default range ends after the device's local today, not the host's.
+            today = datetime.now(device_zone(self._default_timezone())).date()
+            end_day = date.fromisoformat(query["end"]) if "end" in query else today + timedelta(days=1)
+            start_day = (
+                date.fromisoformat(query["start"]) if "start" in query else end_day - timedelta(days=DEFAULT_DAYS)
+            )
+        except ValueError as exc:
+            raise BadRequest(f"invalid date: {exc}") from exc
+        if start_day >= end_day:
+            raise BadRequest("start must be < end")
+        return {"start": start_day, "end": end_day, "channel": self._parse_int(query.get("channel"), 3, 0, 3)}
+
+    @staticmethod
+    def _parse_ts(value: str | None) -> datetime | None:
+        if value is None:
+            return None
+        try:
+            ts = parse_ts(float(value) if value.replace(".", "", 1).isdigit() else value)
+        except (OverflowError, OSError, ValueError):
+            ts = None
+        if ts is None:
+            raise BadRequest(f"invalid timestamp {value!r}")
+        return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+    @staticmethod
+    def _parse_int(value: str | None, default: int, low: int, high: int) -> int:
+        if value is None:
+            return default
+        try:
+            parsed = int(value)
+        except ValueError as exc:
+            raise BadRequest(f"invalid integer {value!r}") from exc
+        return min(high, max(low, parsed))
+
+    @staticmethod
+    def _downsample(rows: list[tuple[Any, ...]], value_index: int, max_points: int) -> list[tuple[Any, ...]]:
+        if len(rows) <= max_points:
+            return rows
+        xs = [row[0].timestamp() for row in rows]
+        ys = [row[value_index] for row in rows]
+        return [rows[i] for i in lttb_indices(xs, ys, max_points)]
@@ -0,0 +1,332 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from psycopg_pool import AsyncConnectionPool
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ModuleNotFoundError:  # optional dependency, only needed when ARCHIVE_DIR is set
+    pa = None
+    pq = None
+
+MANIFEST_NAME = "manifest.json"
+FETCH_BATCH_ROWS = 10000
+# Open months are compacted once this many files pile up; closed months are compacted once.
+COMPACT_MIN_FILES = 8
+
+
+@dataclass(frozen=True)
+class ArchiveTable:
+    name: str
+    ts_column: str
+    key_columns: tuple[str, ...]
+    columns: tuple[tuple[str, str], ...]
+
+
+_FLOAT = "float64"
+_INT = "int32"
+_TEXT = "string"
+_TS = "timestamp"
+
+ARCHIVE_TABLES: dict[str, ArchiveTable] = {
+    "power_readings_1m": ArchiveTable(
+        name="power_readings_1m",
+        ts_column="ts_minute",
+        key_columns=("ts_minute",),
+        columns=(
+            ("ts_minute", _TS),
+            ("device_id", _TEXT),
+            ("avg_total_power_w", _FLOAT),
+            ("avg_phase_a_power_w", _FLOAT),
+            ("avg_phase_b_power_w", _FLOAT),
+            ("avg_phase_c_power_w", _FLOAT),
+            ("avg_phase_a_voltage_v", _FLOAT),
+            ("avg_phase_b_voltage_v", _FLOAT),
+            ("avg_phase_c_voltage_v", _FLOAT),
+            ("avg_phase_a_current_a", _FLOAT),
+            ("avg_phase_b_current_a", _FLOAT),
+            ("avg_phase_c_current_a", _FLOAT),
+            ("samples", _INT),
+        ),
+    ),
+    "energy_intervals": ArchiveTable(
+        name="energy_intervals",
+        ts_column="start_ts",
+        key_columns=("channel", "start_ts", "end_ts"),
+        columns=(
+            ("start_ts", _TS),
+            ("end_ts", _TS),
+            ("device_id", _TEXT),
+            ("channel", _INT),
+            ("energy_wh", _FLOAT),
+            ("avg_power_w", _FLOAT),
+            ("meta", _TEXT),
+        ),
+    ),
+    "energy_intervals_1h": ArchiveTable(
+        name="energy_intervals_1h",
+        ts_column="ts_hour",
+        key_columns=("channel", "ts_hour"),
+        columns=(
+            ("ts_hour", _TS),
+            ("device_id", _TEXT),
+            ("channel", _INT),
+            ("energy_wh", _FLOAT),
+            ("avg_power_w", _FLOAT),
+            ("samples", _INT),
+        ),
+    ),
+}
+
+
+def require_pyarrow() -> None:
+    if pa is None:
+        raise RuntimeError("ARCHIVE_DIR is set but pyarrow is not installed (python3 -m pip install pyarrow)")
+
+
+def _arrow_schema(table: ArchiveTable) -> Any:
+    types = {
+        _FLOAT: pa.float64(),
+        _INT: pa.int32(),
+        _TEXT: pa.string(),
+        _TS: pa.timestamp("us", tz="UTC"),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in table.columns])
+
+
+def _select_sql(table: ArchiveTable) -> str:
+    exprs = []
+    for name, kind in table.columns:
+        if name == "device_id":
+            exprs.append("COALESCE(device_id, 'unknown')")
+        elif kind == _FLOAT:
+            exprs.append(f"{name}::float8")
+        elif kind == _TEXT:
+            exprs.append(f"{name}::text")
+        else:
+            exprs.append(name)
+    return f"SELECT {', '.join(exprs)} FROM {table.name}"
+
+
+def _safe_part(value: str) -> str:
+    return "".join(ch if ch.isalnum() or ch in "-_." else "_" for ch in value)
+
+
+class ArchiveManifest:
+    def __init__(self, root: Path) -> None:
+        self._path = root / MANIFEST_NAME
+        self.files: list[dict[str, Any]] = []
+        if self._path.exists():
+            data = json.loads(self._path.read_text())
+            self.files = list(data.get("files", []))
+
+    def add_file(self, entry: dict[str, Any]) -> None:
+        self.files.append(entry)
+
+    def files_for(self, table: str, device_id: str, start_ts: datetime, end_ts: datetime) -> list[dict[str, Any]]:
+        start = start_ts.astimezone(timezone.utc).isoformat()
+        end = end_ts.astimezone(timezone.utc).isoformat()
+        return [
+            entry
+            for entry in self.files
+            if entry["table"] == table
+            and entry["device_id"] == device_id
+            and entry["max_ts"] >= start
+            and entry["min_ts"] < end
+        ]
+
+    def partition(self, table: str, device_id: str, month: str) -> list[dict[str, Any]]:
+        return [
+            entry
+            for entry in self.files
+            if entry["table"] == table and entry["device_id"] == device_id and entry["month"] == month
+        ]
+
+    def replace(self, old: list[dict[str, Any]], new: dict[str, Any]) -> None:
+        paths = {entry["path"] for entry in old}
+        self.files = [entry for entry in self.files if entry["path"] not in paths]
+        self.add_file(new)
+
+    def save(self) -> None:
+        tmp = self._path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"version": 1, "files": self.files}, indent=1))
+        os.replace(tmp, self._path)
+
+
+class _PartitionWriter:
+    def __init__(self, root: Path, table: ArchiveTable, device_id: str, month: str) -> None:
+        self.table = table
+        self.device_id = device_id
+        self.month = month
+        directory = root / table.name / f"device={_safe_part(device_id)}" / f"month={month}"
+        directory.mkdir(parents=True, exist_ok=True)
+        self.relpath = str(
+            (directory / f"part-{uuid.uuid4().hex[:12]}.parquet").relative_to(root)
+        )
+        self._path = root / self.relpath
+        self._writer = pq.ParquetWriter(self._path, _arrow_schema(table), compression="zstd")
+        self.rows = 0
+        self.min_ts: datetime | None = None
+        self.max_ts: datetime | None = None
+
+    def write(self, rows: list[tuple[Any, ...]]) -> None:
+        columns = list(zip(*rows))
+        batch = pa.table(
+            {name: list(values) for (name, _), values in zip(self.table.columns, columns)},
+            schema=_arrow_schema(self.table),
+        )
+        self._writer.write_table(batch)
+        ts_index = [name for name, _ in self.table.columns].index(self.table.ts_column)
+        first, last = rows[0][ts_index], rows[-1][ts_index]
+        self.min_ts = first if self.min_ts is None else min(self.min_ts, first)
+        self.max_ts = last if self.max_ts is None else max(self.max_ts, last)
+        self.rows += len(rows)
+
+    def close(self) -> dict[str, Any]:
+        self._writer.close()
+        return {
+            "table": self.table.name,
+            "device_id": self.device_id,
+            "month": self.month,
+            "path": self.relpath,
+            "rows": self.rows,
+            "min_ts": self.min_ts.astimezone(timezone.utc).isoformat() if self.min_ts else None,
+            "max_ts": self.max_ts.astimezone(timezone.utc).isoformat() if self.max_ts else None,
+            "created_ts": datetime.now(timezone.utc).isoformat(),
+        }
+
+
+def _dedup(table: ArchiveTable, rows: list[dict[str, Any]]) -> dict[tuple[Any, ...], dict[str, Any]]:
+    # Later files win: a row archived twice (DELETE failed after the write) is kept once.
+    return {tuple(row[key] for key in table.key_columns): row for row in rows}
+
+
+def _month_closed(month: str, cutoff: datetime) -> bool:
+    year, number = (int(part) for part in month.split("-"))
+    month_end = datetime(year + number // 12, number % 12 + 1, 1, tzinfo=timezone.utc)
+    return month_end <= cutoff
+
+
+def _compact_partition(
+    root: Path,
+    manifest: ArchiveManifest,
+    table: ArchiveTable,
+    device_id: str,
+    month: str,
+    cutoff: datetime,
+) -> None:
+    entries = manifest.partition(table.name, device_id, month)
+    if len(entries) < 2:
+        return
+    if len(entries) < COMPACT_MIN_FILES and not _month_closed(month, cutoff):
+        return
+    schema = _arrow_schema(table)
+    merged = pa.concat_tables([pq.read_table(root / entry["path"], schema=schema) for entry in entries])
+    unique = _dedup(table, merged.to_pylist())
+    writer = _PartitionWriter(root, table, device_id, month)
+    names = [name for name, _ in table.columns]
+    rows = sorted(unique.values(), key=lambda row: row[table.ts_column])
+    writer.write([tuple(row[name] for name in names) for row in rows])
+    manifest.replace(entries, writer.close())
+    manifest.save()
+    for entry in entries:
+        (root / entry["path"]).unlink(missing_ok=True)
+
+
+async def archive_and_delete(
+    pool: AsyncConnectionPool,
+    archive_dir: str,
+    table_name: str,
+    cutoff: datetime,
+) -> tuple[int, int]:
+    # Moves rows older than cutoff into the archive. The read and the DELETE share one REPEATABLE READ
+    # snapshot, so only rows that were written out are deleted; rows that arrive meanwhile (gap filler,
+    # backfill) stay for the next run. If the DELETE fails the rows are archived again next time and
+    # readers and compaction drop the duplicates by key.
+    require_pyarrow()
+    table = ARCHIVE_TABLES[table_name]
+    root = Path(archive_dir)
+    root.mkdir(parents=True, exist_ok=True)
+    manifest = ArchiveManifest(root)
+    ts_index = [name for name, _ in table.columns].index(table.ts_column)
+    device_index = [name for name, _ in table.columns].index("device_id")
+
+    query = f"""
+        {_select_sql(table)}
+        WHERE {table.ts_column} < %(cutoff)s
+        ORDER BY COALESCE(device_id, 'unknown'), {table.ts_column}
+    """
+    archived = 0
+    writer: _PartitionWriter | None = None
+    pending: list[tuple[Any, ...]] = []
+    touched: set[tuple[str, str]] = set()
+
+    async def finish() -> None:
+        nonlocal writer, pending
+        if writer is None:
+            return
+        if pending:
+            await asyncio.to_thread(writer.write, pending)
+            pending = []
+        entry = await asyncio.to_thread(writer.close)
+        if entry["rows"]:
+            manifest.add_file(entry)
+        writer = None
+
+    async with pool.connection() as conn:
+        await conn.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+        try:
+            async with conn.cursor(name=f"archive_{table.name}") as cur:
+                await cur.execute(query, {"cutoff": cutoff})
+                while True:
+                    rows = await cur.fetchmany(FETCH_BATCH_ROWS)
+                    if not rows:
+                        break
+                    for row in rows:
+                        device_id = row[device_index]
+                        month = row[ts_index].astimezone(timezone.utc).strftime("%Y-%m")
+                        if writer is None or writer.device_id != device_id or writer.month != month:
+                            await finish()
+                            writer = _PartitionWriter(root, table, device_id, month)
+                            touched.add((device_id, month))
+                        pending.append(row)
+                        archived += 1
+                        if len(pending) >= FETCH_BATCH_ROWS:
+                            await asyncio.to_thread(writer.write, pending)
+                            pending = []
+            await finish()
+        finally:
+            manifest.save()
+        async with conn.cursor() as cur:
+            await cur.execute(f"DELETE FROM {table.name} WHERE {table.ts_column} < %(cutoff)s", {"cutoff": cutoff})
+            deleted = cur.rowcount or 0
+    for device_id, month in sorted(touched):
+        await asyncio.to_thread(_compact_partition, root, manifest, table, device_id, month, cutoff)
+    return archived, deleted
+
+
+def read_archive(
+    archive_dir: str,
+    table_name: str,
+    device_id: str,
+    start_ts: datetime,
+    end_ts: datetime,
+) -> list[dict[str, Any]]:
+    require_pyarrow()
+    table = ARCHIVE_TABLES[table_name]
+    root = Path(archive_dir)
+    manifest = ArchiveManifest(root)
+    rows: list[dict[str, Any]] = []
+    filters = [(table.ts_column, ">=", start_ts), (table.ts_column, "<", end_ts)]
+    for entry in manifest.files_for(table.name, device_id, start_ts, end_ts):
+        rows.extend(pq.read_table(root / entry["path"], filters=filters).to_pylist())
+    return sorted(_dedup(table, rows).values(), key=lambda row: row[table.ts_column])
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Callable
+
+from psycopg_pool import AsyncConnectionPool
+
+from .coverage import day_bitmaps, merge_bitmaps, missing_ranges, range_records
+from .db import (
+    clear_backfill_checkpoint,
+    get_backfill_checkpoint,
+    get_emdata_coverage,
+    insert_energy_intervals_bulk,
+    upsert_backfill_checkpoint,
+)
+from .intervals import interval_row, parse_emdata_blocks, parse_emdata_data
+from .logger import log
+from .metrics import ERRORS, INTERVALS_INGESTED, ROWS_WRITTEN
+from .shelly_rpc import ShellyRpc
+
+
+@dataclass(frozen=True)
+class BackfillChunk:
+    start: datetime
+    end: datetime
+    period: int
+
+    @property
+    def records(self) -> int:
+        return range_records(self.start, self.end, self.period)
+
+
+@dataclass
+class BackfillProgress:
+    chunks_total: int
+    records_total: int
+    chunks_done: int = 0
+    chunks_failed: int = 0
+    records_fetched: int = 0
+    records_absent: int = 0
+    rows_inserted: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def records_per_second(self) -> float:
+        return self.records_fetched / self.elapsed if self.elapsed > 0 else 0.0
+
+    @property
+    def eta_seconds(self) -> float | None:
+        done = self.records_fetched + self.records_absent
+        if not done:
+            return None
+        return self.elapsed * (self.records_total - done) / done
+
+
+class BackfillEngine:
+    # Pulls a window of the device's EMData ring buffer. Chunks follow the block layout reported by
+    # EMData.GetRecords and skip records already in energy_intervals (emdata_coverage) or already asked
+    # for by an earlier run (emdata_backfill_checkpoints), so an interrupted run resumes where it stopped.
+    # Derived tables are left to the caller: concurrent per-chunk 1h upserts could race on shared hours.
+
+    def __init__(
+        self,
+        rpc: ShellyRpc,
+        pool: AsyncConnectionPool,
+        device_id: str,
+        emdata_id: int,
+        max_records: int = 500,
+        concurrency: int = 3,
+        retries: int = 3,
+        on_progress: Callable[[BackfillProgress], None] | None = None,
+    ) -> None:
+        self._rpc = rpc
+        self._pool = pool
+        self._device_id = device_id
+        self._emdata_id = emdata_id
+        self._max_records = max(1, int(max_records))
+        self._concurrency = max(1, int(concurrency))
+        self._retries = max(0, int(retries))
+        self._on_progress = on_progress
+        # [first record start, end of the last record) of the window on the device, set by plan().
+        self.span: tuple[datetime, datetime] | None = None
+
+    async def plan(self, start: datetime, end: datetime, recheck: bool = False) -> list[BackfillChunk]:
+        blocks = parse_emdata_blocks(await self._rpc.get_emdata_records({"id": self._emdata_id}))
+        chunks: list[BackfillChunk] = []
+        self.span = None
+        for period in sorted({block[2] for block in blocks}):
+            first_day = max(start, blocks[0][0]).date()
+            last_day = end.date()
+            if recheck:
+                await clear_backfill_checkpoint(self._pool, self._device_id, period, first_day, last_day)
+            skip = merge_bitmaps(
+                await get_emdata_coverage(self._pool, self._device_id, period, first_day, last_day),
+                await get_backfill_checkpoint(self._pool, self._device_id, period, first_day, last_day),
+            )
+            step = timedelta(seconds=period)
+            for block_start, block_end, block_period in blocks:
+                if block_period != period:
+                    continue
+                # First record on the block's grid at or after start.
+                offset = max(0, -(-int((start - block_start).total_seconds()) // period))
+                lo = block_start + step * offset
+                hi = min(block_end, end)
+                if lo <= hi:
+                    span = self.span or (lo, hi)
+                    self.span = (min(span[0], lo), max(span[1], hi + step))
+                for first, last in missing_ranges(skip, lo, hi, period) if lo <= hi else []:
+                    while first <= last:
+                        chunk_end = min(last, first + step * (self._max_records - 1))
+                        chunks.append(BackfillChunk(first, chunk_end, period))
+                        first = chunk_end + step
+        return sorted(chunks, key=lambda chunk: chunk.start)
+
+    async def run(self, chunks: list[BackfillChunk]) -> BackfillProgress:
+        progress = BackfillProgress(len(chunks), sum(chunk.records for chunk in chunks))
+        queue: asyncio.Queue[BackfillChunk] = asyncio.Queue()
+        for chunk in chunks:
+            queue.put_nowait(chunk)
+
+        async def worker() -> None:
+            while not queue.empty():
+                chunk = queue.get_nowait()
+                try:
+                    await self._backfill_chunk(chunk, progress)
+                except Exception as exc:  # noqa: BLE001
+                    progress.chunks_failed += 1
+                    ERRORS.inc("backfill")
+                    log("backfill.chunk_error", start_ts=chunk.start, end_ts=chunk.end, error=str(exc))
+                progress.chunks_done += 1
+                if self._on_progress is not None:
+                    self._on_progress(progress)
+
+        await asyncio.gather(*(worker() for _ in range(min(self._concurrency, len(chunks)))))
+        return progress
+
+    async def _backfill_chunk(self, chunk: BackfillChunk, progress: BackfillProgress) -> None:
+        params = {"id": self._emdata_id, "ts": int(chunk.start.timestamp()), "end_ts": int(chunk.end.timestamp())}
+        for attempt in range(self._retries + 1):
+            try:
+                payload = await self._rpc.get_emdata_data(params)
+                break
+            except Exception:  # noqa: BLE001
+                if attempt == self._retries:
+                    raise
+                await asyncio.sleep(0.5 * 2**attempt)
+        intervals = [
+            i for i in parse_emdata_data(payload, self._device_id) if chunk.start <= i.start_ts <= chunk.end
+        ]
+        inserted = await insert_energy_intervals_bulk(
+            self._pool, self._device_id, chunk.period, [interval_row(i) for i in intervals]
+        )
+        # Every requested slot is checkpointed, including ones the device no longer has.
+        step = timedelta(seconds=chunk.period)
+        requested = [chunk.start + step * n for n in range(chunk.records)]
+        await upsert_backfill_checkpoint(self._pool, self._device_id, chunk.period, day_bitmaps(requested, chunk.period))
+        fetched = len({i.start_ts for i in intervals})
+        progress.records_fetched += fetched
+        progress.records_absent += chunk.records - fetched
+        progress.rows_inserted += inserted
+        INTERVALS_INGESTED.inc(amount=inserted)
+        ROWS_WRITTEN.inc("energy_intervals", amount=inserted)
@@ -0,0 +1,165 @@
+from __future__ import annotations
+
+import math
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Callable
+
+from psycopg_pool import AsyncConnectionPool
+
+from . import db
+from .ingest import PowerReading
+from .logger import log
+from .metrics import ERRORS
+from .tariffs import device_zone
+
+MINUTES_PER_WEEK = 7 * 1440
+
+
+@dataclass
+class _Profile:
+    timezone: str | None
+    mean: array
+    var: array
+    weight: array
+    # Sum of the bucket occurrence currently being observed, folded in when the next one starts.
+    occurrence: int | None = None
+    index: int = 0
+    pending_sum: float = 0.0
+    pending_count: int = 0
+    dirty: bool = False
+
+
+class BaselineTracker:
+    # Expected load per local time-of-week bucket. Each bucket holds an exponentially weighted
+    # mean/variance of its per-occurrence average, so every sample costs one array lookup and
+    # the profile for a device is three flat arrays (672 slots at 15 minutes).
+
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        bucket_minutes: int = 15,
+        alpha: float = 0.1,
+        min_weeks: int = 3,
+        min_std_w: float = 100.0,
+        checkpoint_seconds: float = 900.0,
+    ) -> None:
+        if MINUTES_PER_WEEK % bucket_minutes:
+            raise ValueError("BASELINE_BUCKET_MINUTES must divide a week evenly")
+        self._pool = pool
+        self._bucket_minutes = bucket_minutes
+        self._buckets = MINUTES_PER_WEEK // bucket_minutes
+        self._alpha = alpha
+        self._min_weeks = min_weeks
+        self._min_std_w = min_std_w
+        self._checkpoint_seconds = checkpoint_seconds
+        self._last_checkpoint = time.monotonic()
+        self._profiles: dict[str, _Profile] = {}
+        self._zscore: float | None = None
+        self._excess_w: float | None = None
+
+    def _empty(self, timezone_name: str | None) -> _Profile:
+        zeros = array("d", [0.0]) * self._buckets
+        return _Profile(timezone_name, array("d", zeros), array("d", zeros), array("l", [0]) * self._buckets)
+
+    def metrics(self) -> dict[str, Callable[[PowerReading], float | None]]:
+        return {"baseline_zscore": self.zscore, "baseline_excess_w": self.excess_w}
+
+    async def _profile(self, device_id: str, timezone_name: str | None, load: bool) -> _Profile | None:
+        profile = self._profiles.get(device_id)
+        if profile is None:
+            if not load:
+                return None
+            try:
+                row = await db.fetch_baseline_profile(self._pool, device_id)
+            except Exception as exc:  # noqa: BLE001
+                # Retried on the next sample; starting empty would overwrite the checkpoint.
+                ERRORS.inc("baseline")
+                log("baseline.load_error", device_id=device_id, error=str(exc))
+                return None
+            profile = self._empty(timezone_name)
+            if row is not None and row[0] == self._bucket_minutes and len(row[1]) == self._buckets:
+                profile.mean = array("d", row[1])
+                profile.var = array("d", row[2])
+                profile.weight = array("l", row[3])
+            self._profiles[device_id] = profile
+        profile.timezone = timezone_name
+        return profile
+
+    async def observe(self, reading: PowerReading, timezone_name: str | None, load: bool = True) -> None:
+        # load=False (database down) skips devices whose checkpoint has not been read yet.
+        self._zscore = None
+        self._excess_w = None
+        value = reading.total_power_w
+        if value is None or reading.device_id is None:
+            return
+        profile = await self._profile(reading.device_id, timezone_name, load)
+        if profile is None:
+            return
+        local = reading.ts.astimezone(device_zone(profile.timezone))
+        minute_of_week = local.weekday() * 1440 + local.hour * 60 + local.minute
+        index = minute_of_week // self._bucket_minutes
+        occurrence = int(reading.ts.timestamp()) // (self._bucket_minutes * 60)
+
+        if profile.occurrence != occurrence:
+            self._fold(profile)
+            profile.occurrence = occurrence
+            profile.index = index
+            profile.pending_sum = 0.0
+            profile.pending_count = 0
+        profile.pending_sum += value
+        profile.pending_count += 1
+
+        if profile.weight[index] < self._min_weeks:
+            return
+        mean = profile.mean[index]
+        std = max(math.sqrt(profile.var[index]), self._min_std_w)
+        self._excess_w = value - mean
+        self._zscore = self._excess_w / std
+
+    def _fold(self, profile: _Profile) -> None:
+        if not profile.pending_count:
+            return
+        index = profile.index
+        x = profile.pending_sum / profile.pending_count
+        if profile.weight[index] == 0:
+            profile.mean[index] = x
+            profile.var[index] = 0.0
+        else:
+            # Incremental exponentially weighted mean and variance.
+            diff = x - profile.mean[index]
+            incr = self._alpha * diff
+            profile.mean[index] += incr
+            profile.var[index] = (1.0 - self._alpha) * (profile.var[index] + diff * incr)
+        profile.weight[index] += 1
+        profile.dirty = True
+
+    def zscore(self, reading: PowerReading) -> float | None:
+        return self._zscore
+
+    def excess_w(self, reading: PowerReading) -> float | None:
+        return self._excess_w
+
+    async def checkpoint(self, force: bool = False) -> None:
+        if not force and time.monotonic() - self._last_checkpoint < self._checkpoint_seconds:
+            return
+        self._last_checkpoint = time.monotonic()
+        for device_id, profile in self._profiles.items():
+            if not profile.dirty:
+                continue
+            try:
+                await db.upsert_baseline_profile(
+                    self._pool,
+                    device_id,
+                    self._bucket_minutes,
+                    profile.timezone,
+                    list(profile.mean),
+                    list(profile.var),
+                    list(profile.weight),
+                )
+            except Exception as exc:  # noqa: BLE001
+                ERRORS.inc("baseline")
+                log("baseline.checkpoint_error", device_id=device_id, error=str(exc))
+                continue
+            profile.dirty = False
@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from psycopg_pool import AsyncConnectionPool
+
+from .db import fetch_energy_fingerprint, fetch_energy_rows, fetch_tariff_definition, find_tariff_ids
+from .tariffs import CompiledTariff, TariffCost, build_load_matrix
+
+_SHAPE_VERSION = 3
+
+
+@dataclass
+class LoadShape:
+    device_id: str
+    channel: int
+    start_ts: datetime
+    end_ts: datetime
+    bucket_seconds: int
+    epochs: array
+    energy_wh: array
+
+
+def _shape_path(cache_dir: str, device_id: str, channel: int, hourly: bool) -> Path:
+    # One file per device/channel/resolution; a different range overwrites it, so the cache stays bounded.
+    key = f"{device_id}|{channel}|{int(hourly)}"
+    return Path(cache_dir) / f"shape-{hashlib.sha1(key.encode()).hexdigest()[:16]}.bin"
+
+
+def _read_shape(path: Path, fingerprint: list[Any]) -> tuple[array, array] | None:
+    try:
+        with path.open("rb") as fh:
+            header = json.loads(fh.readline())
+            if header.get("version") != _SHAPE_VERSION or header.get("fingerprint") != fingerprint:
+                return None
+            epochs = array("q")
+            energy_wh = array("d")
+            epochs.frombytes(fh.read(header["count"] * epochs.itemsize))
+            energy_wh.frombytes(fh.read(header["count"] * energy_wh.itemsize))
+    except (OSError, ValueError, KeyError):
+        return None
+    if len(epochs) != header["count"] or len(energy_wh) != header["count"]:
+        return None
+    return epochs, energy_wh
+
+
+def _write_shape(path: Path, fingerprint: list[Any], epochs: array, energy_wh: array) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    header = {"version": _SHAPE_VERSION, "fingerprint": fingerprint, "count": len(epochs)}
+    with tmp.open("wb") as fh:
+        fh.write(json.dumps(header).encode() + b"\n")
+        fh.write(epochs.tobytes())
+        fh.write(energy_wh.tobytes())
+    os.replace(tmp, path)
+
+
+async def load_shape(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    channel: int,
+    start_ts: datetime,
+    end_ts: datetime,
+    hourly: bool = True,
+    cache_dir: str | None = None,
+) -> LoadShape:
+    bucket_seconds = 3600 if hourly else 60
+    cached = None
+    path = None
+    fingerprint: list[Any] = []
+    if cache_dir:
+        # Detects late or backfilled intervals inside a memoized range (see fetch_energy_fingerprint).
+        fingerprint = [
+            start_ts.isoformat(),
+            end_ts.isoformat(),
+            *await fetch_energy_fingerprint(pool, device_id, channel, start_ts, end_ts, hourly),
+        ]
+        path = _shape_path(cache_dir, device_id, channel, hourly)
+        cached = await asyncio.to_thread(_read_shape, path, fingerprint)
+    if cached is not None:
+        epochs, energy_wh = cached
+    else:
+        rows = await fetch_energy_rows(pool, device_id, channel, start_ts, end_ts, hourly)
+        epochs = array("q", (int(row[0].timestamp()) for row in rows))
+        energy_wh = array("d", (row[1] or 0.0 for row in rows))
+        if path is not None:
+            await asyncio.to_thread(_write_shape, path, fingerprint, epochs, energy_wh)
+    return LoadShape(device_id, channel, start_ts, end_ts, bucket_seconds, epochs, energy_wh)
+
+
+def _price(
+    matrix: dict[int, array],
+    definitions: list[dict[str, list[tuple[Any, ...]]]],
+    start_ts: datetime,
+    end_ts: datetime,
+) -> list[TariffCost]:
+    return [CompiledTariff(d).cost_matrix(matrix, start_ts, end_ts) for d in definitions]
+
+
+class PricingPool:
+    # One spawn-context process pool, created on first use and reused by every comparison; spawn
+    # avoids forking the running event loop and its open sockets.
+
+    def __init__(self, workers: int | None = None) -> None:
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self._executor: ProcessPoolExecutor | None = None
+
+    async def run(
+        self,
+        tasks: list[tuple[dict[int, array], list[dict[str, list[tuple[Any, ...]]]]]],
+        start_ts: datetime,
+        end_ts: datetime,
+    ) -> list[list[TariffCost]]:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.gather(
+                *(loop.run_in_executor(self._executor, _price, m, d, start_ts, end_ts) for m, d in tasks)
+            )
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool next time.
+            self.close()
+            raise
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+async def compare_tariffs(
+    pool: AsyncConnectionPool,
+    shape: LoadShape,
+    tariff_names: list[str] | None = None,
+    workers: int | None = None,
+    pricing: PricingPool | None = None,
+) -> list[TariffCost]:
+    definitions = []
+    for tariff_id, _ in await find_tariff_ids(pool, tariff_names):
+        definition = await fetch_tariff_definition(pool, tariff_id)
+        if definition is not None:
+            definitions.append(definition)
+    if not definitions:
+        return []
+
+    # The load is laid out once per tariff timezone as local-day x minute-of-day rows; every
+    # tariff in that timezone is then priced against the same matrix.
+    by_timezone: dict[str, list[dict[str, list[tuple[Any, ...]]]]] = {}
+    for definition in definitions:
+        by_timezone.setdefault(CompiledTariff(definition).timezone, []).append(definition)
+
+    def build_matrices() -> dict[str, dict[int, array]]:
+        return {
+            tz: build_load_matrix(shape.epochs, shape.energy_wh, shape.bucket_seconds, tz) for tz in by_timezone
+        }
+
+    matrices = await asyncio.to_thread(build_matrices)
+    workers = max(1, min(len(definitions), pricing.workers if pricing else workers or os.cpu_count() or 1))
+    if workers == 1:
+        results = await asyncio.to_thread(
+            lambda: [
+                cost
+                for tz, group in by_timezone.items()
+                for cost in _price(matrices[tz], group, shape.start_ts, shape.end_ts)
+            ]
+        )
+        return sorted(results, key=lambda cost: cost.total)
+
+    # Each task carries one matrix and a batch of that timezone's tariffs, so a matrix is pickled
+    # at most once per worker rather than once per tariff.
+    tasks = []
+    for tz, group in by_timezone.items():
+        batches = min(len(group), workers)
+        tasks.extend((matrices[tz], group[i::batches]) for i in range(batches))
+    owned = pricing is None
+    pricing = pricing or PricingPool(workers)
+    try:
+        batches_out = await pricing.run(tasks, shape.start_ts, shape.end_ts)
+    finally:
+        if owned:
+            pricing.close()
+    return sorted((cost for batch in batches_out for cost in batch), key=lambda cost: cost.total)
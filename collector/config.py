@@ -17,25 +17,76 @@ class Settings(BaseSettings):
     EMDATA_LOOKBACK_RECORDS: int = 720
     EMDATA_MAX_RECORDS: int = 500
     EMDATA_MAX_CHUNKS_PER_POLL: int = 4
+    # Gap filler: re-fetch records missing from energy_intervals while the device still has them, oldest first
+    GAP_FILL_ENABLED: bool = True
+    GAP_FILL_SECONDS: int = 900
+    GAP_FILL_MAX_CHUNKS: int = 8
 
     # Database
     DATABASE_URL: str
+    DATABASE_TIMEOUT_SECONDS: float = 10
+
+    # Local spool (store-and-forward while Postgres is unavailable)
+    SPOOL_PATH: str | None = None
+    SPOOL_MODE: str = "fallback"
+    SPOOL_MAX_RECORDS: int = 200000
+    SPOOL_FLUSH_SECONDS: float = 5
+    SPOOL_REPLAY_BATCH: int = 500
+    SPOOL_REPLAY_ROWS_PER_SECOND: int = 1000
 
     # Alerts
     ALERT_POWER_W: float = 4500
     ALERT_SUSTAIN_SECONDS: int = 120
     ALERT_COOLDOWN_SECONDS: int = 900
     ALERT_TRIGGER_SECONDS: int = 15
+    # Extra rules as a JSON list, e.g. [{"name": "SAG_A", "metric": "phase_a_voltage_v", "op": "<=", "threshold": 207}]
+    ALERT_RULES: str | None = None
+    ALERT_STATE_PERSIST_SECONDS: float = 30
 
     # HTTP trigger (Homebridge HTTP accessory)
     TRIGGER_HTTP_URL: str | None = None
     TRIGGER_HTTP_ON_URL: str | None = None
     TRIGGER_HTTP_OFF_URL: str | None = None
     TRIGGER_HTTP_METHOD: str = "POST"
+    TRIGGER_MAX_CONCURRENCY: int = 4
+    TRIGGER_RETRIES: int = 3
 
     # Service
     HEALTHZ_PORT: int = 8080
     TEST_TRIGGER_TOKEN: str | None = None
+    DEBUG_TOKEN: str | None = None
+    DEBUG_TRACEMALLOC_FRAMES: int = 10
+    LOOP_LAG_SAMPLE_SECONDS: float = 0.5
+    API_CACHE_ENTRIES: int = 256
+    API_MAX_POINTS: int = 2000
+    STREAM_QUEUE_SIZE: int = 32
+    STREAM_MAX_CLIENTS: int = 500
+    TARIFF_SHAPE_CACHE_DIR: str | None = None
+    TARIFF_COMPARE_WORKERS: int | None = None
+    LOG_LEVEL: str = "info"
+    LOG_SUPPRESS_SECONDS: float = 60.0
+    LOG_FLUSH_SECONDS: float = 0.2
+    LOG_QUEUE_SIZE: int = 10000
+
+    # Peak demand (rolling window averages over the total channel, minutes, comma-separated)
+    DEMAND_WINDOWS: str | None = "15,30,60"
+    DEMAND_TOP_N: int = 5
+    DEMAND_LIMIT_KW: float | None = None
+
+    # Cost accrual (prices ingested intervals with the device's tariff from device_tariffs)
+    COSTS_ENABLED: bool = True
+    COSTS_REFRESH_MAX_DAYS: int = 31
+
+    # Load baseline (time-of-week expected load; anomaly rule fires on the z-score when threshold is set)
+    BASELINE_ENABLED: bool = True
+    BASELINE_BUCKET_MINUTES: int = 15
+    BASELINE_ALPHA: float = 0.1
+    BASELINE_MIN_WEEKS: int = 3
+    BASELINE_MIN_STD_W: float = 100.0
+    BASELINE_CHECKPOINT_SECONDS: int = 900
+    BASELINE_ANOMALY_Z: float | None = None
+    BASELINE_ANOMALY_SUSTAIN_SECONDS: int = 1800
+    BASELINE_ANOMALY_TRIGGER: bool = False
 
     # Retention
     RETENTION_RUN_SECONDS: int = 3600
@@ -46,6 +97,12 @@ class Settings(BaseSettings):
     RETENTION_INTERVAL_RAW_MAX_DAYS: int | None = None
     RETENTION_MAX_DB_MB: int | None = None
     RETENTION_PRUNE_INCLUDE_INTERVALS: bool = False
+    ARCHIVE_DIR: str | None = None
+
+    # Rollup pyramid ("level[:retention_days]", comma-separated, coarser levels built from finer ones)
+    ROLLUP_RUN_SECONDS: int = 300
+    ROLLUP_POWER_LEVELS: str | None = "15m,1h,1d"
+    ROLLUP_ENERGY_LEVELS: str | None = "1d,1mo"
 
     @property
     def shelly_base_url(self) -> str:
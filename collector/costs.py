@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from psycopg_pool import AsyncConnectionPool
+
+from . import db
+from .logger import log
+from .tariffs import TariffCache, TariffCost, device_zone
+
+COST_CHANNEL = 3
+
+
+def _day_bounds(day: date, zone: ZoneInfo) -> tuple[datetime, datetime]:
+    start = datetime.combine(day, time(), zone).astimezone(timezone.utc)
+    end = datetime.combine(day + timedelta(days=1), time(), zone).astimezone(timezone.utc)
+    return start, end
+
+
+def _active_tariff(assignments: list[tuple[int, date, date | None]], day: date) -> int | None:
+    # Assignments are newest first; the latest one starting on or before the day wins.
+    for tariff_id, valid_from, valid_to in assignments:
+        if valid_from <= day and (valid_to is None or day <= valid_to):
+            return tariff_id
+    return None
+
+
+class CostAccrual:
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        cache: TariffCache | None = None,
+        channel: int = COST_CHANNEL,
+    ) -> None:
+        self._pool = pool
+        self._cache = cache or TariffCache()
+        self._channel = channel
+
+    async def accrue(
+        self,
+        device_id: str,
+        timezone_name: str | None,
+        start_ts: datetime,
+        end_ts: datetime,
+    ) -> int:
+        # Whole device-local days touched by [start_ts, end_ts) are repriced from the 1-minute
+        # intervals, so late or corrected intervals inside a day are always picked up.
+        if end_ts <= start_ts:
+            return 0
+        zone = device_zone(timezone_name)
+        first_day = start_ts.astimezone(zone).date()
+        last_day = (end_ts - timedelta(microseconds=1)).astimezone(zone).date()
+        assignments = await db.fetch_device_tariffs(self._pool, device_id, first_day, last_day)
+        months: set[date] = set()
+        day = first_day
+        priced = 0
+        while day <= last_day:
+            if await self._price_day(device_id, zone, day, _active_tariff(assignments, day)):
+                priced += 1
+            months.add(day.replace(day=1))
+            day += timedelta(days=1)
+        for month in sorted(months):
+            await db.refresh_energy_costs_month(self._pool, device_id, month)
+        return priced
+
+    async def _price_day(self, device_id: str, zone: ZoneInfo, day: date, tariff_id: int | None) -> bool:
+        day_start, day_end = _day_bounds(day, zone)
+        tariff = await self._cache.get(self._pool, tariff_id) if tariff_id is not None else None
+        if tariff is None:
+            await db.replace_energy_costs_day(self._pool, device_id, day, day_start, day_end, None, [])
+            return False
+
+        rows = await db.fetch_energy_rows(self._pool, device_id, self._channel, day_start, day_end)
+        epochs = [int(row[0].timestamp()) for row in rows]
+        energy_wh = [row[1] or 0.0 for row in rows]
+        costs, unpriced_kwh = tariff.price_epochs(epochs, energy_wh, 60)
+
+        # Hours are counted from local midnight, not the UTC hour: in half-hour-offset zones a UTC
+        # hour would straddle two local days and fall outside replace_energy_costs_day's range.
+        origin = int(day_start.timestamp())
+        hours: dict[tuple[int, str], list[float]] = {}
+        for component, column in zip(tariff.energy_components, costs):
+            for epoch, wh, cost in zip(epochs, energy_wh, column):
+                acc = hours.setdefault((epoch - (epoch - origin) % 3600, component.name), [0.0, 0.0])
+                acc[0] += wh
+                acc[1] += cost
+        hourly = [
+            (datetime.fromtimestamp(hour, tz=timezone.utc), name, wh, cost)
+            for (hour, name), (wh, cost) in sorted(hours.items())
+        ]
+
+        result = TariffCost(tariff_id=tariff.id, name=tariff.name, currency=tariff.currency)
+        result.energy_kwh = sum(energy_wh) / 1000.0
+        result.unpriced_kwh = unpriced_kwh
+        for component, column in zip(tariff.energy_components, costs):
+            result.components[component.name] = sum(column)
+        # Day/month fees and percentage components are prorated to the local day.
+        tariff.add_period_charges(result, day_start, day_end)
+
+        daily = {
+            "timezone": zone.key,
+            "tariff_id": tariff.id,
+            "tariff_revision": tariff.revision,
+            "currency": tariff.currency,
+            "energy_wh": sum(energy_wh),
+            "cost": result.total,
+            "components": result.components,
+        }
+        await db.replace_energy_costs_day(self._pool, device_id, day, day_start, day_end, daily, hourly)
+        return True
+
+    async def refresh(self, max_days: int = 31) -> int:
+        # Reprices days whose tariff was edited (tariffs.revision) or reassigned (device_tariffs), and
+        # prices days that got an assignment only after their consumption was ingested.
+        stale = await db.fetch_stale_cost_days(self._pool, self._channel, max(1, int(max_days)))
+        for device_id, day, timezone_name in stale:
+            zone = device_zone(timezone_name)
+            day_start, day_end = _day_bounds(day, zone)
+            await self.accrue(device_id, timezone_name, day_start, day_end)
+        if stale:
+            log("costs.refreshed", days=len(stale))
+        return len(stale)
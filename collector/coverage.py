@@ -0,0 +1,78 @@
+from __future__ import annotations
+
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable
+
+# One bitmap per device, EMData period and UTC day, one bit per record slot ('1' = stored). Stored as
+# varbit so write-time updates are a plain `bits | new` in SQL; 1-minute records take 180 bytes a day.
+
+SET = ord("1")
+
+
+def slot_count(period: int) -> int:
+    return 86400 // period
+
+
+def day_bitmaps(starts: Iterable[datetime], period: int) -> dict[date, str]:
+    slots = slot_count(period)
+    days: dict[date, bytearray] = {}
+    for ts in starts:
+        ts = ts.astimezone(timezone.utc)
+        bits = days.get(ts.date())
+        if bits is None:
+            bits = days[ts.date()] = bytearray(b"0" * slots)
+        bits[(ts.hour * 3600 + ts.minute * 60 + ts.second) // period] = SET
+    return {day: bits.decode() for day, bits in days.items()}
+
+
+def missing_ranges(
+    bitmaps: dict[date, str],
+    start: datetime,
+    end: datetime,
+    period: int,
+) -> list[tuple[datetime, datetime]]:
+    # Runs of absent record starts within [start, end], inclusive on both ends; a day without a
+    # bitmap counts as entirely missing.
+    slots = slot_count(period)
+    step = timedelta(seconds=period)
+    start = start.astimezone(timezone.utc)
+    end = end.astimezone(timezone.utc)
+    ranges: list[tuple[datetime, datetime]] = []
+    day = start.date()
+    while day <= end.date():
+        midnight = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+        lo = 0 if day > start.date() else int((start - midnight).total_seconds()) // period
+        hi = slots - 1 if day < end.date() else int((end - midnight).total_seconds()) // period
+        bits = bitmaps.get(day) or "0" * slots
+        i = lo
+        while i <= hi:
+            i = bits.find("0", i, hi + 1)
+            if i < 0:
+                break
+            j = bits.find("1", i, hi + 1)
+            if j < 0:
+                j = hi + 1
+            first = midnight + step * i
+            last = midnight + step * (j - 1)
+            if ranges and ranges[-1][1] + step == first:
+                ranges[-1] = (ranges[-1][0], last)
+            else:
+                ranges.append((first, last))
+            i = j
+        day += timedelta(days=1)
+    return ranges
+
+
+def range_records(first: datetime, last: datetime, period: int) -> int:
+    return int((last - first).total_seconds()) // period + 1
+
+
+def merge_bitmaps(left: dict[date, str], right: dict[date, str]) -> dict[date, str]:
+    merged = dict(left)
+    for day, bits in right.items():
+        current = merged.get(day)
+        if current is None or len(current) != len(bits):
+            merged[day] = bits
+        else:
+            merged[day] = "".join("1" if a == "1" or b == "1" else "0" for a, b in zip(current, bits))
+    return merged
@@ -1,12 +1,33 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from datetime import datetime, timedelta
-from typing import Any
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable
 
+from psycopg import AsyncCursor
 from psycopg_pool import AsyncConnectionPool
 from psycopg.types.json import Jsonb
 
+from .coverage import day_bitmaps
+from .metrics import db_timed
+from .rollups import RollupLevel, choose_level
+
+POWER_READINGS_1M_ROLLUP = "power_readings_1m"
+ENERGY_INTERVALS_1H_ROLLUP = "energy_intervals_1h"
+
+_POWER_AVG_COLUMNS = (
+    "avg_total_power_w",
+    "avg_phase_a_power_w",
+    "avg_phase_b_power_w",
+    "avg_phase_c_power_w",
+    "avg_phase_a_voltage_v",
+    "avg_phase_b_voltage_v",
+    "avg_phase_c_voltage_v",
+    "avg_phase_a_current_a",
+    "avg_phase_b_current_a",
+    "avg_phase_c_current_a",
+)
+
 
 @dataclass
 class AlertState:
@@ -15,8 +36,18 @@ class AlertState:
     cooldown_until_ts: datetime | None
 
 
-def create_pool(database_url: str) -> AsyncConnectionPool:
-    return AsyncConnectionPool(conninfo=database_url, open=False)
+def create_pool(
+    database_url: str,
+    timeout_seconds: float = 30.0,
+    max_size: int | None = None,
+) -> AsyncConnectionPool:
+    return AsyncConnectionPool(
+        conninfo=database_url,
+        open=False,
+        timeout=timeout_seconds,
+        min_size=min(4, max_size or 4),
+        max_size=max_size,
+    )
 
 
 def _to_jsonb(value: Any) -> Any:
@@ -25,6 +56,7 @@ def _to_jsonb(value: Any) -> Any:
     return value
 
 
+@db_timed
 async def upsert_device_settings(
     pool: AsyncConnectionPool,
     device_id: str,
@@ -55,13 +87,104 @@ async def upsert_device_settings(
             await cur.execute(query, params)
 
 
+def _rollup_cutoff(older_than: timedelta, bucket_seconds: int) -> datetime:
+    cutoff = datetime.now(timezone.utc) - older_than
+    epoch = int(cutoff.timestamp())
+    return datetime.fromtimestamp(epoch - (epoch % bucket_seconds), tz=timezone.utc)
+
+
+async def _advance_rollup_watermarks(
+    cur: AsyncCursor,
+    rollup: str,
+    device_ids: set[str],
+    cutoff: datetime,
+) -> None:
+    await cur.execute(
+        """
+        UPDATE rollup_watermarks
+        SET watermark_ts = %(cutoff)s, updated_ts = now()
+        WHERE rollup = %(rollup)s AND watermark_ts < %(cutoff)s
+        """,
+        {"rollup": rollup, "cutoff": cutoff},
+    )
+    if device_ids:
+        await cur.execute(
+            """
+            INSERT INTO rollup_watermarks (rollup, device_id, watermark_ts, updated_ts)
+            SELECT %(rollup)s, d, %(cutoff)s, now()
+            FROM unnest(%(device_ids)s::text[]) AS d
+            ON CONFLICT (rollup, device_id) DO NOTHING
+            """,
+            {"rollup": rollup, "cutoff": cutoff, "device_ids": sorted(device_ids)},
+        )
+
+
+@db_timed
+async def get_rollup_watermarks(pool: AsyncConnectionPool, rollup: str) -> dict[str, datetime]:
+    query = """
+        SELECT device_id, watermark_ts
+        FROM rollup_watermarks
+        WHERE rollup = %(rollup)s
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, {"rollup": rollup})
+            return {row[0]: row[1] for row in await cur.fetchall()}
+
+
+@db_timed
+async def rewind_rollup_watermark(
+    pool: AsyncConnectionPool,
+    rollup: str,
+    since_ts: datetime,
+    device_id: str | None = None,
+) -> int:
+    return await rewind_rollup_watermarks(pool, [rollup], since_ts, device_id)
+
+
+@db_timed
+async def rewind_rollup_watermarks(
+    pool: AsyncConnectionPool,
+    rollups: list[str],
+    since_ts: datetime,
+    device_id: str | None = None,
+) -> int:
+    if not rollups:
+        return 0
+    query = """
+        UPDATE rollup_watermarks
+        SET watermark_ts = %(since_ts)s, updated_ts = now()
+        WHERE rollup = ANY(%(rollups)s)
+          AND watermark_ts > %(since_ts)s
+          AND (%(device_id)s::text IS NULL OR device_id = %(device_id)s)
+    """
+    params = {"rollups": list(rollups), "since_ts": since_ts, "device_id": device_id}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return cur.rowcount or 0
+
+
+@db_timed
 async def downsample_power_readings(
     pool: AsyncConnectionPool,
     older_than_hours: int,
     bucket_seconds: int,
 ) -> int:
+    # No global lower bound: a device without a watermark is rolled up from its first reading, and
+    # delete_power_readings_older_than keeps raw rows below each device's watermark from piling up.
     bucket_seconds = max(60, int(bucket_seconds))
+    cutoff = _rollup_cutoff(timedelta(hours=older_than_hours), bucket_seconds)
     query = """
+        WITH marks AS (
+            SELECT
+                device_id,
+                (timestamptz 'epoch'
+                 + floor(extract(epoch from watermark_ts) / %(bucket_seconds)s)
+                 * %(bucket_seconds)s * interval '1 second') AS watermark_ts
+            FROM rollup_watermarks
+            WHERE rollup = %(rollup)s
+        )
         INSERT INTO power_readings_1m (
             ts_minute,
             device_id,
@@ -79,31 +202,49 @@ async def downsample_power_readings(
         )
         SELECT
             (timestamptz 'epoch'
-             + floor(extract(epoch from ts) / %(bucket_seconds)s)
+             + floor(extract(epoch from pr.ts) / %(bucket_seconds)s)
              * %(bucket_seconds)s * interval '1 second') AS ts_minute,
-            COALESCE(device_id, 'unknown') AS device_id,
-            avg(total_power_w),
-            avg(phase_a_power_w),
-            avg(phase_b_power_w),
-            avg(phase_c_power_w),
-            avg(phase_a_voltage_v),
-            avg(phase_b_voltage_v),
-            avg(phase_c_voltage_v),
-            avg(phase_a_current_a),
-            avg(phase_b_current_a),
-            avg(phase_c_current_a),
+            COALESCE(pr.device_id, 'unknown') AS device_id,
+            avg(pr.total_power_w),
+            avg(pr.phase_a_power_w),
+            avg(pr.phase_b_power_w),
+            avg(pr.phase_c_power_w),
+            avg(pr.phase_a_voltage_v),
+            avg(pr.phase_b_voltage_v),
+            avg(pr.phase_c_voltage_v),
+            avg(pr.phase_a_current_a),
+            avg(pr.phase_b_current_a),
+            avg(pr.phase_c_current_a),
             count(*)
-        FROM power_readings
-        WHERE ts < (now() AT TIME ZONE 'utc') - (%(hours)s || ' hours')::interval
+        FROM power_readings pr
+        LEFT JOIN marks m ON m.device_id = COALESCE(pr.device_id, 'unknown')
+        WHERE pr.ts < %(cutoff)s
+          AND (m.watermark_ts IS NULL OR pr.ts >= m.watermark_ts)
         GROUP BY 1, 2
-        ON CONFLICT (device_id, ts_minute) DO NOTHING
+        ON CONFLICT (device_id, ts_minute) DO UPDATE SET
+            avg_total_power_w = EXCLUDED.avg_total_power_w,
+            avg_phase_a_power_w = EXCLUDED.avg_phase_a_power_w,
+            avg_phase_b_power_w = EXCLUDED.avg_phase_b_power_w,
+            avg_phase_c_power_w = EXCLUDED.avg_phase_c_power_w,
+            avg_phase_a_voltage_v = EXCLUDED.avg_phase_a_voltage_v,
+            avg_phase_b_voltage_v = EXCLUDED.avg_phase_b_voltage_v,
+            avg_phase_c_voltage_v = EXCLUDED.avg_phase_c_voltage_v,
+            avg_phase_a_current_a = EXCLUDED.avg_phase_a_current_a,
+            avg_phase_b_current_a = EXCLUDED.avg_phase_b_current_a,
+            avg_phase_c_current_a = EXCLUDED.avg_phase_c_current_a,
+            samples = EXCLUDED.samples
+        RETURNING device_id
     """
+    params = {"rollup": POWER_READINGS_1M_ROLLUP, "cutoff": cutoff, "bucket_seconds": bucket_seconds}
     async with pool.connection() as conn:
         async with conn.cursor() as cur:
-            await cur.execute(query, {"hours": older_than_hours, "bucket_seconds": bucket_seconds})
-            return cur.rowcount or 0
+            await cur.execute(query, params)
+            rows = await cur.fetchall()
+            await _advance_rollup_watermarks(cur, POWER_READINGS_1M_ROLLUP, {row[0] for row in rows}, cutoff)
+            return len(rows)
 
 
+@db_timed
 async def upsert_power_readings_1m_range(
     pool: AsyncConnectionPool,
     start_ts: datetime,
@@ -166,17 +307,26 @@ async def upsert_power_readings_1m_range(
             return cur.rowcount or 0
 
 
+@db_timed
 async def delete_power_readings_older_than(pool: AsyncConnectionPool, older_than_hours: int) -> int:
+    # Each device's rows are only deleted below its own watermark; a device without one is not rolled up yet.
     query = """
-        DELETE FROM power_readings
-        WHERE ts < (now() AT TIME ZONE 'utc') - (%(hours)s || ' hours')::interval
+        DELETE FROM power_readings pr
+        USING rollup_watermarks w
+        WHERE w.rollup = %(rollup)s
+          AND (pr.device_id = w.device_id OR (pr.device_id IS NULL AND w.device_id = 'unknown'))
+          AND pr.ts < LEAST(
+              (now() AT TIME ZONE 'utc') - (%(hours)s || ' hours')::interval,
+              w.watermark_ts
+          )
     """
     async with pool.connection() as conn:
         async with conn.cursor() as cur:
-            await cur.execute(query, {"hours": older_than_hours})
+            await cur.execute(query, {"hours": older_than_hours, "rollup": POWER_READINGS_1M_ROLLUP})
             return cur.rowcount or 0
 
 
+@db_timed
 async def delete_power_readings_1m_older_than(pool: AsyncConnectionPool, older_than_days: int) -> int:
     query = """
         DELETE FROM power_readings_1m
@@ -188,13 +338,24 @@ async def delete_power_readings_1m_older_than(pool: AsyncConnectionPool, older_t
             return cur.rowcount or 0
 
 
+@db_timed
 async def downsample_energy_intervals(
     pool: AsyncConnectionPool,
     older_than_days: int,
     bucket_seconds: int,
 ) -> int:
     bucket_seconds = max(3600, int(bucket_seconds))
+    cutoff = _rollup_cutoff(timedelta(days=older_than_days), bucket_seconds)
     query = """
+        WITH marks AS (
+            SELECT
+                device_id,
+                (timestamptz 'epoch'
+                 + floor(extract(epoch from watermark_ts) / %(bucket_seconds)s)
+                 * %(bucket_seconds)s * interval '1 second') AS watermark_ts
+            FROM rollup_watermarks
+            WHERE rollup = %(rollup)s
+        )
         INSERT INTO energy_intervals_1h (
             ts_hour,
             device_id,
@@ -205,24 +366,35 @@ async def downsample_energy_intervals(
         )
         SELECT
             (timestamptz 'epoch'
-             + floor(extract(epoch from start_ts) / %(bucket_seconds)s)
+             + floor(extract(epoch from ei.start_ts) / %(bucket_seconds)s)
              * %(bucket_seconds)s * interval '1 second') AS ts_hour,
-            COALESCE(device_id, 'unknown') AS device_id,
-            channel,
-            sum(energy_wh) AS energy_wh,
-            sum(energy_wh) * 3600.0 / %(bucket_seconds)s AS avg_power_w,
+            COALESCE(ei.device_id, 'unknown') AS device_id,
+            ei.channel,
+            sum(ei.energy_wh) AS energy_wh,
+            sum(ei.energy_wh) * 3600.0 / %(bucket_seconds)s AS avg_power_w,
             count(*) AS samples
-        FROM energy_intervals
-        WHERE start_ts < (now() AT TIME ZONE 'utc') - (%(days)s || ' days')::interval
+        FROM energy_intervals ei
+        LEFT JOIN marks m ON m.device_id = COALESCE(ei.device_id, 'unknown')
+        WHERE ei.start_ts >= COALESCE((SELECT min(watermark_ts) FROM marks), '-infinity')
+          AND ei.start_ts < %(cutoff)s
+          AND (m.watermark_ts IS NULL OR ei.start_ts >= m.watermark_ts)
         GROUP BY 1, 2, 3
-        ON CONFLICT (device_id, channel, ts_hour) DO NOTHING
+        ON CONFLICT (device_id, channel, ts_hour) DO UPDATE SET
+            energy_wh = EXCLUDED.energy_wh,
+            avg_power_w = EXCLUDED.avg_power_w,
+            samples = EXCLUDED.samples
+        RETURNING device_id
     """
+    params = {"rollup": ENERGY_INTERVALS_1H_ROLLUP, "cutoff": cutoff, "bucket_seconds": bucket_seconds}
     async with pool.connection() as conn:
         async with conn.cursor() as cur:
-            await cur.execute(query, {"days": older_than_days, "bucket_seconds": bucket_seconds})
-            return cur.rowcount or 0
+            await cur.execute(query, params)
+            rows = await cur.fetchall()
+            await _advance_rollup_watermarks(cur, ENERGY_INTERVALS_1H_ROLLUP, {row[0] for row in rows}, cutoff)
+            return len(rows)
 
 
+@db_timed
 async def upsert_energy_intervals_1h_range(
     pool: AsyncConnectionPool,
     start_ts: datetime,
@@ -263,6 +435,7 @@ async def upsert_energy_intervals_1h_range(
             return cur.rowcount or 0
 
 
+@db_timed
 async def get_database_size_bytes(pool: AsyncConnectionPool) -> int | None:
     query = "SELECT pg_database_size(current_database())"
     async with pool.connection() as conn:
@@ -274,10 +447,12 @@ async def get_database_size_bytes(pool: AsyncConnectionPool) -> int | None:
             return int(row[0])
 
 
+@db_timed
 async def prune_power_storage_by_size(
     pool: AsyncConnectionPool,
     max_bytes: int,
     include_intervals: bool = False,
+    archive_delete: Callable[[str, datetime], Awaitable[int]] | None = None,
 ) -> dict[str, int | None]:
     size = await get_database_size_bytes(pool)
     if size is None or size <= max_bytes:
@@ -372,14 +547,21 @@ async def prune_power_storage_by_size(
                 )
                 deleted_raw += cur.rowcount or 0
 
-            async with conn.cursor() as cur:
-                await cur.execute(
-                    "DELETE FROM power_readings_1m WHERE ts_minute < %(cutoff)s",
-                    {"cutoff": cutoff},
-                )
-                deleted_low += cur.rowcount or 0
+            # Archived tables are moved by archive_delete (archive + delete in its own transaction).
+            if archive_delete is not None:
+                deleted_low += await archive_delete("power_readings_1m", cutoff)
+                if include_intervals:
+                    deleted_intervals += await archive_delete("energy_intervals", cutoff)
+                    deleted_intervals += await archive_delete("energy_intervals_1h", cutoff)
+            else:
+                async with conn.cursor() as cur:
+                    await cur.execute(
+                        "DELETE FROM power_readings_1m WHERE ts_minute < %(cutoff)s",
+                        {"cutoff": cutoff},
+                    )
+                    deleted_low += cur.rowcount or 0
 
-            if include_intervals:
+            if include_intervals and archive_delete is None:
                 async with conn.cursor() as cur:
                     await cur.execute(
                         "DELETE FROM energy_intervals WHERE start_ts < %(cutoff)s",
@@ -405,6 +587,7 @@ async def prune_power_storage_by_size(
     }
 
 
+@db_timed
 async def delete_energy_intervals_older_than(pool: AsyncConnectionPool, older_than_days: int) -> int:
     query = """
         DELETE FROM energy_intervals
@@ -416,6 +599,7 @@ async def delete_energy_intervals_older_than(pool: AsyncConnectionPool, older_th
             return cur.rowcount or 0
 
 
+@db_timed
 async def delete_energy_intervals_1h_older_than(pool: AsyncConnectionPool, older_than_days: int) -> int:
     query = """
         DELETE FROM energy_intervals_1h
@@ -427,6 +611,650 @@ async def delete_energy_intervals_1h_older_than(pool: AsyncConnectionPool, older
             return cur.rowcount or 0
 
 
+def power_rollup_key(level: RollupLevel) -> str:
+    return f"power_rollups:{level.name}"
+
+
+def energy_rollup_key(level: RollupLevel) -> str:
+    return f"energy_rollups:{level.name}"
+
+
+def _rollup_window(ts_col: str, level: RollupLevel, by_range: bool) -> tuple[str, str, str]:
+    # (CTE, join, WHERE) selecting source rows: either past each device's watermark up to %(cutoff)s, or a
+    # plain [%(start_ts)s, %(end_ts)s) slice for rebuilds.
+    if by_range:
+        return "", "", f"{ts_col} >= %(start_ts)s AND {ts_col} < %(end_ts)s"
+    cte = f"""WITH marks AS (
+            SELECT device_id, {level.bucket_sql("watermark_ts")} AS watermark_ts
+            FROM rollup_watermarks
+            WHERE rollup = %(rollup)s
+        )"""
+    where = f"""{ts_col} >= COALESCE((SELECT min(watermark_ts) FROM marks), '-infinity')
+          AND {ts_col} < %(cutoff)s
+          AND (m.watermark_ts IS NULL OR {ts_col} >= m.watermark_ts)"""
+    return cte, "LEFT JOIN marks m ON m.device_id = s.device_id", where
+
+
+def _power_rollup_query(level: RollupLevel, source_is_base: bool, by_range: bool) -> str:
+    if source_is_base:
+        source_sql = "power_readings_1m s"
+        ts_col = "s.ts_minute"
+        level_filter = ""
+        min_col = max_col = "s.avg_total_power_w"
+    else:
+        source_sql = "power_rollups s"
+        ts_col = "s.ts_bucket"
+        level_filter = "AND s.level = %(source_level)s"
+        min_col, max_col = "s.min_total_power_w", "s.max_total_power_w"
+    averages = ",\n            ".join(
+        f"sum(s.{col} * s.samples) / NULLIF(sum(s.samples) FILTER (WHERE s.{col} IS NOT NULL), 0)"
+        for col in _POWER_AVG_COLUMNS
+    )
+    updates = ",\n            ".join(
+        f"{col} = EXCLUDED.{col}"
+        for col in (*_POWER_AVG_COLUMNS, "min_total_power_w", "max_total_power_w", "samples")
+    )
+    cte, join, where = _rollup_window(ts_col, level, by_range)
+    return f"""
+        {cte}
+        INSERT INTO power_rollups (
+            level,
+            ts_bucket,
+            device_id,
+            {", ".join(_POWER_AVG_COLUMNS)},
+            min_total_power_w,
+            max_total_power_w,
+            samples
+        )
+        SELECT
+            %(level)s,
+            {level.bucket_sql(ts_col)} AS ts_bucket,
+            s.device_id,
+            {averages},
+            min({min_col}),
+            max({max_col}),
+            sum(s.samples)
+        FROM {source_sql}
+        {join}
+        WHERE {where}
+          {level_filter}
+        GROUP BY 2, 3
+        ON CONFLICT (device_id, level, ts_bucket) DO UPDATE SET
+            {updates}
+        RETURNING device_id
+    """
+
+
+def _energy_rollup_query(level: RollupLevel, source_is_base: bool, by_range: bool) -> str:
+    if source_is_base:
+        source_sql = "energy_intervals_1h s"
+        ts_col = "s.ts_hour"
+        level_filter = ""
+    else:
+        source_sql = "energy_rollups s"
+        ts_col = "s.ts_bucket"
+        level_filter = "AND s.level = %(source_level)s"
+    bucket = level.bucket_sql(ts_col)
+    cte, join, where = _rollup_window(ts_col, level, by_range)
+    return f"""
+        {cte}
+        INSERT INTO energy_rollups (
+            level,
+            ts_bucket,
+            device_id,
+            channel,
+            energy_wh,
+            avg_power_w,
+            samples
+        )
+        SELECT
+            %(level)s,
+            {bucket} AS ts_bucket,
+            s.device_id,
+            s.channel,
+            sum(s.energy_wh) AS energy_wh,
+            sum(s.energy_wh) * 3600.0 / {level.seconds_sql(bucket)} AS avg_power_w,
+            sum(s.samples) AS samples
+        FROM {source_sql}
+        {join}
+        WHERE {where}
+          {level_filter}
+        GROUP BY 2, 3, 4
+        ON CONFLICT (device_id, channel, level, ts_bucket) DO UPDATE SET
+            energy_wh = EXCLUDED.energy_wh,
+            avg_power_w = EXCLUDED.avg_power_w,
+            samples = EXCLUDED.samples
+        RETURNING device_id
+    """
+
+
+@db_timed
+async def rollup_power_level(
+    pool: AsyncConnectionPool,
+    level: RollupLevel,
+    source: RollupLevel,
+    source_cutoff: datetime,
+    source_is_base: bool,
+) -> tuple[int, datetime]:
+    cutoff = level.floor(source_cutoff)
+    rollup = power_rollup_key(level)
+    query = _power_rollup_query(level, source_is_base, by_range=False)
+    params = {"rollup": rollup, "level": level.name, "source_level": source.name, "cutoff": cutoff}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            rows = await cur.fetchall()
+            await _advance_rollup_watermarks(cur, rollup, {row[0] for row in rows}, cutoff)
+            return len(rows), cutoff
+
+
+@db_timed
+async def rollup_energy_level(
+    pool: AsyncConnectionPool,
+    level: RollupLevel,
+    source: RollupLevel,
+    source_cutoff: datetime,
+    source_is_base: bool,
+) -> tuple[int, datetime]:
+    cutoff = level.floor(source_cutoff)
+    rollup = energy_rollup_key(level)
+    query = _energy_rollup_query(level, source_is_base, by_range=False)
+    params = {"rollup": rollup, "level": level.name, "source_level": source.name, "cutoff": cutoff}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            rows = await cur.fetchall()
+            await _advance_rollup_watermarks(cur, rollup, {row[0] for row in rows}, cutoff)
+            return len(rows), cutoff
+
+
+@db_timed
+async def upsert_power_rollups_range(
+    pool: AsyncConnectionPool,
+    level: RollupLevel,
+    source: RollupLevel,
+    start_ts: datetime,
+    end_ts: datetime,
+    source_is_base: bool,
+) -> int:
+    # Callers align start/end to the level's buckets; watermarks are left alone.
+    query = _power_rollup_query(level, source_is_base, by_range=True)
+    params = {"level": level.name, "source_level": source.name, "start_ts": start_ts, "end_ts": end_ts}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return cur.rowcount or 0
+
+
+@db_timed
+async def upsert_energy_rollups_range(
+    pool: AsyncConnectionPool,
+    level: RollupLevel,
+    source: RollupLevel,
+    start_ts: datetime,
+    end_ts: datetime,
+    source_is_base: bool,
+) -> int:
+    query = _energy_rollup_query(level, source_is_base, by_range=True)
+    params = {"level": level.name, "source_level": source.name, "start_ts": start_ts, "end_ts": end_ts}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return cur.rowcount or 0
+
+
+@db_timed
+async def get_rebuild_progress(pool: AsyncConnectionPool, run_key: str) -> set[tuple[str, datetime]]:
+    query = "SELECT step, slice_start FROM rollup_rebuild_progress WHERE run_key = %(run_key)s"
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, {"run_key": run_key})
+            return {(step, slice_start) for step, slice_start in await cur.fetchall()}
+
+
+@db_timed
+async def mark_rebuild_slice(
+    pool: AsyncConnectionPool,
+    run_key: str,
+    step: str,
+    slice_start: datetime,
+    slice_end: datetime,
+    rows_written: int,
+) -> None:
+    query = """
+        INSERT INTO rollup_rebuild_progress (run_key, step, slice_start, slice_end, rows_written, completed_ts)
+        VALUES (%(run_key)s, %(step)s, %(slice_start)s, %(slice_end)s, %(rows_written)s, now())
+        ON CONFLICT (run_key, step, slice_start) DO UPDATE SET
+            slice_end = EXCLUDED.slice_end,
+            rows_written = EXCLUDED.rows_written,
+            completed_ts = EXCLUDED.completed_ts
+    """
+    params = {
+        "run_key": run_key,
+        "step": step,
+        "slice_start": slice_start,
+        "slice_end": slice_end,
+        "rows_written": rows_written,
+    }
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+
+
+@db_timed
+async def clear_rebuild_progress(pool: AsyncConnectionPool, run_key: str) -> int:
+    query = "DELETE FROM rollup_rebuild_progress WHERE run_key = %(run_key)s"
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, {"run_key": run_key})
+            return cur.rowcount or 0
+
+
+@db_timed
+async def delete_power_rollups_older_than(pool: AsyncConnectionPool, level: str, older_than_days: int) -> int:
+    query = """
+        DELETE FROM power_rollups
+        WHERE level = %(level)s
+          AND ts_bucket < (now() AT TIME ZONE 'utc') - (%(days)s || ' days')::interval
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, {"level": level, "days": older_than_days})
+            return cur.rowcount or 0
+
+
+@db_timed
+async def delete_energy_rollups_older_than(pool: AsyncConnectionPool, level: str, older_than_days: int) -> int:
+    query = """
+        DELETE FROM energy_rollups
+        WHERE level = %(level)s
+          AND ts_bucket < (now() AT TIME ZONE 'utc') - (%(days)s || ' days')::interval
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, {"level": level, "days": older_than_days})
+            return cur.rowcount or 0
+
+
+@db_timed
+async def fetch_power_series(
+    pool: AsyncConnectionPool,
+    levels: list[RollupLevel],
+    device_id: str,
+    start_ts: datetime,
+    end_ts: datetime,
+    max_points: int,
+) -> tuple[RollupLevel, list[tuple[Any, ...]]]:
+    level = choose_level(levels, start_ts, end_ts, max_points)
+    if level is levels[0]:
+        query = """
+            SELECT
+                ts_minute,
+                avg_total_power_w,
+                avg_total_power_w,
+                avg_total_power_w,
+                avg_phase_a_power_w,
+                avg_phase_b_power_w,
+                avg_phase_c_power_w,
+                samples
+            FROM power_readings_1m
+            WHERE device_id = %(device_id)s AND ts_minute >= %(start_ts)s AND ts_minute < %(end_ts)s
+            ORDER BY ts_minute
+        """
+    else:
+        query = """
+            SELECT
+                ts_bucket,
+                avg_total_power_w,
+                min_total_power_w,
+                max_total_power_w,
+                avg_phase_a_power_w,
+                avg_phase_b_power_w,
+                avg_phase_c_power_w,
+                samples
+            FROM power_rollups
+            WHERE device_id = %(device_id)s AND level = %(level)s
+              AND ts_bucket >= %(start_ts)s AND ts_bucket < %(end_ts)s
+            ORDER BY ts_bucket
+        """
+    params = {"device_id": device_id, "level": level.name, "start_ts": start_ts, "end_ts": end_ts}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return level, await cur.fetchall()
+
+
+@db_timed
+async def get_newest_power_bucket(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    start_ts: datetime,
+    end_ts: datetime,
+) -> tuple[datetime, int] | None:
+    query = """
+        SELECT ts_minute, samples
+        FROM power_readings_1m
+        WHERE device_id = %(device_id)s AND ts_minute >= %(start_ts)s AND ts_minute < %(end_ts)s
+        ORDER BY ts_minute DESC
+        LIMIT 1
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, {"device_id": device_id, "start_ts": start_ts, "end_ts": end_ts})
+            row = await cur.fetchone()
+            return (row[0], int(row[1])) if row else None
+
+
+@db_timed
+async def fetch_energy_series(
+    pool: AsyncConnectionPool,
+    levels: list[RollupLevel],
+    device_id: str,
+    channel: int,
+    start_ts: datetime,
+    end_ts: datetime,
+    max_points: int,
+) -> tuple[RollupLevel, list[tuple[Any, ...]]]:
+    level = choose_level(levels, start_ts, end_ts, max_points)
+    if level is levels[0]:
+        query = """
+            SELECT ts_hour, energy_wh, avg_power_w, samples
+            FROM energy_intervals_1h
+            WHERE device_id = %(device_id)s AND channel = %(channel)s
+              AND ts_hour >= %(start_ts)s AND ts_hour < %(end_ts)s
+            ORDER BY ts_hour
+        """
+    else:
+        query = """
+            SELECT ts_bucket, energy_wh, avg_power_w, samples
+            FROM energy_rollups
+            WHERE device_id = %(device_id)s AND channel = %(channel)s AND level = %(level)s
+              AND ts_bucket >= %(start_ts)s AND ts_bucket < %(end_ts)s
+            ORDER BY ts_bucket
+        """
+    params = {
+        "device_id": device_id,
+        "channel": channel,
+        "level": level.name,
+        "start_ts": start_ts,
+        "end_ts": end_ts,
+    }
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return level, await cur.fetchall()
+
+
+@db_timed
+async def upsert_energy_local_days_range(
+    pool: AsyncConnectionPool,
+    start_ts: datetime,
+    end_ts: datetime,
+) -> int:
+    daily_query = """
+        WITH devices AS (
+            SELECT d.device_id, COALESCE(ds.timezone, 'UTC') AS timezone
+            FROM (
+                SELECT DISTINCT COALESCE(device_id, 'unknown') AS device_id
+                FROM energy_intervals
+                WHERE start_ts >= %(start_ts)s AND start_ts < %(end_ts)s
+            ) d
+            LEFT JOIN device_settings ds ON ds.device_id = d.device_id
+        ),
+        days AS (
+            SELECT
+                dv.device_id,
+                dv.timezone,
+                gs::date AS local_day,
+                (gs::date::timestamp AT TIME ZONE dv.timezone) AS day_start,
+                ((gs::date + 1)::timestamp AT TIME ZONE dv.timezone) AS day_end
+            FROM devices dv
+            CROSS JOIN LATERAL generate_series(
+                (%(start_ts)s AT TIME ZONE dv.timezone)::date,
+                ((%(end_ts)s - interval '1 microsecond') AT TIME ZONE dv.timezone)::date,
+                interval '1 day'
+            ) AS gs
+        )
+        INSERT INTO energy_local_daily (
+            device_id, channel, local_day, timezone, energy_wh, samples, updated_ts
+        )
+        SELECT
+            d.device_id,
+            e.channel,
+            d.local_day,
+            d.timezone,
+            sum(e.energy_wh),
+            count(*),
+            now()
+        FROM days d
+        JOIN energy_intervals e
+          ON COALESCE(e.device_id, 'unknown') = d.device_id
+         AND e.start_ts >= d.day_start
+         AND e.start_ts < d.day_end
+        WHERE e.channel IS NOT NULL
+        GROUP BY 1, 2, 3, 4
+        ON CONFLICT (device_id, channel, local_day) DO UPDATE SET
+            timezone = EXCLUDED.timezone,
+            energy_wh = EXCLUDED.energy_wh,
+            samples = EXCLUDED.samples,
+            updated_ts = EXCLUDED.updated_ts
+        WHERE EXCLUDED.samples >= energy_local_daily.samples
+           OR EXCLUDED.timezone <> energy_local_daily.timezone
+        RETURNING device_id, date_trunc('month', local_day)::date
+    """
+    monthly_query = """
+        INSERT INTO energy_local_monthly (
+            device_id, channel, local_month, timezone, energy_wh, days, updated_ts
+        )
+        SELECT
+            d.device_id,
+            d.channel,
+            m.local_month,
+            max(d.timezone),
+            sum(d.energy_wh),
+            count(*),
+            now()
+        FROM unnest(%(device_ids)s::text[], %(months)s::date[]) AS m(device_id, local_month)
+        JOIN energy_local_daily d
+          ON d.device_id = m.device_id
+         AND d.local_day >= m.local_month
+         AND d.local_day < (m.local_month + interval '1 month')::date
+        GROUP BY 1, 2, 3
+        ON CONFLICT (device_id, channel, local_month) DO UPDATE SET
+            timezone = EXCLUDED.timezone,
+            energy_wh = EXCLUDED.energy_wh,
+            days = EXCLUDED.days,
+            updated_ts = EXCLUDED.updated_ts
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(daily_query, {"start_ts": start_ts, "end_ts": end_ts})
+            rows = await cur.fetchall()
+            months = sorted(set(rows))
+            if months:
+                await cur.execute(
+                    monthly_query,
+                    {"device_ids": [m[0] for m in months], "months": [m[1] for m in months]},
+                )
+            return len(rows)
+
+
+@db_timed
+async def fetch_local_daily(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    channel: int,
+    start_day: date,
+    end_day: date,
+) -> list[tuple[Any, ...]]:
+    query = """
+        SELECT local_day, timezone, energy_wh, samples
+        FROM energy_local_daily
+        WHERE device_id = %(device_id)s AND channel = %(channel)s
+          AND local_day >= %(start_day)s AND local_day < %(end_day)s
+        ORDER BY local_day
+    """
+    params = {"device_id": device_id, "channel": channel, "start_day": start_day, "end_day": end_day}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return await cur.fetchall()
+
+
+@db_timed
+async def fetch_energy_rows(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    channel: int,
+    start_ts: datetime,
+    end_ts: datetime,
+    hourly: bool = False,
+) -> list[tuple[datetime, float]]:
+    if hourly:
+        query = """
+            SELECT ts_hour, energy_wh::float8
+            FROM energy_intervals_1h
+            WHERE device_id = %(device_id)s AND channel = %(channel)s
+              AND ts_hour >= %(start_ts)s AND ts_hour < %(end_ts)s
+            ORDER BY ts_hour
+        """
+    else:
+        query = """
+            SELECT start_ts, energy_wh::float8
+            FROM energy_intervals
+            WHERE device_id = %(device_id)s AND channel = %(channel)s
+              AND start_ts >= %(start_ts)s AND start_ts < %(end_ts)s
+            ORDER BY start_ts
+        """
+    params = {"device_id": device_id, "channel": channel, "start_ts": start_ts, "end_ts": end_ts}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return await cur.fetchall()
+
+
+@db_timed
+async def fetch_energy_fingerprint(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    channel: int,
+    start_ts: datetime,
+    end_ts: datetime,
+    hourly: bool = False,
+) -> tuple[Any, ...]:
+    if hourly:
+        # At most 24 rows a day, so an exact count/sum stays cheap.
+        query = """
+            SELECT count(*), coalesce(sum(energy_wh), 0)::text
+            FROM energy_intervals_1h
+            WHERE device_id = %(device_id)s AND channel = %(channel)s
+              AND ts_hour >= %(start_ts)s AND ts_hour < %(end_ts)s
+        """
+    else:
+        # Index lookups only: emdata_coverage is updated in the same transaction as every EMData insert
+        # (live loop, gap filler, backfill), and the range ends catch retention trimming the start.
+        query = """
+            SELECT
+                (SELECT max(updated_ts) FROM emdata_coverage
+                 WHERE device_id = %(device_id)s AND day >= %(start_day)s AND day <= %(end_day)s)::text,
+                (SELECT min(start_ts) FROM energy_intervals
+                 WHERE device_id = %(device_id)s AND channel = %(channel)s
+                   AND start_ts >= %(start_ts)s AND start_ts < %(end_ts)s)::text,
+                (SELECT max(start_ts) FROM energy_intervals
+                 WHERE device_id = %(device_id)s AND channel = %(channel)s
+                   AND start_ts >= %(start_ts)s AND start_ts < %(end_ts)s)::text
+        """
+    params = {
+        "device_id": device_id,
+        "channel": channel,
+        "start_ts": start_ts,
+        "end_ts": end_ts,
+        "start_day": start_ts.astimezone(timezone.utc).date(),
+        "end_day": (end_ts - timedelta(microseconds=1)).astimezone(timezone.utc).date(),
+    }
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            row = await cur.fetchone()
+            return tuple(row)
+
+
+@db_timed
+async def fetch_tariff_revision(pool: AsyncConnectionPool, tariff_id: int) -> int | None:
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT revision FROM tariffs WHERE id = %(id)s", {"id": tariff_id})
+            row = await cur.fetchone()
+            return int(row[0]) if row else None
+
+
+@db_timed
+async def find_tariff_ids(pool: AsyncConnectionPool, names: list[str] | None = None) -> list[tuple[int, str]]:
+    query = "SELECT id, name FROM tariffs"
+    params: dict[str, Any] = {}
+    if names:
+        query += " WHERE name = ANY(%(names)s)"
+        params["names"] = names
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query + " ORDER BY id", params)
+            return await cur.fetchall()
+
+
+@db_timed
+async def fetch_tariff_definition(pool: AsyncConnectionPool, tariff_id: int) -> dict[str, list[tuple[Any, ...]]] | None:
+    queries = {
+        "tariff": """
+            SELECT id, name, currency, timezone, valid_from, valid_to, revision
+            FROM tariffs WHERE id = %(id)s
+        """,
+        "components": """
+            SELECT id, name, kind, direction, unit, billing_period, priority
+            FROM tariff_components WHERE tariff_id = %(id)s
+            ORDER BY priority, id
+        """,
+        "rules": """
+            SELECT r.id, r.component_id, r.day_type_id, r.season_id, r.effective_from, r.effective_to,
+                   r.rate::float8, r.min_kwh, r.max_kwh, r.min_kw::float8, r.max_kw::float8, r.priority
+            FROM tariff_rules r
+            JOIN tariff_components c ON c.id = r.component_id
+            WHERE c.tariff_id = %(id)s
+            ORDER BY r.priority, r.id
+        """,
+        "windows": """
+            SELECT w.rule_id, w.start_time, w.end_time
+            FROM tariff_rule_windows w
+            JOIN tariff_rules r ON r.id = w.rule_id
+            JOIN tariff_components c ON c.id = r.component_id
+            WHERE c.tariff_id = %(id)s
+            ORDER BY w.rule_id, w.start_time
+        """,
+        "day_types": """
+            SELECT id, name, dow_mask, include_holidays
+            FROM tariff_day_types WHERE tariff_id = %(id)s
+            ORDER BY id
+        """,
+        "seasons": """
+            SELECT id, name, start_md, end_md, year
+            FROM tariff_seasons WHERE tariff_id = %(id)s
+            ORDER BY year NULLS LAST, id
+        """,
+        "holidays": """
+            SELECT holiday_date FROM tariff_holidays WHERE tariff_id = %(id)s
+        """,
+    }
+    definition: dict[str, list[tuple[Any, ...]]] = {}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            for key, query in queries.items():
+                await cur.execute(query, {"id": tariff_id})
+                definition[key] = await cur.fetchall()
+    if not definition["tariff"]:
+        return None
+    return definition
+
+
+@db_timed
 async def insert_power_reading(
     pool: AsyncConnectionPool,
     ts: datetime,
@@ -474,6 +1302,34 @@ async def insert_power_reading(
             await cur.execute(query, params)
 
 
+@db_timed
+async def insert_power_readings_bulk(pool: AsyncConnectionPool, readings: list[dict[str, Any]]) -> int:
+    if not readings:
+        return 0
+    query = """
+        INSERT INTO power_readings (
+            ts, device_id, total_power_w,
+            phase_a_power_w, phase_b_power_w, phase_c_power_w,
+            phase_a_voltage_v, phase_b_voltage_v, phase_c_voltage_v,
+            phase_a_current_a, phase_b_current_a, phase_c_current_a
+        )
+        SELECT
+            %(ts)s, %(device_id)s, %(total_power_w)s,
+            %(phase_a_power_w)s, %(phase_b_power_w)s, %(phase_c_power_w)s,
+            %(phase_a_voltage_v)s, %(phase_b_voltage_v)s, %(phase_c_voltage_v)s,
+            %(phase_a_current_a)s, %(phase_b_current_a)s, %(phase_c_current_a)s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM power_readings
+            WHERE ts = %(ts)s AND device_id IS NOT DISTINCT FROM %(device_id)s
+        )
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.executemany(query, readings)
+            return cur.rowcount or 0
+
+
+@db_timed
 async def upsert_energy_interval(
     pool: AsyncConnectionPool,
     device_id: str | None,
@@ -506,6 +1362,202 @@ async def upsert_energy_interval(
             await cur.execute(query, params)
 
 
+@db_timed
+async def insert_energy_intervals_bulk(
+    pool: AsyncConnectionPool,
+    device_id: str | None,
+    period: int,
+    intervals: list[dict[str, Any]],
+) -> int:
+    # One transaction for the rows and their coverage bits, so the index never claims missing data.
+    if not intervals:
+        return 0
+    query = """
+        INSERT INTO energy_intervals (
+            device_id, channel, start_ts, end_ts, energy_wh, avg_power_w, meta
+        ) VALUES (
+            %(device_id)s, %(channel)s, %(start_ts)s, %(end_ts)s, %(energy_wh)s, %(avg_power_w)s, %(meta)s
+        )
+        ON CONFLICT (device_id, channel, start_ts, end_ts) DO NOTHING
+    """
+    params = [{**interval, "device_id": device_id, "meta": _to_jsonb(interval.get("meta"))} for interval in intervals]
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.executemany(query, params)
+            inserted = cur.rowcount
+            if device_id:
+                bitmaps = day_bitmaps({interval["start_ts"] for interval in intervals}, period)
+                await _upsert_bitmaps(cur, "emdata_coverage", device_id, period, bitmaps)
+    return max(0, inserted)
+
+
+@db_timed
+async def get_emdata_watermark(pool: AsyncConnectionPool, device_id: str, emdata_id: int) -> datetime | None:
+    # Falls back to the newest stored total-channel interval for databases from before emdata_watermarks.
+    query = """
+        SELECT COALESCE(
+            (SELECT last_record_ts FROM emdata_watermarks
+             WHERE device_id = %(device_id)s AND emdata_id = %(emdata_id)s),
+            (SELECT max(start_ts) FROM energy_intervals WHERE device_id = %(device_id)s AND channel = 3)
+        )
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, {"device_id": device_id, "emdata_id": emdata_id})
+            row = await cur.fetchone()
+            return row[0] if row else None
+
+
+@db_timed
+async def set_emdata_watermark(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    emdata_id: int,
+    last_record_ts: datetime,
+) -> None:
+    query = """
+        INSERT INTO emdata_watermarks (device_id, emdata_id, last_record_ts, updated_ts)
+        VALUES (%(device_id)s, %(emdata_id)s, %(last_record_ts)s, now())
+        ON CONFLICT (device_id, emdata_id) DO UPDATE SET
+            last_record_ts = EXCLUDED.last_record_ts,
+            updated_ts = EXCLUDED.updated_ts
+    """
+    params = {"device_id": device_id, "emdata_id": emdata_id, "last_record_ts": last_record_ts}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+
+
+async def _upsert_bitmaps(
+    cur: AsyncCursor,
+    table: str,
+    device_id: str,
+    period: int,
+    bitmaps: dict[date, str],
+) -> None:
+    query = f"""
+        INSERT INTO {table} (device_id, period, day, bits, updated_ts)
+        VALUES (%(device_id)s, %(period)s, %(day)s, %(bits)s::varbit, now())
+        ON CONFLICT (device_id, period, day) DO UPDATE SET
+            bits = {table}.bits | EXCLUDED.bits,
+            updated_ts = EXCLUDED.updated_ts
+    """
+    params = [
+        {"device_id": device_id, "period": period, "day": day, "bits": bits}
+        for day, bits in sorted(bitmaps.items())
+    ]
+    await cur.executemany(query, params)
+
+
+async def _fetch_bitmaps(
+    pool: AsyncConnectionPool,
+    table: str,
+    device_id: str,
+    period: int,
+    start_day: date,
+    end_day: date,
+) -> dict[date, str]:
+    query = f"""
+        SELECT day, bits::text
+        FROM {table}
+        WHERE device_id = %(device_id)s AND period = %(period)s AND day BETWEEN %(start_day)s AND %(end_day)s
+    """
+    params = {"device_id": device_id, "period": period, "start_day": start_day, "end_day": end_day}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return {day: bits for day, bits in await cur.fetchall()}
+
+
+@db_timed
+async def upsert_emdata_coverage(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    period: int,
+    bitmaps: dict[date, str],
+) -> None:
+    if not bitmaps:
+        return
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await _upsert_bitmaps(cur, "emdata_coverage", device_id, period, bitmaps)
+
+
+@db_timed
+async def get_emdata_coverage(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    period: int,
+    start_day: date,
+    end_day: date,
+) -> dict[date, str]:
+    return await _fetch_bitmaps(pool, "emdata_coverage", device_id, period, start_day, end_day)
+
+
+@db_timed
+async def upsert_backfill_checkpoint(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    period: int,
+    bitmaps: dict[date, str],
+) -> None:
+    if not bitmaps:
+        return
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await _upsert_bitmaps(cur, "emdata_backfill_checkpoints", device_id, period, bitmaps)
+
+
+@db_timed
+async def get_backfill_checkpoint(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    period: int,
+    start_day: date,
+    end_day: date,
+) -> dict[date, str]:
+    return await _fetch_bitmaps(pool, "emdata_backfill_checkpoints", device_id, period, start_day, end_day)
+
+
+@db_timed
+async def clear_backfill_checkpoint(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    period: int,
+    start_day: date,
+    end_day: date,
+) -> int:
+    query = """
+        DELETE FROM emdata_backfill_checkpoints
+        WHERE device_id = %(device_id)s AND period = %(period)s AND day BETWEEN %(start_day)s AND %(end_day)s
+    """
+    params = {"device_id": device_id, "period": period, "start_day": start_day, "end_day": end_day}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return cur.rowcount
+
+
+@db_timed
+async def get_interval_starts(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    start_ts: datetime,
+    end_ts: datetime,
+) -> list[datetime]:
+    query = """
+        SELECT start_ts
+        FROM energy_intervals
+        WHERE device_id = %(device_id)s AND channel = 3 AND start_ts >= %(start_ts)s AND start_ts < %(end_ts)s
+    """
+    params = {"device_id": device_id, "start_ts": start_ts, "end_ts": end_ts}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return [row[0] for row in await cur.fetchall()]
+
+
+@db_timed
 async def insert_alert_event(
     pool: AsyncConnectionPool,
     ts: datetime,
@@ -523,46 +1575,379 @@ async def insert_alert_event(
             await cur.execute(query, params)
 
 
-async def get_alert_state(pool: AsyncConnectionPool, alert_type: str) -> AlertState | None:
+@db_timed
+async def insert_alert_events_bulk(pool: AsyncConnectionPool, events: list[dict[str, Any]]) -> int:
+    if not events:
+        return 0
     query = """
-        SELECT active, last_triggered_ts, cooldown_until_ts
+        INSERT INTO alert_events (ts, type, value, details)
+        SELECT %(ts)s, %(type)s, %(value)s, %(details)s
+        WHERE NOT EXISTS (
+            SELECT 1 FROM alert_events WHERE ts = %(ts)s AND type = %(type)s
+        )
+    """
+    params = [{**event, "details": _to_jsonb(event.get("details"))} for event in events]
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.executemany(query, params)
+            return cur.rowcount or 0
+
+
+@db_timed
+async def get_alert_states(pool: AsyncConnectionPool) -> dict[str, AlertState]:
+    query = """
+        SELECT type, active, last_triggered_ts, cooldown_until_ts
         FROM alert_state
-        WHERE type = %(type)s
     """
     async with pool.connection() as conn:
         async with conn.cursor() as cur:
-            await cur.execute(query, {"type": alert_type})
-            row = await cur.fetchone()
-            if row is None:
-                return None
-            return AlertState(
-                active=row[0],
-                last_triggered_ts=row[1],
-                cooldown_until_ts=row[2],
-            )
+            await cur.execute(query)
+            return {
+                row[0]: AlertState(active=row[1], last_triggered_ts=row[2], cooldown_until_ts=row[3])
+                for row in await cur.fetchall()
+            }
 
 
-async def upsert_alert_state(
-    pool: AsyncConnectionPool,
-    alert_type: str,
-    active: bool,
-    last_triggered_ts: datetime | None,
-    cooldown_until_ts: datetime | None,
-) -> None:
+@db_timed
+async def upsert_alert_states(pool: AsyncConnectionPool, states: list[dict[str, Any]]) -> None:
+    if not states:
+        return
     query = """
         INSERT INTO alert_state (type, active, last_triggered_ts, cooldown_until_ts)
         VALUES (%(type)s, %(active)s, %(last_triggered_ts)s, %(cooldown_until_ts)s)
         ON CONFLICT (type) DO UPDATE SET
             active = EXCLUDED.active,
-            last_triggered_ts = EXCLUDED.last_triggered_ts,
+            last_triggered_ts = COALESCE(EXCLUDED.last_triggered_ts, alert_state.last_triggered_ts),
             cooldown_until_ts = EXCLUDED.cooldown_until_ts
     """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.executemany(query, states)
+
+
+@db_timed
+async def fetch_alert_rules(pool: AsyncConnectionPool) -> list[tuple[Any, ...]]:
+    query = """
+        SELECT name, metric, op, threshold, sustain_seconds, cooldown_seconds, trigger,
+               aggregate, window_seconds
+        FROM alert_rules
+        WHERE enabled
+        ORDER BY name
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query)
+            return await cur.fetchall()
+
+
+@db_timed
+async def fetch_demand_peaks(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    period_start: date,
+) -> list[tuple[int, datetime, float]]:
+    query = """
+        SELECT window_minutes, peak_ts, demand_kw::float8
+        FROM demand_peaks
+        WHERE device_id = %(device_id)s AND period_start = %(period_start)s
+        ORDER BY window_minutes, rank
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, {"device_id": device_id, "period_start": period_start})
+            return await cur.fetchall()
+
+
+@db_timed
+async def replace_demand_peaks(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    window_minutes: int,
+    period_start: date,
+    peaks: list[tuple[datetime, float]],
+) -> None:
+    key = {"device_id": device_id, "window_minutes": window_minutes, "period_start": period_start}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                DELETE FROM demand_peaks
+                WHERE device_id = %(device_id)s
+                  AND window_minutes = %(window_minutes)s
+                  AND period_start = %(period_start)s
+                """,
+                key,
+            )
+            if peaks:
+                await cur.executemany(
+                    """
+                    INSERT INTO demand_peaks (device_id, window_minutes, period_start, rank, peak_ts, demand_kw)
+                    VALUES (%(device_id)s, %(window_minutes)s, %(period_start)s, %(rank)s, %(peak_ts)s, %(demand_kw)s)
+                    """,
+                    [
+                        {**key, "rank": rank, "peak_ts": peak_ts, "demand_kw": demand_kw}
+                        for rank, (peak_ts, demand_kw) in enumerate(peaks, start=1)
+                    ],
+                )
+
+
+@db_timed
+async def fetch_baseline_profile(
+    pool: AsyncConnectionPool,
+    device_id: str,
+) -> tuple[int, list[float], list[float], list[int]] | None:
+    query = """
+        SELECT bucket_minutes, mean_w, var_w, weight
+        FROM load_baseline
+        WHERE device_id = %(device_id)s
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, {"device_id": device_id})
+            return await cur.fetchone()
+
+
+@db_timed
+async def upsert_baseline_profile(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    bucket_minutes: int,
+    timezone_name: str | None,
+    mean_w: list[float],
+    var_w: list[float],
+    weight: list[int],
+) -> None:
+    query = """
+        INSERT INTO load_baseline (device_id, bucket_minutes, timezone, mean_w, var_w, weight, updated_ts)
+        VALUES (%(device_id)s, %(bucket_minutes)s, %(timezone)s, %(mean_w)s, %(var_w)s, %(weight)s, now())
+        ON CONFLICT (device_id) DO UPDATE SET
+            bucket_minutes = EXCLUDED.bucket_minutes,
+            timezone = EXCLUDED.timezone,
+            mean_w = EXCLUDED.mean_w,
+            var_w = EXCLUDED.var_w,
+            weight = EXCLUDED.weight,
+            updated_ts = EXCLUDED.updated_ts
+    """
     params = {
-        "type": alert_type,
-        "active": active,
-        "last_triggered_ts": last_triggered_ts,
-        "cooldown_until_ts": cooldown_until_ts,
+        "device_id": device_id,
+        "bucket_minutes": bucket_minutes,
+        "timezone": timezone_name,
+        "mean_w": mean_w,
+        "var_w": var_w,
+        "weight": weight,
     }
     async with pool.connection() as conn:
         async with conn.cursor() as cur:
             await cur.execute(query, params)
+
+
+@db_timed
+async def fetch_device_timezone(pool: AsyncConnectionPool, device_id: str) -> str | None:
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "SELECT timezone FROM device_settings WHERE device_id = %(device_id)s",
+                {"device_id": device_id},
+            )
+            row = await cur.fetchone()
+            return row[0] if row else None
+
+
+@db_timed
+async def fetch_device_tariffs(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    first_day: date,
+    last_day: date,
+) -> list[tuple[int, date, date | None]]:
+    query = """
+        SELECT tariff_id, valid_from, valid_to
+        FROM device_tariffs
+        WHERE device_id = %(device_id)s
+          AND valid_from <= %(last_day)s
+          AND (valid_to IS NULL OR valid_to >= %(first_day)s)
+        ORDER BY valid_from DESC
+    """
+    params = {"device_id": device_id, "first_day": first_day, "last_day": last_day}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            return await cur.fetchall()
+
+
+@db_timed
+async def replace_energy_costs_day(
+    pool: AsyncConnectionPool,
+    device_id: str,
+    local_day: date,
+    day_start: datetime,
+    day_end: datetime,
+    daily: dict[str, Any] | None,
+    hourly: list[tuple[datetime, str, float, float]],
+) -> None:
+    key = {"device_id": device_id, "local_day": local_day, "day_start": day_start, "day_end": day_end}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                DELETE FROM energy_costs
+                WHERE device_id = %(device_id)s AND ts_hour >= %(day_start)s AND ts_hour < %(day_end)s
+                """,
+                key,
+            )
+            if daily is None:
+                await cur.execute(
+                    "DELETE FROM energy_costs_daily WHERE device_id = %(device_id)s AND local_day = %(local_day)s",
+                    key,
+                )
+                return
+            if hourly:
+                await cur.executemany(
+                    """
+                    INSERT INTO energy_costs (device_id, ts_hour, component, tariff_id, energy_wh, cost)
+                    VALUES (%(device_id)s, %(ts_hour)s, %(component)s, %(tariff_id)s, %(energy_wh)s, %(cost)s)
+                    ON CONFLICT (device_id, ts_hour, component) DO UPDATE SET
+                        tariff_id = EXCLUDED.tariff_id,
+                        energy_wh = EXCLUDED.energy_wh,
+                        cost = EXCLUDED.cost,
+                        updated_ts = now()
+                    """,
+                    [
+                        {
+                            "device_id": device_id,
+                            "ts_hour": ts_hour,
+                            "component": component,
+                            "tariff_id": daily["tariff_id"],
+                            "energy_wh": energy_wh,
+                            "cost": cost,
+                        }
+                        for ts_hour, component, energy_wh, cost in hourly
+                    ],
+                )
+            await cur.execute(
+                """
+                INSERT INTO energy_costs_daily (
+                    device_id, local_day, timezone, tariff_id, tariff_revision, currency,
+                    energy_wh, cost, components, updated_ts
+                )
+                VALUES (
+                    %(device_id)s, %(local_day)s, %(timezone)s, %(tariff_id)s, %(tariff_revision)s, %(currency)s,
+                    %(energy_wh)s, %(cost)s, %(components)s, now()
+                )
+                ON CONFLICT (device_id, local_day) DO UPDATE SET
+                    timezone = EXCLUDED.timezone,
+                    tariff_id = EXCLUDED.tariff_id,
+                    tariff_revision = EXCLUDED.tariff_revision,
+                    currency = EXCLUDED.currency,
+                    energy_wh = EXCLUDED.energy_wh,
+                    cost = EXCLUDED.cost,
+                    components = EXCLUDED.components,
+                    updated_ts = EXCLUDED.updated_ts
+                """,
+                {**key, **daily, "components": Jsonb(daily["components"])},
+            )
+
+
+@db_timed
+async def refresh_energy_costs_month(pool: AsyncConnectionPool, device_id: str, local_month: date) -> None:
+    params = {"device_id": device_id, "local_month": local_month}
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                """
+                SELECT currency, energy_wh::float8, components
+                FROM energy_costs_daily
+                WHERE device_id = %(device_id)s
+                  AND local_day >= %(local_month)s
+                  AND local_day < (%(local_month)s::date + interval '1 month')
+                ORDER BY local_day
+                """,
+                params,
+            )
+            rows = await cur.fetchall()
+            if not rows:
+                await cur.execute(
+                    """
+                    DELETE FROM energy_costs_monthly
+                    WHERE device_id = %(device_id)s AND local_month = %(local_month)s
+                    """,
+                    params,
+                )
+                return
+            components: dict[str, float] = {}
+            for _, _, day_components in rows:
+                for name, value in day_components.items():
+                    components[name] = components.get(name, 0.0) + float(value)
+            await cur.execute(
+                """
+                INSERT INTO energy_costs_monthly (
+                    device_id, local_month, currency, energy_wh, cost, components, days, updated_ts
+                )
+                VALUES (
+                    %(device_id)s, %(local_month)s, %(currency)s, %(energy_wh)s, %(cost)s, %(components)s,
+                    %(days)s, now()
+                )
+                ON CONFLICT (device_id, local_month) DO UPDATE SET
+                    currency = EXCLUDED.currency,
+                    energy_wh = EXCLUDED.energy_wh,
+                    cost = EXCLUDED.cost,
+                    components = EXCLUDED.components,
+                    days = EXCLUDED.days,
+                    updated_ts = EXCLUDED.updated_ts
+                """,
+                {
+                    **params,
+                    "currency": rows[-1][0],
+                    "energy_wh": sum(row[1] or 0.0 for row in rows),
+                    "cost": sum(components.values()),
+                    "components": Jsonb(components),
+                    "days": len(rows),
+                },
+            )
+
+
+@db_timed
+async def fetch_stale_cost_days(pool: AsyncConnectionPool, channel: int, limit: int) -> list[tuple[str, date, str]]:
+    # Days priced with an older tariff revision, or whose device tariff assignment changed since, plus
+    # days with consumption under an active assignment that were never priced (assignment added later).
+    query = """
+        SELECT device_id, local_day, timezone
+        FROM (
+            SELECT d.device_id, d.local_day, d.timezone
+            FROM energy_costs_daily d
+            LEFT JOIN tariffs t ON t.id = d.tariff_id
+            LEFT JOIN LATERAL (
+                SELECT a.tariff_id
+                FROM device_tariffs a
+                WHERE a.device_id = d.device_id
+                  AND a.valid_from <= d.local_day
+                  AND (a.valid_to IS NULL OR a.valid_to >= d.local_day)
+                ORDER BY a.valid_from DESC
+                LIMIT 1
+            ) a ON true
+            WHERE t.revision IS DISTINCT FROM d.tariff_revision
+               OR a.tariff_id IS DISTINCT FROM d.tariff_id
+            UNION ALL
+            SELECT l.device_id, l.local_day, l.timezone
+            FROM energy_local_daily l
+            WHERE l.channel = %(channel)s
+              AND EXISTS (
+                  SELECT 1
+                  FROM device_tariffs a
+                  WHERE a.device_id = l.device_id
+                    AND a.valid_from <= l.local_day
+                    AND (a.valid_to IS NULL OR a.valid_to >= l.local_day)
+              )
+              AND NOT EXISTS (
+                  SELECT 1
+                  FROM energy_costs_daily d
+                  WHERE d.device_id = l.device_id AND d.local_day = l.local_day
+              )
+        ) stale
+        ORDER BY device_id, local_day
+        LIMIT %(limit)s
+    """
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, {"channel": channel, "limit": limit})
+            return await cur.fetchall()
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import asyncio
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+
+from aiohttp import web
+
+from .health import HealthState
+from .logger import log
+from .metrics import LOOP_LAG_SECONDS
+
+MAX_PROFILE_SECONDS = 120.0
+SAMPLE_INTERVAL_SECONDS = 0.005
+
+
+class LagSampler:
+    # Sleeps a fixed interval and measures how late the loop wakes it: anything above zero is time
+    # the loop spent running other callbacks (CPU-bound work or blocking calls), not waiting on I/O.
+
+    def __init__(self, health: HealthState, interval_seconds: float = 0.5, window_seconds: float = 60.0) -> None:
+        self._health = health
+        self._interval = interval_seconds
+        self._window: deque[float] = deque(maxlen=max(1, int(window_seconds / interval_seconds)))
+
+    async def run(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            wake_at = time.perf_counter() + self._interval
+            await asyncio.sleep(self._interval)
+            lag = max(0.0, time.perf_counter() - wake_at)
+            self._window.append(lag)
+            LOOP_LAG_SECONDS.observe(lag, "event_loop")
+            self._health.loop_lag_ms = round(lag * 1000.0, 2)
+            self._health.loop_lag_max_ms = round(max(self._window) * 1000.0, 2)
+
+
+def _sample_stacks(thread_id: int, seconds: float, done: threading.Event) -> Counter[str]:
+    # Statistical profile of the loop thread: folded stacks (root first) with sample counts.
+    stacks: Counter[str] = Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline and not done.is_set():
+        frame = sys._current_frames().get(thread_id)
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{frame.f_lineno})")
+            frame = frame.f_back
+        if names:
+            stacks[";".join(reversed(names))] += 1
+        time.sleep(SAMPLE_INTERVAL_SECONDS)
+    return stacks
+
+
+class DebugApi:
+    def __init__(self, token: str, tracemalloc_frames: int = 10) -> None:
+        self._token = token
+        self._frames = tracemalloc_frames
+        self._profiling = asyncio.Lock()
+        self._snapshot: tracemalloc.Snapshot | None = None
+
+    def register(self, app: web.Application) -> None:
+        app.router.add_get("/debug/profile", self.profile)
+        app.router.add_get("/debug/tracemalloc", self.memory)
+        app.router.add_get("/debug/tasks", self.tasks)
+
+    def _forbidden(self, request: web.Request) -> web.Response | None:
+        if request.query.get("token") != self._token:
+            return web.json_response({"status": "forbidden"}, status=403)
+        return None
+
+    async def profile(self, request: web.Request) -> web.Response:
+        if (denied := self._forbidden(request)) is not None:
+            return denied
+        try:
+            seconds = min(MAX_PROFILE_SECONDS, max(0.1, float(request.query.get("seconds", "10"))))
+            top = max(1, int(request.query.get("top", "40")))
+        except ValueError:
+            return web.json_response({"status": "bad_request", "error": "invalid seconds or top"}, status=400)
+        mode = request.query.get("mode", "cprofile")
+        if mode not in ("cprofile", "sample"):
+            return web.json_response({"status": "bad_request", "error": "mode must be cprofile or sample"}, status=400)
+        sort = request.query.get("sort", "cumulative")
+        if sort not in ("cumulative", "tottime", "calls"):
+            return web.json_response(
+                {"status": "bad_request", "error": "sort must be cumulative, tottime or calls"}, status=400
+            )
+        if self._profiling.locked():
+            return web.json_response({"status": "busy"}, status=409)
+
+        async with self._profiling:
+            log("debug.profile.start", mode=mode, seconds=seconds)
+            if mode == "cprofile":
+                profiler = cProfile.Profile()
+                profiler.enable()
+                try:
+                    await asyncio.sleep(seconds)
+                finally:
+                    profiler.disable()
+                out = io.StringIO()
+                stats = pstats.Stats(profiler, stream=out)
+                stats.sort_stats(sort).print_stats(top)
+                text = out.getvalue()
+            else:
+                done = threading.Event()
+                try:
+                    stacks = await asyncio.to_thread(_sample_stacks, threading.get_ident(), seconds, done)
+                finally:
+                    done.set()
+                # Folded format, ready for flamegraph.pl / speedscope.
+                text = "".join(f"{stack} {count}\n" for stack, count in stacks.most_common(top))
+            log("debug.profile.done", mode=mode, seconds=seconds)
+        return web.Response(text=text, content_type="text/plain", charset="utf-8")
+
+    async def memory(self, request: web.Request) -> web.Response:
+        # First call starts tracing; each later call diffs against the previous snapshot.
+        if (denied := self._forbidden(request)) is not None:
+            return denied
+        if request.query.get("stop"):
+            tracemalloc.stop()
+            self._snapshot = None
+            return web.json_response({"status": "stopped"})
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self._frames)
+            self._snapshot = tracemalloc.take_snapshot()
+            return web.json_response({"status": "started", "frames": self._frames})
+        try:
+            top = max(1, int(request.query.get("top", "25")))
+        except ValueError:
+            return web.json_response({"status": "bad_request", "error": "invalid top"}, status=400)
+        key = "traceback" if request.query.get("group") == "traceback" else "lineno"
+        snapshot = tracemalloc.take_snapshot()
+        previous = self._snapshot or snapshot
+        self._snapshot = snapshot
+        diff = snapshot.compare_to(previous, key)[:top]
+        current, peak = tracemalloc.get_traced_memory()
+        return web.json_response(
+            {
+                "traced_bytes": current,
+                "peak_bytes": peak,
+                "top": [
+                    {
+                        "location": str(stat.traceback) if key == "lineno" else [str(frame) for frame in stat.traceback],
+                        "size_bytes": stat.size,
+                        "size_diff_bytes": stat.size_diff,
+                        "count": stat.count,
+                        "count_diff": stat.count_diff,
+                    }
+                    for stat in diff
+                ],
+            }
+        )
+
+    async def tasks(self, request: web.Request) -> web.Response:
+        if (denied := self._forbidden(request)) is not None:
+            return denied
+        out = io.StringIO()
+        tasks = sorted(asyncio.all_tasks(), key=lambda task: task.get_name())
+        out.write(f"{len(tasks)} tasks\n\n")
+        for task in tasks:
+            out.write(f"{task.get_name()} {task.get_coro()!r}\n")
+            task.print_stack(file=out)
+            out.write("\n")
+        return web.Response(text=out.getvalue(), content_type="text/plain", charset="utf-8")
@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Iterable
+
+from aiohttp import web
+from psycopg_pool import AsyncConnectionPool
+
+from . import db
+from .intervals import EnergyInterval
+from .logger import log
+from .metrics import ERRORS
+from .tariffs import device_zone
+
+DEMAND_CHANNEL = 3
+
+
+def parse_windows(value: str | None) -> list[int]:
+    windows: set[int] = set()
+    for part in (value or "").split(","):
+        part = part.strip().lower().removesuffix("m")
+        if not part:
+            continue
+        minutes = int(part)
+        if minutes <= 0:
+            raise ValueError(f"invalid demand window: {part!r}")
+        windows.add(minutes)
+    return sorted(windows)
+
+
+class RollingDemand:
+    def __init__(self, minutes: int) -> None:
+        self.minutes = minutes
+        self._seconds = minutes * 60
+        self._buckets: deque[tuple[int, float]] = deque()
+        self._sum_wh = 0.0
+        self._end: int | None = None
+
+    def reset(self) -> None:
+        self._buckets.clear()
+        self._sum_wh = 0.0
+        self._end = None
+
+    def push(self, start: int, end: int, energy_wh: float) -> float | None:
+        if self._end is not None:
+            if start < self._end:
+                return None
+            if start > self._end:
+                # A gap would make the window average over missing data; start over.
+                self.reset()
+        self._buckets.append((start, energy_wh))
+        self._sum_wh += energy_wh
+        self._end = end
+        horizon = end - self._seconds
+        while self._buckets and self._buckets[0][0] < horizon:
+            self._sum_wh -= self._buckets.popleft()[1]
+        if not self._buckets:
+            self._sum_wh = 0.0
+        if not self._buckets or self._buckets[0][0] != horizon:
+            return None
+        # Wh over the window -> average kW.
+        return self._sum_wh * 3.6 / self._seconds
+
+
+@dataclass
+class DemandPeak:
+    ts: datetime
+    demand_kw: float
+
+
+@dataclass
+class _DeviceDemand:
+    windows: dict[int, RollingDemand]
+    timezone: str | None = None
+    period_start: date | None = None
+    current: dict[int, DemandPeak] = field(default_factory=dict)
+    peaks: dict[int, list[DemandPeak]] = field(default_factory=dict)
+    dirty: set[int] = field(default_factory=set)
+
+
+class DemandTracker:
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        windows: list[int],
+        top_n: int = 5,
+        limit_kw: float | None = None,
+        channel: int = DEMAND_CHANNEL,
+    ) -> None:
+        self._pool = pool
+        self._windows = windows
+        self._top_n = max(1, int(top_n))
+        self._limit_kw = limit_kw
+        self._channel = channel
+        self._devices: dict[str, _DeviceDemand] = {}
+
+    async def process(self, device_id: str, timezone_name: str | None, intervals: Iterable[EnergyInterval]) -> None:
+        if not self._windows:
+            return
+        state = self._devices.get(device_id)
+        if state is None:
+            state = self._devices[device_id] = _DeviceDemand({m: RollingDemand(m) for m in self._windows})
+        state.timezone = timezone_name
+        zone = device_zone(timezone_name)
+        rows = sorted(
+            (i for i in intervals if i.channel == self._channel and i.energy_wh is not None),
+            key=lambda i: i.start_ts,
+        )
+        for interval in rows:
+            period = interval.start_ts.astimezone(zone).date().replace(day=1)
+            if state.period_start is not None and period < state.period_start:
+                continue
+            if period != state.period_start:
+                await self._persist(device_id, state)
+                state.peaks = await self._load_peaks(device_id, period)
+                state.period_start = period
+                state.current.clear()
+            start = int(interval.start_ts.timestamp())
+            end = int(interval.end_ts.timestamp())
+            for minutes, window in state.windows.items():
+                demand_kw = window.push(start, end, float(interval.energy_wh))
+                if demand_kw is None:
+                    continue
+                candidate = DemandPeak(interval.end_ts, demand_kw)
+                state.current[minutes] = candidate
+                if self._offer(state.peaks.setdefault(minutes, []), candidate, minutes):
+                    state.dirty.add(minutes)
+        await self._persist(device_id, state)
+
+    async def recompute(
+        self,
+        device_id: str,
+        timezone_name: str | None,
+        start_ts: datetime,
+        end_ts: datetime,
+        period_seconds: int,
+    ) -> None:
+        # Gap-filled intervals land behind the live windows, which only move forward. Replay fresh windows
+        # over the stored intervals that can share a window with [start_ts, end_ts) and offer their peaks.
+        if not self._windows:
+            return
+        span = timedelta(minutes=max(self._windows))
+        rows = await db.fetch_energy_rows(self._pool, device_id, self._channel, start_ts - span, end_ts + span)
+        state = self._devices.get(device_id)
+        zone = device_zone(timezone_name)
+        windows = {m: RollingDemand(m) for m in self._windows}
+        periods: dict[date, dict[int, list[DemandPeak]]] = {}
+        dirty: dict[date, set[int]] = {}
+        for ts, energy_wh in rows:
+            if energy_wh is None:
+                continue
+            period = ts.astimezone(zone).date().replace(day=1)
+            if period not in periods:
+                if state is not None and period == state.period_start:
+                    periods[period] = state.peaks
+                else:
+                    periods[period] = await self._load_peaks(device_id, period)
+                dirty[period] = set()
+            start = int(ts.timestamp())
+            end = start + period_seconds
+            for minutes, window in windows.items():
+                demand_kw = window.push(start, end, float(energy_wh))
+                if demand_kw is None:
+                    continue
+                candidate = DemandPeak(datetime.fromtimestamp(end, tz=timezone.utc), demand_kw)
+                if self._offer(periods[period].setdefault(minutes, []), candidate, minutes):
+                    dirty[period].add(minutes)
+        for period, changed in dirty.items():
+            if state is not None and period == state.period_start:
+                state.dirty |= changed
+                await self._persist(device_id, state)
+            else:
+                await self._write_peaks(device_id, period, periods[period], changed)
+
+    def _offer(self, peaks: list[DemandPeak], candidate: DemandPeak, minutes: int) -> bool:
+        # Peaks are kept at least one window apart so a single event is not counted N times.
+        spacing = timedelta(minutes=minutes)
+        overlapping = [p for p in peaks if abs(p.ts - candidate.ts) < spacing]
+        if overlapping:
+            if candidate.demand_kw <= max(p.demand_kw for p in overlapping):
+                return False
+            peaks[:] = [p for p in peaks if p not in overlapping]
+        elif len(peaks) >= self._top_n and candidate.demand_kw <= peaks[-1].demand_kw:
+            return False
+        peaks.append(candidate)
+        peaks.sort(key=lambda p: p.demand_kw, reverse=True)
+        del peaks[self._top_n:]
+        return True
+
+    async def _load_peaks(self, device_id: str, period_start: date) -> dict[int, list[DemandPeak]]:
+        peaks: dict[int, list[DemandPeak]] = {}
+        for minutes, peak_ts, demand_kw in await db.fetch_demand_peaks(self._pool, device_id, period_start):
+            peaks.setdefault(minutes, []).append(DemandPeak(peak_ts, float(demand_kw)))
+        return peaks
+
+    async def _persist(self, device_id: str, state: _DeviceDemand) -> None:
+        if state.period_start is None:
+            return
+        await self._write_peaks(device_id, state.period_start, state.peaks, state.dirty)
+
+    async def _write_peaks(
+        self,
+        device_id: str,
+        period_start: date,
+        peaks_by_window: dict[int, list[DemandPeak]],
+        dirty: set[int],
+    ) -> None:
+        for minutes in sorted(dirty):
+            peaks = peaks_by_window.get(minutes, [])
+            try:
+                await db.replace_demand_peaks(
+                    self._pool,
+                    device_id,
+                    minutes,
+                    period_start,
+                    [(p.ts, p.demand_kw) for p in peaks],
+                )
+            except Exception as exc:  # noqa: BLE001
+                ERRORS.inc("demand")
+                log("demand.persist_error", device_id=device_id, window_minutes=minutes, error=str(exc))
+                continue
+            dirty.discard(minutes)
+            log("demand.peaks", device_id=device_id, window_minutes=minutes, peak_kw=peaks[0].demand_kw if peaks else None)
+
+    def period_peak(self, device_id: str, minutes: int) -> DemandPeak | None:
+        state = self._devices.get(device_id)
+        if state is None or not state.peaks.get(minutes):
+            return None
+        return state.peaks[minutes][0]
+
+    def snapshot(self, device_id: str) -> dict[str, Any]:
+        state = self._devices.get(device_id)
+        windows = []
+        for minutes in self._windows:
+            current = state.current.get(minutes) if state else None
+            peaks = state.peaks.get(minutes, []) if state else []
+            peak = peaks[0] if peaks else None
+            current_kw = current.demand_kw if current else None
+            windows.append(
+                {
+                    "minutes": minutes,
+                    "current_kw": current_kw,
+                    "current_ts": current.ts.isoformat() if current else None,
+                    "peak_kw": peak.demand_kw if peak else None,
+                    "peak_ts": peak.ts.isoformat() if peak else None,
+                    # How far demand can rise before it sets a new billing-period peak.
+                    "headroom_kw": peak.demand_kw - current_kw if peak and current_kw is not None else None,
+                    "limit_headroom_kw": (
+                        self._limit_kw - current_kw
+                        if self._limit_kw is not None and current_kw is not None
+                        else None
+                    ),
+                    "peaks": [{"ts": p.ts.isoformat(), "demand_kw": p.demand_kw} for p in peaks],
+                }
+            )
+        return {
+            "device_id": device_id,
+            "timezone": state.timezone if state else None,
+            "period_start": state.period_start.isoformat() if state and state.period_start else None,
+            "limit_kw": self._limit_kw,
+            "windows": windows,
+        }
+
+
+class DemandApi:
+    def __init__(self, tracker: DemandTracker, default_device: Callable[[], str | None]) -> None:
+        self._tracker = tracker
+        self._default_device = default_device
+
+    def register(self, app: web.Application) -> None:
+        app.router.add_get("/api/demand", self.demand)
+
+    async def demand(self, request: web.Request) -> web.Response:
+        device_id = request.query.get("device_id") or self._default_device()
+        if not device_id:
+            return web.json_response({"status": "bad_request", "error": "device_id is required"}, status=400)
+        return web.json_response(self._tracker.snapshot(device_id), headers={"Cache-Control": "no-cache"})
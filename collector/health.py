@@ -2,19 +2,32 @@ from __future__ import annotations
 
 from dataclasses import dataclass
 from datetime import datetime
+from typing import Any
 
 
 @dataclass
 class HealthState:
     last_live_poll: datetime | None = None
     last_interval_poll: datetime | None = None
+    last_interval_ingest: datetime | None = None
     last_retention_run: datetime | None = None
+    last_rollup_run: datetime | None = None
     last_error: str | None = None
+    spool_pending: int | None = None
+    loop_lag_ms: float | None = None
+    loop_lag_max_ms: float | None = None
+    interval_gap_records: int | None = None
 
-    def as_dict(self) -> dict[str, str | None]:
+    def as_dict(self) -> dict[str, Any]:
         return {
             "last_live_poll": self.last_live_poll.isoformat() if self.last_live_poll else None,
             "last_interval_poll": self.last_interval_poll.isoformat() if self.last_interval_poll else None,
+            "last_interval_ingest": self.last_interval_ingest.isoformat() if self.last_interval_ingest else None,
             "last_retention_run": self.last_retention_run.isoformat() if self.last_retention_run else None,
+            "last_rollup_run": self.last_rollup_run.isoformat() if self.last_rollup_run else None,
             "last_error": self.last_error,
+            "spool_pending": self.spool_pending,
+            "loop_lag_ms": self.loop_lag_ms,
+            "loop_lag_max_ms": self.loop_lag_max_ms,
+            "interval_gap_records": self.interval_gap_records,
         }
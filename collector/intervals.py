@@ -1,7 +1,7 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Any, Iterable
 
 from .ingest import parse_ts
@@ -18,6 +18,33 @@ class EnergyInterval:
     meta: dict[str, Any] | None
 
 
+def parse_emdata_blocks(payload: dict[str, Any]) -> list[tuple[datetime, datetime, int]]:
+    # EMData.GetRecords: (first record start, last record start, period) per block the device still holds,
+    # oldest first.
+    blocks = []
+    for block in payload.get("data_blocks") or []:
+        if not isinstance(block, dict) or not isinstance(block.get("ts"), (int, float)):
+            continue
+        period = _coerce_int(block.get("period")) or 0
+        records = _coerce_int(block.get("records")) or 0
+        if period <= 0 or records <= 0 or 86400 % period:
+            continue
+        start = datetime.fromtimestamp(int(block["ts"]), tz=timezone.utc)
+        blocks.append((start, start + timedelta(seconds=period * (records - 1)), period))
+    return sorted(blocks)
+
+
+def interval_row(interval: EnergyInterval) -> dict[str, Any]:
+    return {
+        "channel": interval.channel,
+        "start_ts": interval.start_ts,
+        "end_ts": interval.end_ts,
+        "energy_wh": interval.energy_wh,
+        "avg_power_w": interval.avg_power_w,
+        "meta": interval.meta,
+    }
+
+
 def parse_emdata_data(payload: dict[str, Any], device_id: str | None) -> Iterable[EnergyInterval]:
     keys = payload.get("keys")
     data = payload.get("data")
@@ -1,16 +1,159 @@
 from __future__ import annotations
 
+import atexit
 import json
 import sys
+import threading
+import time
+from collections import deque
 from datetime import datetime, timezone
 from typing import Any
 
+DEBUG = 10
+INFO = 20
+ERROR = 40
+LEVELS = {"debug": DEBUG, "info": INFO, "error": ERROR}
+_LEVEL_NAMES = {DEBUG: "debug", INFO: "info", ERROR: "error"}
 
-def _now_iso() -> str:
-    return datetime.now(timezone.utc).isoformat()
+_encode = json.JSONEncoder(default=str, ensure_ascii=False, separators=(",", ":")).encode
+
+_level = INFO
+_suppress_seconds = 60.0
+_flush_seconds = 0.2
+_queue_size = 10000
+_queue: deque[tuple[float, int, str, dict[str, Any]]] = deque()
+_enqueue = _queue.append
+_clock = time.time
+_dropped = 0
+_writer: threading.Thread | None = None
+_drain_lock = threading.Lock()
+# (level, event, encoded fields) -> [window start, suppressed count, last ts]
+_repeats: dict[tuple[int, str, str], list[float]] = {}
+_MAX_REPEAT_KEYS = 4096
+
+
+def configure(
+    level: str = "info",
+    suppress_seconds: float = 60.0,
+    flush_seconds: float = 0.2,
+    queue_size: int = 10000,
+) -> None:
+    global _level, _suppress_seconds, _flush_seconds, _queue_size
+    if level.lower() not in LEVELS:
+        raise ValueError(f"LOG_LEVEL must be one of {', '.join(LEVELS)}")
+    _level = LEVELS[level.lower()]
+    _suppress_seconds = max(0.0, suppress_seconds)
+    _flush_seconds = max(0.01, flush_seconds)
+    _queue_size = max(1, queue_size)
 
 
 def log(event: str, **fields: Any) -> None:
-    payload = {"ts": _now_iso(), "event": event, **fields}
-    sys.stdout.write(json.dumps(payload, default=str) + "\n")
-    sys.stdout.flush()
+    # The call site only enqueues; serialization, repeat suppression and writes happen on the
+    # writer thread, so a slow stdout never stalls the event loop.
+    level = ERROR if event.endswith("error") else INFO
+    if level >= _level:
+        _put(level, event, fields)
+
+
+def debug(event: str, **fields: Any) -> None:
+    if _level <= DEBUG:
+        _put(DEBUG, event, fields)
+
+
+def _put(level: int, event: str, fields: dict[str, Any]) -> None:
+    global _dropped
+    if len(_queue) >= _queue_size:
+        _dropped += 1
+        return
+    _enqueue((_clock(), level, event, fields))
+    if _writer is None:
+        _start()
+
+
+def flush() -> None:
+    _drain(final=True)
+
+
+def _start() -> None:
+    global _writer
+    with _drain_lock:
+        if _writer is not None:
+            return
+        _writer = threading.Thread(target=_run, name="log-writer", daemon=True)
+        _writer.start()
+    atexit.register(flush)
+
+
+def _run() -> None:
+    while True:
+        time.sleep(_flush_seconds)
+        try:
+            _drain()
+        except Exception as exc:  # noqa: BLE001
+            # The writer is never restarted, so it must outlive any bad batch.
+            try:
+                sys.stdout.write(_line(time.time(), ERROR, "log.writer_error", _encode({"error": repr(exc)})))
+                sys.stdout.flush()
+            except Exception:  # noqa: BLE001
+                pass
+
+
+def _line(ts: float, level: int, event: str, body: str, extra: str = "") -> str:
+    iso = datetime.fromtimestamp(ts, timezone.utc).isoformat()
+    head = f'{{"ts":"{iso}","level":"{_LEVEL_NAMES[level]}","event":{_encode(event)}{extra}'
+    return head + ("," + body[1:] if body != "{}" else "}") + "\n"
+
+
+def _summary(key: tuple[int, str, str], state: list[float]) -> str:
+    # e.g. poll.error with "repeated": 120 over "repeated_seconds": 1200 since the first occurrence.
+    level, event, body = key
+    extra = f',"repeated":{int(state[1])},"repeated_seconds":{round(state[2] - state[0], 1)}'
+    return _line(state[2], level, event, body, extra)
+
+
+def _drain(final: bool = False) -> None:
+    global _dropped
+    with _drain_lock:
+        lines: list[str] = []
+        repeats = _repeats
+        window = _suppress_seconds
+        while _queue:
+            ts, level, event, fields = _queue.popleft()
+            try:
+                body = _encode(fields)
+            except Exception as exc:  # noqa: BLE001
+                # Unserializable values, a raising __str__, or a dict mutated while queued.
+                body = _encode({"log_error": repr(exc)})
+            if window <= 0:
+                lines.append(_line(ts, level, event, body))
+                continue
+            key = (level, event, body)
+            state = repeats.get(key)
+            if state is not None and ts - state[0] < window:
+                state[1] += 1
+                state[2] = ts
+                continue
+            if state is not None and state[1]:
+                lines.append(_summary(key, state))
+            repeats[key] = [ts, 0, ts]
+            lines.append(_line(ts, level, event, body))
+
+        now = time.time()
+        if final or len(repeats) > _MAX_REPEAT_KEYS:
+            expired = list(repeats)
+        else:
+            expired = [key for key, state in repeats.items() if now - state[0] >= window]
+        for key in expired:
+            state = repeats.pop(key)
+            if state[1]:
+                lines.append(_summary(key, state))
+        if _dropped:
+            lines.append(_line(now, ERROR, "log.dropped", _encode({"events": _dropped})))
+            _dropped = 0
+        if not lines:
+            return
+        try:
+            sys.stdout.write("".join(lines))
+            sys.stdout.flush()
+        except (OSError, ValueError):
+            pass
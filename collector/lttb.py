@@ -0,0 +1,38 @@
+from __future__ import annotations
+
+from typing import Sequence
+
+
+def lttb_indices(xs: Sequence[float], ys: Sequence[float | None], threshold: int) -> list[int]:
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    values = [0.0 if y is None else float(y) for y in ys]
+    selected = [0]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        span = avg_end - avg_start
+        if span > 0:
+            avg_x = sum(xs[avg_start:avg_end]) / span
+            avg_y = sum(values[avg_start:avg_end]) / span
+        else:
+            avg_x, avg_y = xs[n - 1], values[n - 1]
+
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        ax, ay = xs[a], values[a]
+        best = range_start
+        best_area = -1.0
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (values[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > best_area:
+                best_area = area
+                best = j
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
@@ -3,35 +3,69 @@ from __future__ import annotations
 import asyncio
 import signal
 from dataclasses import dataclass
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
 from typing import Any
 
 from aiohttp import web
 
-from .alert import AlertConfig, AlertEngine
+from .alert import AlertEngine, AlertRule, load_db_rules, merge_rules, parse_rules, register_metrics
+from .api import QueryApi
+from .archive import archive_and_delete, require_pyarrow
+from .baseline import BaselineTracker
 from .config import Settings
+from .costs import CostAccrual
+from .coverage import day_bitmaps, merge_bitmaps, missing_ranges, range_records, slot_count
+from .debug import DebugApi, LagSampler
+from .demand import DemandApi, DemandTracker, parse_windows
 from .db import (
     create_pool,
     delete_power_readings_older_than,
     delete_power_readings_1m_older_than,
     delete_energy_intervals_older_than,
+    delete_energy_rollups_older_than,
+    delete_power_rollups_older_than,
     downsample_power_readings,
+    energy_rollup_key,
+    get_emdata_coverage,
+    get_emdata_watermark,
+    get_interval_starts,
+    power_rollup_key,
     insert_alert_event,
+    insert_energy_intervals_bulk,
     insert_power_reading,
     prune_power_storage_by_size,
+    rewind_rollup_watermarks,
+    rollup_energy_level,
+    rollup_power_level,
+    set_emdata_watermark,
     upsert_device_settings,
-    upsert_energy_interval,
+    upsert_emdata_coverage,
     upsert_energy_intervals_1h_range,
+    upsert_energy_local_days_range,
     upsert_power_readings_1m_range,
 )
 from .health import HealthState
-from .ingest import extract_power_reading
-from .intervals import parse_emdata_data
-from .logger import log
+from .ingest import PowerReading, extract_power_reading
+from .intervals import EnergyInterval, interval_row, parse_emdata_blocks, parse_emdata_data
+from .logger import configure as configure_logging, flush as flush_logs, log
+from .metrics import (
+    EMDATA_GAP_EXPIRY_SECONDS,
+    EMDATA_GAP_RECORDS,
+    EMDATA_LAG_SECONDS,
+    ERRORS,
+    INTERVALS_INGESTED,
+    ROWS_WRITTEN,
+    LoopMonitor,
+    MetricsApi,
+)
+from .rollups import RollupLevel, base_level, parse_levels
 from .shelly_rpc import ShellyRpc
-from .trigger import HttpTrigger
+from .spool import Spool, replay_spool_batch
+from .stream import BroadcastHub, StreamApi
+from .trigger import TriggerDispatcher
 
 ALERT_TYPE_HIGH_POWER = "HIGH_POWER"
+ALERT_TYPE_LOAD_ANOMALY = "LOAD_ANOMALY"
 
 
 def _utcnow() -> datetime:
@@ -70,58 +104,177 @@ def _timezone_from_sys_config(payload: dict[str, Any]) -> str | None:
     return None
 
 
+async def _store_power_reading(pool, spool: Spool | None, reading: PowerReading) -> bool:
+    if spool is not None and (spool.journal or spool.db_down):
+        spool.append_power_reading(reading)
+        return False
+    try:
+        await insert_power_reading(
+            pool,
+            reading.ts,
+            reading.device_id,
+            reading.total_power_w,
+            reading.phase_a_power_w,
+            reading.phase_b_power_w,
+            reading.phase_c_power_w,
+            reading.phase_a_voltage_v,
+            reading.phase_b_voltage_v,
+            reading.phase_c_voltage_v,
+            reading.phase_a_current_a,
+            reading.phase_b_current_a,
+            reading.phase_c_current_a,
+        )
+    except Exception as exc:  # noqa: BLE001
+        if spool is None:
+            raise
+        spool.append_power_reading(reading)
+        spool.db_down = True
+        log("spool.buffered", kind="power_reading", pending=spool.pending, error=str(exc))
+        return False
+    ROWS_WRITTEN.inc("power_readings")
+    return True
+
+
+async def _store_alert_event(
+    pool,
+    spool: Spool | None,
+    ts: datetime,
+    alert_type: str,
+    value: float | None,
+    details: dict[str, Any] | None,
+) -> None:
+    if spool is not None and (spool.journal or spool.db_down):
+        spool.append_alert_event(ts, alert_type, value, details)
+        return
+    try:
+        await insert_alert_event(pool, ts, alert_type, value, details)
+        ROWS_WRITTEN.inc("alert_events")
+    except Exception as exc:  # noqa: BLE001
+        if spool is None:
+            raise
+        spool.append_alert_event(ts, alert_type, value, details)
+        spool.db_down = True
+        log("spool.buffered", kind="alert_event", pending=spool.pending, error=str(exc))
+
+
 async def live_poll_loop(
     rpc: ShellyRpc,
     pool,
     alert_engine: AlertEngine,
-    trigger: HttpTrigger,
+    baseline: BaselineTracker | None,
+    trigger: TriggerDispatcher,
     low_res_minutes: int,
     poll_seconds: int,
     health: HealthState,
     device_ctx: DeviceContext,
+    spool: Spool | None,
+    hub: BroadcastHub | None,
     stop: asyncio.Event,
 ) -> None:
+    monitor = LoopMonitor("live")
     while not stop.is_set():
+        monitor.begin()
         try:
             status = await rpc.get_status()
             reading = extract_power_reading(status)
             device_ctx.device_id = reading.device_id or device_ctx.device_id
-            await insert_power_reading(
-                pool,
-                reading.ts,
-                reading.device_id,
-                reading.total_power_w,
-                reading.phase_a_power_w,
-                reading.phase_b_power_w,
-                reading.phase_c_power_w,
-                reading.phase_a_voltage_v,
-                reading.phase_b_voltage_v,
-                reading.phase_c_voltage_v,
-                reading.phase_a_current_a,
-                reading.phase_b_current_a,
-                reading.phase_c_current_a,
-            )
+            if hub is not None:
+                hub.publish_reading(reading)
+            stored = await _store_power_reading(pool, spool, reading)
             health.last_live_poll = _utcnow()
-            triggered = await alert_engine.process(ALERT_TYPE_HIGH_POWER, reading.total_power_w)
-            if triggered:
-                log("alert.triggered", type=ALERT_TYPE_HIGH_POWER, value=reading.total_power_w)
-                await insert_alert_event(
+            # While the spool holds writes for a down database, state writes are deferred too: each
+            # would otherwise wait out DATABASE_TIMEOUT_SECONDS and cost polls.
+            db_up = spool is None or not spool.db_down
+            if baseline is not None:
+                await baseline.observe(reading, device_ctx.timezone, load=db_up)
+            fired = await alert_engine.process(reading, persist=db_up)
+            for alert in fired:
+                log("alert.triggered", type=alert.rule.name, metric=alert.rule.metric, value=alert.value)
+                await _store_alert_event(
                     pool,
-                    _utcnow(),
-                    ALERT_TYPE_HIGH_POWER,
-                    reading.total_power_w,
-                    {"device_id": reading.device_id},
+                    spool,
+                    alert.ts,
+                    alert.rule.name,
+                    alert.value,
+                    {"device_id": reading.device_id, "metric": alert.rule.metric, "threshold": alert.rule.threshold},
                 )
-                asyncio.create_task(trigger.pulse())
-            if low_res_minutes and low_res_minutes > 0:
+            if any(alert.rule.trigger for alert in fired):
+                trigger.pulse()
+            if baseline is not None and db_up:
+                await baseline.checkpoint()
+            if spool is not None and spool.needs_flush():
+                await spool.flush()
+            if stored and low_res_minutes and low_res_minutes > 0:
                 bucket_seconds = max(60, int(low_res_minutes) * 60)
                 bucket_start = _bucket_start(reading.ts, bucket_seconds)
                 bucket_end = bucket_start + timedelta(seconds=bucket_seconds)
                 await upsert_power_readings_1m_range(pool, bucket_start, bucket_end, bucket_seconds)
         except Exception as exc:  # noqa: BLE001
             health.last_error = str(exc)
+            ERRORS.inc("live")
             log("poll.error", loop="live", error=str(exc))
-        await asyncio.sleep(poll_seconds)
+        await monitor.sleep(poll_seconds)
+
+
+async def spool_loop(
+    spool: Spool,
+    pool,
+    low_res_minutes: int,
+    power_rollups: list[str],
+    flush_seconds: float,
+    replay_batch: int,
+    replay_rows_per_second: int,
+    health: HealthState,
+    stop: asyncio.Event,
+) -> None:
+    while not stop.is_set():
+        delay = flush_seconds
+        try:
+            await spool.flush()
+            if spool.pending:
+                replayed = await replay_spool_batch(spool, pool, replay_batch, low_res_minutes, power_rollups)
+                if replayed:
+                    log("spool.replayed", count=replayed, pending=spool.pending)
+                    if spool.pending:
+                        delay = replayed / max(1, replay_rows_per_second)
+        except Exception as exc:  # noqa: BLE001
+            health.last_error = str(exc)
+            ERRORS.inc("spool")
+            log("spool.error", error=str(exc), pending=spool.pending)
+        health.spool_pending = spool.pending
+        await asyncio.sleep(delay)
+
+
+async def _store_interval_chunk(
+    pool,
+    device_ctx: DeviceContext,
+    intervals: list[EnergyInterval],
+    chunk_start: datetime,
+    period: int,
+    bucket_seconds: int,
+    energy_rollups: list[str],
+    costs: CostAccrual | None,
+) -> datetime:
+    await insert_energy_intervals_bulk(pool, device_ctx.device_id, period, [interval_row(i) for i in intervals])
+    last_interval_ts = max(i.start_ts for i in intervals)
+    hour_start = chunk_start.replace(minute=0, second=0, microsecond=0)
+    hour_end = last_interval_ts.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    await upsert_energy_intervals_1h_range(pool, hour_start, hour_end, bucket_seconds)
+    await rewind_rollup_watermarks(pool, energy_rollups, hour_start)
+    await upsert_energy_local_days_range(pool, chunk_start, last_interval_ts + timedelta(seconds=period))
+    if costs is not None and device_ctx.device_id:
+        try:
+            priced = await costs.accrue(
+                device_ctx.device_id,
+                device_ctx.timezone,
+                chunk_start,
+                last_interval_ts + timedelta(seconds=period),
+            )
+            ROWS_WRITTEN.inc("energy_costs_daily", amount=priced)
+        except Exception as exc:  # noqa: BLE001
+            ERRORS.inc("costs")
+            log("costs.error", error=str(exc))
+    return last_interval_ts
 
 
 async def interval_poll_loop(
@@ -133,24 +286,36 @@ async def interval_poll_loop(
     max_records_per_call: int,
     max_chunks_per_poll: int,
     interval_bucket_hours: int,
+    energy_levels: list[RollupLevel],
     poll_seconds: int,
     health: HealthState,
+    demand: DemandTracker | None,
+    costs: CostAccrual | None,
     stop: asyncio.Event,
 ) -> None:
+    energy_rollups = [energy_rollup_key(level) for level in energy_levels[1:]]
     last_record_ts: datetime | None = None
+    watermark_device: str | None = None
+    monitor = LoopMonitor("interval")
     while not stop.is_set():
+        monitor.begin()
         try:
+            if device_ctx.device_id and watermark_device != device_ctx.device_id:
+                # Resume from the persisted watermark; lookback only applies to a device never ingested.
+                last_record_ts = await get_emdata_watermark(pool, device_ctx.device_id, emdata_id)
+                watermark_device = device_ctx.device_id
+                log("intervals.resume", device_id=watermark_device, last_record_ts=last_record_ts)
             records_payload = await rpc.get_emdata_records({"id": emdata_id})
             data_blocks = records_payload.get("data_blocks")
             if not isinstance(data_blocks, list) or not data_blocks:
                 log("intervals.no_blocks")
-                await asyncio.sleep(poll_seconds)
+                await monitor.sleep(poll_seconds)
                 continue
 
             candidates = [b for b in data_blocks if isinstance(b, dict) and isinstance(b.get("ts"), (int, float))]
             if not candidates:
                 log("intervals.no_valid_blocks")
-                await asyncio.sleep(poll_seconds)
+                await monitor.sleep(poll_seconds)
                 continue
             latest_block = max(candidates, key=lambda b: b["ts"])
             block_ts = int(latest_block["ts"])
@@ -158,12 +323,18 @@ async def interval_poll_loop(
             records = int(latest_block.get("records", 0))
             if period <= 0 or records <= 0:
                 log("intervals.bad_block", block=latest_block)
-                await asyncio.sleep(poll_seconds)
+                await monitor.sleep(poll_seconds)
                 continue
 
             block_start = datetime.fromtimestamp(block_ts, tz=timezone.utc)
             block_end = block_start + timedelta(seconds=period * (records - 1))
 
+            if last_record_ts is not None and last_record_ts > block_end + timedelta(seconds=period):
+                # EMData was reset, or the device clock ran ahead before NTP sync: the watermark points past
+                # anything the device holds. Start over from the lookback; the next chunk lowers the watermark.
+                log("intervals.watermark_ahead", last_record_ts=last_record_ts, block_end=block_end)
+                last_record_ts = None
+
             if last_record_ts is None:
                 if lookback_records > 0:
                     lookback_start = block_end - timedelta(seconds=period * (lookback_records - 1))
@@ -172,10 +343,19 @@ async def interval_poll_loop(
                     start_ts = block_start
             else:
                 start_ts = max(block_start, last_record_ts + timedelta(seconds=period))
+                if last_record_ts + timedelta(seconds=period) < block_start:
+                    log(
+                        "intervals.watermark_expired",
+                        last_record_ts=last_record_ts,
+                        block_start=block_start,
+                        lost_records=int((block_start - last_record_ts).total_seconds()) // period - 1,
+                    )
 
             if start_ts > block_end:
+                if last_record_ts is not None:
+                    EMDATA_LAG_SECONDS.set((_utcnow() - last_record_ts).total_seconds() - period)
                 log("intervals.up_to_date")
-                await asyncio.sleep(poll_seconds)
+                await monitor.sleep(poll_seconds)
                 continue
 
             max_records = max(1, int(max_records_per_call))
@@ -194,26 +374,22 @@ async def interval_poll_loop(
                 if not intervals:
                     log("intervals.empty_chunk", start_ts=chunk_start, end_ts=chunk_end)
                     break
-                for interval in intervals:
-                    await upsert_energy_interval(
-                        pool,
-                        interval.device_id,
-                        interval.channel,
-                        interval.start_ts,
-                        interval.end_ts,
-                        interval.energy_wh,
-                        interval.avg_power_w,
-                        interval.meta,
-                    )
-                    inserted += 1
-                last_interval_ts = max(i.start_ts for i in intervals)
-                hour_start = chunk_start.replace(minute=0, second=0, microsecond=0)
-                hour_end = last_interval_ts.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
-                await upsert_energy_intervals_1h_range(pool, hour_start, hour_end, bucket_seconds)
+                last_interval_ts = await _store_interval_chunk(
+                    pool, device_ctx, intervals, chunk_start, period, bucket_seconds, energy_rollups, costs
+                )
+                inserted += len(intervals)
+                health.last_interval_ingest = _utcnow()
+                if demand is not None and device_ctx.device_id:
+                    await demand.process(device_ctx.device_id, device_ctx.timezone, intervals)
+                if device_ctx.device_id:
+                    await set_emdata_watermark(pool, device_ctx.device_id, emdata_id, last_interval_ts)
                 chunk_start = last_interval_ts + timedelta(seconds=period)
                 chunks += 1
             if last_interval_ts is not None:
                 last_record_ts = last_interval_ts
+                EMDATA_LAG_SECONDS.set((_utcnow() - last_record_ts).total_seconds() - period)
+            INTERVALS_INGESTED.inc(amount=inserted)
+            ROWS_WRITTEN.inc("energy_intervals", amount=inserted)
             health.last_interval_poll = _utcnow()
             log(
                 "intervals.ingested",
@@ -224,8 +400,131 @@ async def interval_poll_loop(
             )
         except Exception as exc:  # noqa: BLE001
             health.last_error = str(exc)
+            ERRORS.inc("interval")
             log("poll.error", loop="interval", error=str(exc))
-        await asyncio.sleep(poll_seconds)
+        await monitor.sleep(poll_seconds)
+
+
+def _midnight(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+
+
+async def gap_fill_loop(
+    rpc: ShellyRpc,
+    pool,
+    device_ctx: DeviceContext,
+    emdata_id: int,
+    max_records_per_call: int,
+    max_chunks_per_run: int,
+    interval_bucket_hours: int,
+    energy_levels: list[RollupLevel],
+    run_seconds: int,
+    health: HealthState,
+    demand: DemandTracker | None,
+    costs: CostAccrual | None,
+    stop: asyncio.Event,
+) -> None:
+    # Re-fetches records missing below the interval loop's watermark. The device overwrites its oldest
+    # records first, so gaps are filled oldest first: a gap's start minus the window start is its time left.
+    energy_rollups = [energy_rollup_key(level) for level in energy_levels[1:]]
+    bucket_seconds = max(1, int(interval_bucket_hours)) * 3600
+    step_records = max(1, int(max_records_per_call))
+    # Slots the device was asked for and did not return; retried only after a restart.
+    unavailable: dict[date, str] = {}
+    monitor = LoopMonitor("gap_fill")
+    while not stop.is_set():
+        monitor.begin()
+        try:
+            device_id = device_ctx.device_id
+            watermark = await get_emdata_watermark(pool, device_id, emdata_id) if device_id else None
+            blocks = parse_emdata_blocks(await rpc.get_emdata_records({"id": emdata_id})) if watermark else []
+            if not blocks:
+                await monitor.sleep(run_seconds)
+                continue
+            period = blocks[-1][2]
+            window_start = blocks[0][0]
+            first_day = window_start.date()
+            last_day = watermark.date()
+            bitmaps = await get_emdata_coverage(pool, device_id, period, first_day, last_day)
+            unseeded = [
+                first_day + timedelta(days=n)
+                for n in range((last_day - first_day).days + 1)
+                if first_day + timedelta(days=n) not in bitmaps
+            ]
+            if unseeded:
+                # Days ingested before the coverage index existed (or never): build their bitmaps once.
+                starts = await get_interval_starts(
+                    pool, device_id, _midnight(unseeded[0]), _midnight(unseeded[-1]) + timedelta(days=1)
+                )
+                seeded = day_bitmaps(starts, period)
+                seeded = {day: seeded.get(day, "0" * slot_count(period)) for day in unseeded}
+                await upsert_emdata_coverage(pool, device_id, period, seeded)
+                bitmaps.update(seeded)
+                log("gaps.seeded", days=len(seeded), first_day=unseeded[0], last_day=unseeded[-1])
+
+            known = merge_bitmaps(bitmaps, unavailable)
+            gaps = []
+            for block_start, block_end, block_period in blocks:
+                end = min(block_end, watermark)
+                if block_period == period and block_start <= end:
+                    gaps.extend(missing_ranges(known, block_start, end, period))
+            missing = sum(range_records(first, last, period) for first, last in gaps)
+            EMDATA_GAP_RECORDS.set(missing)
+            EMDATA_GAP_EXPIRY_SECONDS.set((gaps[0][0] - window_start).total_seconds() if gaps else 0)
+            health.interval_gap_records = missing
+
+            filled = 0
+            chunks = 0
+            for first, last in gaps:
+                chunk_start = first
+                while chunk_start <= last and chunks < max_chunks_per_run and not stop.is_set():
+                    chunk_end = min(last, chunk_start + timedelta(seconds=period * (step_records - 1)))
+                    data_payload = await rpc.get_emdata_data(
+                        {"id": emdata_id, "ts": int(chunk_start.timestamp()), "end_ts": int(chunk_end.timestamp())}
+                    )
+                    chunks += 1
+                    intervals = [
+                        i for i in parse_emdata_data(data_payload, device_id) if chunk_start <= i.start_ts <= chunk_end
+                    ]
+                    returned = {i.start_ts for i in intervals}
+                    absent = [
+                        chunk_start + timedelta(seconds=period * n)
+                        for n in range(range_records(chunk_start, chunk_end, period))
+                        if chunk_start + timedelta(seconds=period * n) not in returned
+                    ]
+                    if absent:
+                        unavailable = merge_bitmaps(unavailable, day_bitmaps(absent, period))
+                        log("gaps.unavailable", start_ts=chunk_start, end_ts=chunk_end, records=len(absent))
+                    if intervals:
+                        await _store_interval_chunk(
+                            pool, device_ctx, intervals, chunk_start, period, bucket_seconds, energy_rollups, costs
+                        )
+                        filled += len(returned)
+                        health.last_interval_ingest = _utcnow()
+                        if demand is not None:
+                            await demand.recompute(
+                                device_id,
+                                device_ctx.timezone,
+                                chunk_start,
+                                chunk_end + timedelta(seconds=period),
+                                period,
+                            )
+                        INTERVALS_INGESTED.inc(amount=len(intervals))
+                        ROWS_WRITTEN.inc("energy_intervals", amount=len(intervals))
+                    chunk_start = chunk_end + timedelta(seconds=period)
+            if gaps:
+                log(
+                    "gaps.filled",
+                    missing=missing,
+                    filled=filled,
+                    chunks=chunks,
+                    oldest=gaps[0][0],
+                    expires_in_seconds=int((gaps[0][0] - window_start).total_seconds()),
+                )
+        except Exception as exc:  # noqa: BLE001
+            ERRORS.inc("gap_fill")
+            log("poll.error", loop="gap_fill", error=str(exc))
+        await monitor.sleep(run_seconds)
 
 
 async def retention_loop(
@@ -237,10 +536,19 @@ async def retention_loop(
     interval_raw_max_days: int | None,
     prune_include_intervals: bool,
     max_db_mb: int | None,
+    archive_dir: str | None,
     health: HealthState,
     stop: asyncio.Event,
 ) -> None:
+    async def archive(table: str, cutoff: datetime) -> int:
+        archived, deleted = await archive_and_delete(pool, archive_dir, table, cutoff)
+        if archived:
+            log("retention.archive", table=table, archived=archived, cutoff=cutoff)
+        return deleted
+
+    monitor = LoopMonitor("retention")
     while not stop.is_set():
+        monitor.begin()
         try:
             if downsample_after_hours and downsample_after_hours > 0:
                 inserted = await downsample_power_readings(
@@ -248,6 +556,7 @@ async def retention_loop(
                     downsample_after_hours,
                     low_res_minutes * 60,
                 )
+                ROWS_WRITTEN.inc("power_readings_1m", amount=inserted)
                 deleted = await delete_power_readings_older_than(pool, downsample_after_hours)
                 log(
                     "retention.downsample",
@@ -258,12 +567,20 @@ async def retention_loop(
                 )
 
             if low_res_max_days and low_res_max_days > 0:
-                low_res_deleted = await delete_power_readings_1m_older_than(pool, low_res_max_days)
+                if archive_dir:
+                    cutoff = _utcnow() - timedelta(days=low_res_max_days)
+                    low_res_deleted = await archive("power_readings_1m", cutoff)
+                else:
+                    low_res_deleted = await delete_power_readings_1m_older_than(pool, low_res_max_days)
                 if low_res_deleted:
                     log("retention.low_res_prune", deleted=low_res_deleted, older_than_days=low_res_max_days)
 
             if interval_raw_max_days and interval_raw_max_days > 0:
-                interval_deleted = await delete_energy_intervals_older_than(pool, interval_raw_max_days)
+                if archive_dir:
+                    cutoff = _utcnow() - timedelta(days=interval_raw_max_days)
+                    interval_deleted = await archive("energy_intervals", cutoff)
+                else:
+                    interval_deleted = await delete_energy_intervals_older_than(pool, interval_raw_max_days)
                 if interval_deleted:
                     log(
                         "retention.interval_raw_prune",
@@ -277,6 +594,7 @@ async def retention_loop(
                     pool,
                     max_bytes=max_bytes,
                     include_intervals=prune_include_intervals,
+                    archive_delete=archive if archive_dir else None,
                 )
                 if deleted["raw"] or deleted["low"] or deleted["intervals"]:
                     log(
@@ -292,11 +610,67 @@ async def retention_loop(
             health.last_retention_run = _utcnow()
         except Exception as exc:  # noqa: BLE001
             health.last_error = str(exc)
+            ERRORS.inc("retention")
             log("retention.error", error=str(exc))
-        await asyncio.sleep(run_seconds)
+        await monitor.sleep(run_seconds)
 
 
-async def health_app(health: HealthState, trigger: HttpTrigger, settings: Settings) -> web.Application:
+async def rollup_loop(
+    pool,
+    power_levels: list[RollupLevel],
+    energy_levels: list[RollupLevel],
+    run_seconds: int,
+    costs: CostAccrual | None,
+    cost_refresh_days: int,
+    health: HealthState,
+    stop: asyncio.Event,
+) -> None:
+    pyramids = (
+        ("power", power_levels, rollup_power_level, delete_power_rollups_older_than),
+        ("energy", energy_levels, rollup_energy_level, delete_energy_rollups_older_than),
+    )
+    monitor = LoopMonitor("rollup")
+    while not stop.is_set():
+        monitor.begin()
+        try:
+            now = _utcnow()
+            for kind, levels, rollup, prune in pyramids:
+                cutoff = levels[0].floor(now)
+                for source, level in zip(levels, levels[1:]):
+                    inserted, cutoff = await rollup(pool, level, source, cutoff, source is levels[0])
+                    ROWS_WRITTEN.inc(f"{kind}_rollups", amount=inserted)
+                    deleted = 0
+                    if level.retention_days and level.retention_days > 0:
+                        deleted = await prune(pool, level.name, level.retention_days)
+                    if inserted or deleted:
+                        log(
+                            "rollup.level",
+                            kind=kind,
+                            level=level.name,
+                            inserted=inserted,
+                            deleted=deleted,
+                            cutoff=cutoff,
+                        )
+            health.last_rollup_run = _utcnow()
+            if costs is not None:
+                await costs.refresh(cost_refresh_days)
+        except Exception as exc:  # noqa: BLE001
+            health.last_error = str(exc)
+            ERRORS.inc("rollup")
+            log("rollup.error", error=str(exc))
+        await monitor.sleep(run_seconds)
+
+
+async def health_app(
+    health: HealthState,
+    trigger: TriggerDispatcher,
+    settings: Settings,
+    api: QueryApi | None = None,
+    stream: StreamApi | None = None,
+    metrics: MetricsApi | None = None,
+    demand: DemandApi | None = None,
+    debug: DebugApi | None = None,
+) -> web.Application:
     app = web.Application()
 
     async def handle(request: web.Request) -> web.Response:
@@ -308,22 +682,60 @@ async def health_app(health: HealthState, trigger: HttpTrigger, settings: Settin
             provided = request.query.get("token")
             if provided != token:
                 return web.json_response({"status": "forbidden"}, status=403)
-        asyncio.create_task(trigger.pulse())
+        trigger.pulse()
         return web.json_response({"status": "triggered"})
 
     app.router.add_get("/healthz", handle)
     app.router.add_get("/trigger/test", trigger_test)
+    if api is not None:
+        api.register(app)
+    if stream is not None:
+        stream.register(app)
+    if metrics is not None:
+        metrics.register(app)
+    if demand is not None:
+        demand.register(app)
+    if debug is not None:
+        debug.register(app)
     return app
 
 
 async def run() -> None:
     settings = Settings()
+    configure_logging(
+        settings.LOG_LEVEL,
+        settings.LOG_SUPPRESS_SECONDS,
+        settings.LOG_FLUSH_SECONDS,
+        settings.LOG_QUEUE_SIZE,
+    )
     health = HealthState()
     device_ctx = DeviceContext()
 
-    pool = create_pool(settings.DATABASE_URL)
+    power_base = base_level(
+        f"{settings.RETENTION_LOW_RES_MINUTES}m",
+        max(60, settings.RETENTION_LOW_RES_MINUTES * 60),
+        settings.RETENTION_LOW_RES_MAX_DAYS,
+    )
+    energy_base = base_level(
+        f"{settings.RETENTION_INTERVAL_LOW_RES_HOURS}h",
+        max(1, settings.RETENTION_INTERVAL_LOW_RES_HOURS) * 3600,
+    )
+    power_levels = [power_base, *parse_levels(settings.ROLLUP_POWER_LEVELS, power_base)]
+    energy_levels = [energy_base, *parse_levels(settings.ROLLUP_ENERGY_LEVELS, energy_base)]
+
+    pool = create_pool(settings.DATABASE_URL, settings.DATABASE_TIMEOUT_SECONDS)
     await pool.open()
 
+    if settings.ARCHIVE_DIR:
+        require_pyarrow()
+
+    spool: Spool | None = None
+    if settings.SPOOL_PATH:
+        spool = Spool(settings.SPOOL_PATH, settings.SPOOL_MODE, settings.SPOOL_MAX_RECORDS)
+        spool.open()
+        health.spool_pending = spool.pending
+        log("spool.opened", path=settings.SPOOL_PATH, mode=settings.SPOOL_MODE, pending=spool.pending)
+
     rpc = ShellyRpc(settings.shelly_base_url, settings.SHELLY_TIMEOUT_MS)
 
     try:
@@ -341,23 +753,63 @@ async def run() -> None:
     except Exception as exc:  # noqa: BLE001
         log("device.config.error", error=str(exc))
 
-    trigger = HttpTrigger(
+    trigger = TriggerDispatcher(
         settings.TRIGGER_HTTP_URL,
         settings.TRIGGER_HTTP_ON_URL,
         settings.TRIGGER_HTTP_OFF_URL,
         settings.TRIGGER_HTTP_METHOD,
         settings.ALERT_TRIGGER_SECONDS,
+        settings.TRIGGER_MAX_CONCURRENCY,
+        settings.TRIGGER_RETRIES,
     )
 
-    alert_engine = AlertEngine(
-        AlertConfig(
-            threshold_w=settings.ALERT_POWER_W,
+    hub = BroadcastHub(settings.STREAM_QUEUE_SIZE, settings.STREAM_MAX_CLIENTS)
+
+    baseline = None
+    if settings.BASELINE_ENABLED:
+        baseline = BaselineTracker(
+            pool,
+            settings.BASELINE_BUCKET_MINUTES,
+            settings.BASELINE_ALPHA,
+            settings.BASELINE_MIN_WEEKS,
+            settings.BASELINE_MIN_STD_W,
+            settings.BASELINE_CHECKPOINT_SECONDS,
+        )
+        register_metrics(baseline.metrics())
+
+    rules = [
+        AlertRule(
+            name=ALERT_TYPE_HIGH_POWER,
+            metric="total_power_w",
+            threshold=settings.ALERT_POWER_W,
             sustain_seconds=settings.ALERT_SUSTAIN_SECONDS,
             cooldown_seconds=settings.ALERT_COOLDOWN_SECONDS,
-        ),
-        pool,
-    )
-    await alert_engine.load_state(ALERT_TYPE_HIGH_POWER)
+            trigger=True,
+        )
+    ]
+    if baseline is not None and settings.BASELINE_ANOMALY_Z is not None:
+        rules.append(
+            AlertRule(
+                name=ALERT_TYPE_LOAD_ANOMALY,
+                metric="baseline_zscore",
+                threshold=settings.BASELINE_ANOMALY_Z,
+                sustain_seconds=settings.BASELINE_ANOMALY_SUSTAIN_SECONDS,
+                cooldown_seconds=settings.ALERT_COOLDOWN_SECONDS,
+                trigger=settings.BASELINE_ANOMALY_TRIGGER,
+            )
+        )
+    try:
+        db_rules = await load_db_rules(pool)
+    except Exception as exc:  # noqa: BLE001
+        db_rules = []
+        log("alert.rules.db_error", error=str(exc))
+    rules = merge_rules(rules, parse_rules(settings.ALERT_RULES), db_rules)
+    log("alert.rules", rules=[rule.name for rule in rules])
+    alert_engine = AlertEngine(rules, pool, hub, settings.ALERT_STATE_PERSIST_SECONDS)
+    try:
+        await alert_engine.load_state()
+    except Exception as exc:  # noqa: BLE001
+        log("alert.state.error", error=str(exc))
 
     stop = asyncio.Event()
     loop = asyncio.get_running_loop()
@@ -367,7 +819,35 @@ async def run() -> None:
         except (AttributeError, NotImplementedError):
             pass
 
-    app = await health_app(health, trigger, settings)
+    api = QueryApi(
+        pool,
+        health,
+        power_levels,
+        energy_levels,
+        lambda: device_ctx.device_id,
+        settings.API_CACHE_ENTRIES,
+        settings.API_MAX_POINTS,
+        settings.TARIFF_SHAPE_CACHE_DIR,
+        settings.TARIFF_COMPARE_WORKERS,
+        lambda: device_ctx.timezone,
+    )
+    costs = CostAccrual(pool) if settings.COSTS_ENABLED else None
+    demand = DemandTracker(
+        pool,
+        parse_windows(settings.DEMAND_WINDOWS),
+        settings.DEMAND_TOP_N,
+        settings.DEMAND_LIMIT_KW,
+    )
+    app = await health_app(
+        health,
+        trigger,
+        settings,
+        api,
+        StreamApi(hub),
+        MetricsApi(pool),
+        DemandApi(demand, lambda: device_ctx.device_id),
+        DebugApi(settings.DEBUG_TOKEN, settings.DEBUG_TRACEMALLOC_FRAMES) if settings.DEBUG_TOKEN else None,
+    )
     runner = web.AppRunner(app)
     await runner.setup()
     site = web.TCPSite(runner, "0.0.0.0", settings.HEALTHZ_PORT)
@@ -376,16 +856,20 @@ async def run() -> None:
     log("service.started", port=settings.HEALTHZ_PORT)
 
     tasks = [
+        asyncio.create_task(LagSampler(health, settings.LOOP_LAG_SAMPLE_SECONDS).run(stop)),
         asyncio.create_task(
             live_poll_loop(
                 rpc,
                 pool,
                 alert_engine,
+                baseline,
                 trigger,
                 settings.RETENTION_LOW_RES_MINUTES,
                 settings.POLL_LIVE_SECONDS,
                 health,
                 device_ctx,
+                spool,
+                hub,
                 stop,
             )
         ),
@@ -399,8 +883,11 @@ async def run() -> None:
                 settings.EMDATA_MAX_RECORDS,
                 settings.EMDATA_MAX_CHUNKS_PER_POLL,
                 settings.RETENTION_INTERVAL_LOW_RES_HOURS,
+                energy_levels,
                 settings.POLL_INTERVAL_DATA_SECONDS,
                 health,
+                demand,
+                costs,
                 stop,
             )
         ),
@@ -414,19 +901,77 @@ async def run() -> None:
                 settings.RETENTION_INTERVAL_RAW_MAX_DAYS,
                 settings.RETENTION_PRUNE_INCLUDE_INTERVALS,
                 settings.RETENTION_MAX_DB_MB,
+                settings.ARCHIVE_DIR,
+                health,
+                stop,
+            )
+        ),
+        asyncio.create_task(
+            rollup_loop(
+                pool,
+                power_levels,
+                energy_levels,
+                settings.ROLLUP_RUN_SECONDS,
+                costs,
+                settings.COSTS_REFRESH_MAX_DAYS,
                 health,
                 stop,
             )
         ),
     ]
+    if spool is not None:
+        tasks.append(
+            asyncio.create_task(
+                spool_loop(
+                    spool,
+                    pool,
+                    settings.RETENTION_LOW_RES_MINUTES,
+                    [power_rollup_key(level) for level in power_levels[1:]],
+                    settings.SPOOL_FLUSH_SECONDS,
+                    settings.SPOOL_REPLAY_BATCH,
+                    settings.SPOOL_REPLAY_ROWS_PER_SECOND,
+                    health,
+                    stop,
+                )
+            )
+        )
+    if settings.GAP_FILL_ENABLED:
+        tasks.append(
+            asyncio.create_task(
+                gap_fill_loop(
+                    rpc,
+                    pool,
+                    device_ctx,
+                    settings.EM_DATA_ID,
+                    settings.EMDATA_MAX_RECORDS,
+                    settings.GAP_FILL_MAX_CHUNKS,
+                    settings.RETENTION_INTERVAL_LOW_RES_HOURS,
+                    energy_levels,
+                    settings.GAP_FILL_SECONDS,
+                    health,
+                    demand,
+                    costs,
+                    stop,
+                )
+            )
+        )
 
     await stop.wait()
     log("service.stopping")
     for task in tasks:
         task.cancel()
     await asyncio.gather(*tasks, return_exceptions=True)
+    hub.close()
+    await alert_engine.persist()
+    if baseline is not None:
+        await baseline.checkpoint(force=True)
     await runner.cleanup()
+    api.close()
+    await trigger.close()
+    if spool is not None:
+        spool.close()
     await pool.close()
+    flush_logs()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import math
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, TypeVar
+
+from aiohttp import web
+
+R = TypeVar("R")
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    value = float(value)
+    if value.is_integer():
+        return str(int(value))
+    if math.isfinite(value):
+        return repr(value)
+    return "NaN" if math.isnan(value) else ("+Inf" if value > 0 else "-Inf")
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        REGISTRY.append(self)
+
+    def render(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labelnames: tuple[str, ...] = ()) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def set(self, value: float, *labels: str) -> None:
+        self._values[labels] = value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, help_text, labelnames)
+        self._buckets = buckets
+        # Per-label state: [count per bucket (+Inf last)..., sum]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        state = self._values.get(labels)
+        if state is None:
+            state = self._values[labels] = [0.0] * (len(self._buckets) + 2)
+        state[bisect_left(self._buckets, value)] += 1
+        state[-1] += value
+
+    def render(self) -> list[str]:
+        lines = super().render()
+        for labels, state in sorted(self._values.items()):
+            cumulative = 0.0
+            for bound, count in zip((*self._buckets, float("inf")), state):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                bucket_labels = _labels(self.labelnames, labels, f'le="{le}"')
+                lines.append(f"{self.name}_bucket{bucket_labels} {_number(cumulative)}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(state[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {_number(cumulative)}")
+        return lines
+
+
+REGISTRY: list[_Metric] = []
+
+RPC_SECONDS = Histogram("shelly_rpc_duration_seconds", "Shelly RPC call latency.", ("method",))
+DB_SECONDS = Histogram("collector_db_duration_seconds", "Database call latency per db function.", ("function",))
+LOOP_SECONDS = Histogram("collector_loop_duration_seconds", "Loop iteration duration.", ("loop",))
+LOOP_LAG_SECONDS = Histogram(
+    "collector_loop_lag_seconds",
+    "Delay between a loop's scheduled and actual wake-up.",
+    ("loop",),
+    LAG_BUCKETS,
+)
+ROWS_WRITTEN = Counter("collector_rows_written_total", "Rows written per table.", ("table",))
+INTERVALS_INGESTED = Counter("collector_intervals_ingested_total", "EMData intervals ingested.")
+ALERTS_FIRED = Counter("collector_alerts_fired_total", "Alerts fired per type.", ("type",))
+ERRORS = Counter("collector_errors_total", "Errors by kind.", ("kind",))
+EMDATA_LAG_SECONDS = Gauge("collector_emdata_lag_seconds", "Age of the newest ingested EMData interval.")
+EMDATA_GAP_RECORDS = Gauge(
+    "collector_emdata_gap_records", "EMData records missing from energy_intervals that the device still holds."
+)
+EMDATA_GAP_EXPIRY_SECONDS = Gauge(
+    "collector_emdata_gap_expiry_seconds", "Time until the oldest missing record leaves the device EMData window."
+)
+POOL_CONNECTIONS = Gauge("collector_db_pool_connections", "Database pool connections by state.", ("state",))
+
+
+def render() -> str:
+    lines: list[str] = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def db_timed(func: Callable[..., Awaitable[R]]) -> Callable[..., Awaitable[R]]:
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> R:
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            ERRORS.inc("db")
+            raise
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - started, name)
+
+    return wrapper
+
+
+class LoopMonitor:
+    def __init__(self, name: str) -> None:
+        self._name = name
+        self._started = time.perf_counter()
+
+    def begin(self) -> None:
+        self._started = time.perf_counter()
+
+    async def sleep(self, seconds: float) -> None:
+        now = time.perf_counter()
+        LOOP_SECONDS.observe(now - self._started, self._name)
+        wake_at = now + seconds
+        await asyncio.sleep(seconds)
+        LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - wake_at), self._name)
+
+
+class MetricsApi:
+    def __init__(self, pool: Any | None = None) -> None:
+        self._pool = pool
+
+    def register(self, app: web.Application) -> None:
+        app.router.add_get("/metrics", self.metrics)
+
+    async def metrics(self, request: web.Request) -> web.Response:
+        if self._pool is not None:
+            stats = self._pool.get_stats()
+            POOL_CONNECTIONS.set(stats.get("pool_size", 0), "open")
+            POOL_CONNECTIONS.set(stats.get("pool_available", 0), "idle")
+            POOL_CONNECTIONS.set(stats.get("requests_waiting", 0), "waiting")
+        # Prometheus text exposition format; the version parameter tells scrapers which parser to use.
+        return web.Response(text=render(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import math
+from collections import deque
+
+AGG_LAST = "last"
+AGG_MEAN = "mean"
+AGG_MAX = "max"
+AGG_MIN = "min"
+AGG_ENERGY_WH = "energy_wh"
+AGG_RATE = "rate"
+AGGREGATES = (AGG_LAST, AGG_MEAN, AGG_MAX, AGG_MIN, AGG_ENERGY_WH, AGG_RATE)
+
+# Running sums are recomputed exactly this often to shed floating-point drift.
+_RESUM_EVERY = 4096
+
+
+class RollingAggregate:
+    # Time-based sliding window over irregular samples; push() is amortized O(1) for every kind.
+    # A window only reports once it spans window_seconds of data, and a gap longer than the
+    # window starts it over.
+
+    def __init__(self, kind: str, window_seconds: float) -> None:
+        if kind not in AGGREGATES or kind == AGG_LAST:
+            raise ValueError(f"unsupported rolling aggregate: {kind!r}")
+        if window_seconds <= 0:
+            raise ValueError("window_seconds must be > 0")
+        self.kind = kind
+        self.window = float(window_seconds)
+        # mean/energy/rate: (ts, value) in arrival order; max/min: monotonic candidates.
+        self._items: deque[tuple[float, float]] = deque()
+        self._sum = 0.0
+        self._pushes = 0
+        self._since: float | None = None
+        self._last: tuple[float, float] | None = None
+
+    def reset(self) -> None:
+        self._items.clear()
+        self._sum = 0.0
+        self._since = None
+        self._last = None
+
+    def push(self, ts: float, value: float | None) -> float | None:
+        if value is None:
+            return None
+        last = self._last
+        if last is not None:
+            if ts <= last[0]:
+                return None
+            if ts - last[0] > self.window:
+                self.reset()
+                last = None
+        if self._since is None:
+            self._since = ts
+        self._last = (ts, value)
+        horizon = ts - self.window
+        items = self._items
+        kind = self.kind
+
+        if kind == AGG_MEAN:
+            items.append((ts, value))
+            self._sum += value
+            while items[0][0] < horizon:
+                self._sum -= items.popleft()[1]
+        elif kind == AGG_MAX or kind == AGG_MIN:
+            if kind == AGG_MAX:
+                while items and items[-1][1] <= value:
+                    items.pop()
+            else:
+                while items and items[-1][1] >= value:
+                    items.pop()
+            items.append((ts, value))
+            while items[0][0] < horizon:
+                items.popleft()
+        elif kind == AGG_ENERGY_WH:
+            # The previous sample's power is held until this one (left Riemann sum); segments are
+            # keyed by their end time.
+            if last is not None:
+                wh = last[1] * (ts - last[0]) / 3600.0
+                items.append((ts, wh))
+                self._sum += wh
+            while items and items[0][0] <= horizon:
+                self._sum -= items.popleft()[1]
+        else:
+            items.append((ts, value))
+            while len(items) > 1 and items[0][0] < horizon:
+                items.popleft()
+
+        if kind == AGG_MEAN or kind == AGG_ENERGY_WH:
+            self._pushes += 1
+            if not items or self._pushes % _RESUM_EVERY == 0:
+                self._sum = math.fsum(item[1] for item in items)
+
+        if ts - self._since < self.window:
+            return None
+        if kind == AGG_MEAN:
+            return self._sum / len(items)
+        if kind == AGG_MAX or kind == AGG_MIN:
+            return items[0][1]
+        if kind == AGG_ENERGY_WH:
+            return self._sum
+        first_ts, first_value = items[0]
+        if ts <= first_ts:
+            return None
+        # Change per minute.
+        return (value - first_value) * 60.0 / (ts - first_ts)
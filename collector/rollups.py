@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+_UNIT_SECONDS = {"m": 60, "h": 3600, "d": 86400}
+_LEVEL_RE = re.compile(r"^(\d+)(mo|m|h|d)$")
+_MONTH_SECONDS = 30 * 86400
+
+
+@dataclass(frozen=True)
+class RollupLevel:
+    name: str
+    seconds: int | None
+    retention_days: int | None = None
+
+    @property
+    def approx_seconds(self) -> int:
+        return self.seconds if self.seconds is not None else _MONTH_SECONDS
+
+    def floor(self, ts: datetime) -> datetime:
+        ts = ts.astimezone(timezone.utc)
+        if self.seconds is None:
+            return datetime(ts.year, ts.month, 1, tzinfo=timezone.utc)
+        epoch = int(ts.timestamp())
+        return datetime.fromtimestamp(epoch - (epoch % self.seconds), tz=timezone.utc)
+
+    def bucket_sql(self, column: str) -> str:
+        if self.seconds is None:
+            return f"(date_trunc('month', {column} AT TIME ZONE 'UTC') AT TIME ZONE 'UTC')"
+        return (
+            f"(timestamptz 'epoch' + floor(extract(epoch from {column}) / {self.seconds})"
+            f" * {self.seconds} * interval '1 second')"
+        )
+
+    def seconds_sql(self, bucket: str) -> str:
+        if self.seconds is None:
+            return (
+                f"extract(epoch from ((({bucket}) AT TIME ZONE 'UTC' + interval '1 month')"
+                f" AT TIME ZONE 'UTC') - ({bucket}))"
+            )
+        return str(self.seconds)
+
+
+def base_level(name: str, seconds: int, retention_days: int | None = None) -> RollupLevel:
+    return RollupLevel(name=name, seconds=seconds, retention_days=retention_days)
+
+
+def parse_level(token: str) -> RollupLevel:
+    name, _, retention = token.strip().partition(":")
+    name = name.strip().lower()
+    match = _LEVEL_RE.match(name)
+    if not match:
+        raise ValueError(f"Invalid rollup level {token!r} (expected e.g. 15m, 1h, 1d, 1mo)")
+    count, unit = int(match.group(1)), match.group(2)
+    if count <= 0:
+        raise ValueError(f"Invalid rollup level {token!r}")
+    if unit == "mo":
+        if count != 1:
+            raise ValueError(f"Only 1mo is supported for calendar rollups, got {token!r}")
+        seconds = None
+    else:
+        seconds = count * _UNIT_SECONDS[unit]
+    retention_days = int(retention) if retention.strip() else None
+    return RollupLevel(name=name, seconds=seconds, retention_days=retention_days)
+
+
+def parse_levels(spec: str | None, base: RollupLevel) -> list[RollupLevel]:
+    if not spec or not spec.strip():
+        return []
+    levels = sorted(
+        (parse_level(token) for token in spec.split(",") if token.strip()),
+        key=lambda level: level.approx_seconds,
+    )
+    previous = base
+    for level in levels:
+        if level.name == previous.name:
+            raise ValueError(f"Duplicate rollup level {level.name!r}")
+        if previous.seconds is None:
+            raise ValueError(f"Rollup level {level.name!r} cannot be coarser than 1mo")
+        divisor = 86400 if level.seconds is None else level.seconds
+        if divisor % previous.seconds != 0:
+            raise ValueError(f"Rollup level {level.name!r} is not a multiple of {previous.name!r}")
+        previous = level
+    return levels
+
+
+def choose_level(
+    levels: list[RollupLevel],
+    start_ts: datetime,
+    end_ts: datetime,
+    max_points: int,
+    now: datetime | None = None,
+) -> RollupLevel:
+    now = now or datetime.now(timezone.utc)
+    span = max(0.0, (end_ts - start_ts).total_seconds())
+    covering = [
+        level
+        for level in levels
+        if level.retention_days is None or start_ts >= now - timedelta(days=level.retention_days)
+    ] or levels[-1:]
+    for level in covering:
+        if span / level.approx_seconds <= max(1, max_points):
+            return level
+    return covering[-1]
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import time
 from typing import Any
 
 import httpx
 
+from .metrics import ERRORS, RPC_SECONDS
+
 
 class ShellyRpc:
     def __init__(self, base_url: str, timeout_ms: int) -> None:
@@ -12,16 +15,23 @@ class ShellyRpc:
 
     async def call(self, method: str, params: dict[str, Any] | None = None) -> dict[str, Any]:
         url = f"{self._base_url}/rpc/{method}"
-        async with httpx.AsyncClient(timeout=self._timeout) as client:
-            if params is None:
-                resp = await client.get(url)
-            else:
-                resp = await client.post(url, json=params)
-            resp.raise_for_status()
-            data = resp.json()
-            if not isinstance(data, dict):
-                raise ValueError("Unexpected RPC response shape")
-            return data
+        started = time.perf_counter()
+        try:
+            async with httpx.AsyncClient(timeout=self._timeout) as client:
+                if params is None:
+                    resp = await client.get(url)
+                else:
+                    resp = await client.post(url, json=params)
+                resp.raise_for_status()
+                data = resp.json()
+                if not isinstance(data, dict):
+                    raise ValueError("Unexpected RPC response shape")
+                return data
+        except Exception:
+            ERRORS.inc("rpc")
+            raise
+        finally:
+            RPC_SECONDS.observe(time.perf_counter() - started, method)
 
     async def get_status(self) -> dict[str, Any]:
         return await self.call("Shelly.GetStatus")
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import threading
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any
+
+from psycopg_pool import AsyncConnectionPool
+
+from .db import (
+    insert_alert_events_bulk,
+    insert_power_readings_bulk,
+    rewind_rollup_watermarks,
+    upsert_power_readings_1m_range,
+)
+from .ingest import PowerReading
+from .logger import log
+from .metrics import ROWS_WRITTEN
+
+KIND_POWER_READING = "power_reading"
+KIND_ALERT_EVENT = "alert_event"
+
+SPOOL_MODE_FALLBACK = "fallback"
+SPOOL_MODE_JOURNAL = "journal"
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+def _bucket_floor(ts: datetime, bucket_seconds: int) -> datetime:
+    epoch = int(ts.timestamp())
+    return datetime.fromtimestamp(epoch - (epoch % bucket_seconds), tz=timezone.utc)
+
+
+class Spool:
+    def __init__(self, path: str, mode: str, max_records: int, flush_records: int = 100) -> None:
+        if mode not in (SPOOL_MODE_FALLBACK, SPOOL_MODE_JOURNAL):
+            raise ValueError(f"Unknown spool mode {mode!r}")
+        self._path = Path(path)
+        self._mode = mode
+        self._max_records = max(1, int(max_records))
+        self._flush_records = max(1, int(flush_records))
+        self._buffer: list[tuple[str, str]] = []
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._pending = 0
+        self.db_down = False
+
+    @property
+    def journal(self) -> bool:
+        return self._mode == SPOOL_MODE_JOURNAL
+
+    @property
+    def pending(self) -> int:
+        return self._pending + len(self._buffer)
+
+    def open(self) -> None:
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS spool (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL
+            )
+            """
+        )
+        self._conn = conn
+        self._pending = conn.execute("SELECT count(*) FROM spool").fetchone()[0]
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._write(self._take_buffer())
+            self._conn.close()
+            self._conn = None
+
+    def append(self, kind: str, payload: dict[str, Any]) -> None:
+        self._buffer.append((kind, json.dumps(payload, default=_encode, separators=(",", ":"))))
+
+    def append_power_reading(self, reading: PowerReading) -> None:
+        self.append(KIND_POWER_READING, asdict(reading))
+
+    def append_alert_event(
+        self,
+        ts: datetime,
+        alert_type: str,
+        value: float | None,
+        details: dict[str, Any] | None,
+    ) -> None:
+        self.append(KIND_ALERT_EVENT, {"ts": ts, "type": alert_type, "value": value, "details": details})
+
+    def needs_flush(self) -> bool:
+        return len(self._buffer) >= self._flush_records
+
+    async def flush(self) -> int:
+        batch = self._take_buffer()
+        if not batch:
+            return 0
+        evicted = await asyncio.to_thread(self._write, batch)
+        if evicted:
+            log("spool.evicted", count=evicted, max_records=self._max_records)
+        return len(batch)
+
+    async def read_batch(self, limit: int) -> list[tuple[int, str, dict[str, Any]]]:
+        rows = await asyncio.to_thread(self._read, max(1, int(limit)))
+        return [(row_id, kind, json.loads(payload)) for row_id, kind, payload in rows]
+
+    async def ack(self, last_id: int) -> None:
+        await asyncio.to_thread(self._delete_through, last_id)
+
+    def _take_buffer(self) -> list[tuple[str, str]]:
+        batch, self._buffer = self._buffer, []
+        return batch
+
+    def _write(self, batch: list[tuple[str, str]]) -> int:
+        if not batch or self._conn is None:
+            return 0
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN")
+            conn.executemany("INSERT INTO spool (kind, payload) VALUES (?, ?)", batch)
+            self._pending += len(batch)
+            evicted = 0
+            if self._pending > self._max_records:
+                evicted = self._pending - self._max_records
+                conn.execute(
+                    "DELETE FROM spool WHERE id IN (SELECT id FROM spool ORDER BY id LIMIT ?)",
+                    (evicted,),
+                )
+                self._pending -= evicted
+            conn.execute("COMMIT")
+            return evicted
+
+    def _read(self, limit: int) -> list[tuple[int, str, str]]:
+        if self._conn is None:
+            return []
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, kind, payload FROM spool ORDER BY id LIMIT ?",
+                (limit,),
+            ).fetchall()
+
+    def _delete_through(self, last_id: int) -> None:
+        if self._conn is None:
+            return
+        with self._lock:
+            cur = self._conn.execute("DELETE FROM spool WHERE id <= ?", (last_id,))
+            self._pending = max(0, self._pending - (cur.rowcount or 0))
+
+
+async def replay_spool_batch(
+    spool: Spool,
+    pool: AsyncConnectionPool,
+    limit: int,
+    low_res_minutes: int,
+    power_rollups: list[str],
+) -> int:
+    records = await spool.read_batch(limit)
+    if not records:
+        return 0
+
+    readings: list[dict[str, Any]] = []
+    alerts: list[dict[str, Any]] = []
+    for _, kind, payload in records:
+        payload["ts"] = datetime.fromisoformat(payload["ts"])
+        if kind == KIND_POWER_READING:
+            readings.append(payload)
+        elif kind == KIND_ALERT_EVENT:
+            alerts.append(payload)
+
+    if readings:
+        ROWS_WRITTEN.inc("power_readings", amount=await insert_power_readings_bulk(pool, readings))
+        if low_res_minutes and low_res_minutes > 0:
+            bucket_seconds = max(60, int(low_res_minutes) * 60)
+            start_ts = _bucket_floor(min(r["ts"] for r in readings), bucket_seconds)
+            end_ts = _bucket_floor(max(r["ts"] for r in readings), bucket_seconds) + timedelta(seconds=bucket_seconds)
+            await upsert_power_readings_1m_range(pool, start_ts, end_ts, bucket_seconds)
+            await rewind_rollup_watermarks(pool, power_rollups, start_ts)
+    if alerts:
+        ROWS_WRITTEN.inc("alert_events", amount=await insert_alert_events_bulk(pool, alerts))
+
+    await spool.ack(records[-1][0])
+    spool.db_down = False
+    return len(records)
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+from dataclasses import asdict
+from datetime import datetime
+from typing import Any
+
+from aiohttp import WSMsgType, web
+
+from .ingest import PowerReading
+from .logger import log
+
+TOPIC_POWER = "power"
+TOPIC_ALERT = "alert"
+TOPICS = (TOPIC_POWER, TOPIC_ALERT)
+
+_CLOSED = object()
+
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class Subscriber:
+    def __init__(self, topics: frozenset[str], queue_size: int, min_interval: float, every: int) -> None:
+        self.topics = topics
+        self.queue: asyncio.Queue[Any] = asyncio.Queue(maxsize=max(1, queue_size))
+        self.min_interval = max(0.0, min_interval)
+        self.every = max(1, every)
+        self.dropped = 0
+        self.closed = False
+        self._lagging = 0
+        self._seen = 0
+        self._last_sent = 0.0
+
+    def wants(self, topic: str, now: float) -> bool:
+        if topic not in self.topics:
+            return False
+        if topic != TOPIC_POWER:
+            return True
+        # Rate limiting and decimation only thin out the power stream; alerts are never skipped.
+        self._seen += 1
+        if self._seen % self.every:
+            return False
+        if self.min_interval and now - self._last_sent < self.min_interval:
+            return False
+        self._last_sent = now
+        return True
+
+    def offer(self, message: tuple[str, str], max_lag: int) -> bool:
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+            self._lagging += 1
+            if self._lagging > max_lag:
+                return False
+        self.queue.put_nowait(message)
+        return True
+
+    async def get(self, timeout: float) -> Any:
+        message = await asyncio.wait_for(self.queue.get(), timeout)
+        self._lagging = 0
+        return message
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(_CLOSED)
+
+
+class BroadcastHub:
+    def __init__(self, queue_size: int = 32, max_clients: int = 500) -> None:
+        self._queue_size = max(1, int(queue_size))
+        self._max_clients = max(1, int(max_clients))
+        self._subscribers: set[Subscriber] = set()
+        self._latest: dict[str, tuple[str, str]] = {}
+
+    @property
+    def clients(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self, topics: frozenset[str], min_interval: float = 0.0, every: int = 1) -> Subscriber | None:
+        if len(self._subscribers) >= self._max_clients:
+            return None
+        sub = Subscriber(topics, self._queue_size, min_interval, every)
+        # Late joiners get the last power reading immediately instead of waiting a poll cycle.
+        latest = self._latest.get(TOPIC_POWER)
+        if latest is not None and TOPIC_POWER in topics:
+            sub.queue.put_nowait(latest)
+        self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        self._subscribers.discard(sub)
+        sub.close()
+
+    def publish(self, topic: str, payload: dict[str, Any]) -> None:
+        message = (topic, json.dumps(payload, default=_encode, separators=(",", ":")))
+        self._latest[topic] = message
+        if not self._subscribers:
+            return
+        now = time.monotonic()
+        evicted = []
+        for sub in self._subscribers:
+            if sub.wants(topic, now) and not sub.offer(message, self._queue_size):
+                evicted.append(sub)
+        for sub in evicted:
+            log("stream.client.dropped", dropped=sub.dropped)
+            self.unsubscribe(sub)
+
+    def publish_reading(self, reading: PowerReading) -> None:
+        self.publish(TOPIC_POWER, asdict(reading))
+
+    def publish_alert(self, ts: datetime, alert_type: str, value: float | None) -> None:
+        self.publish(TOPIC_ALERT, {"ts": ts, "type": alert_type, "value": value})
+
+    def close(self) -> None:
+        for sub in list(self._subscribers):
+            self.unsubscribe(sub)
+
+
+class StreamApi:
+    def __init__(self, hub: BroadcastHub, heartbeat_seconds: float = 15.0) -> None:
+        self._hub = hub
+        self._heartbeat_seconds = heartbeat_seconds
+
+    def register(self, app: web.Application) -> None:
+        app.router.add_get("/stream", self.sse)
+        app.router.add_get("/ws", self.websocket)
+
+    def _subscribe(self, request: web.Request) -> Subscriber:
+        query = request.query
+        try:
+            topics = frozenset(t.strip() for t in query.get("topics", ",".join(TOPICS)).split(",") if t.strip())
+            min_interval = float(query.get("interval", 0))
+            every = int(query.get("every", 1))
+        except ValueError as exc:
+            raise web.HTTPBadRequest(reason=str(exc)) from exc
+        unknown = topics - set(TOPICS)
+        if unknown or not topics:
+            raise web.HTTPBadRequest(reason=f"unknown topics: {','.join(sorted(unknown)) or '(none)'}")
+        sub = self._hub.subscribe(topics, min_interval, every)
+        if sub is None:
+            raise web.HTTPServiceUnavailable(reason="too many stream clients")
+        return sub
+
+    async def sse(self, request: web.Request) -> web.StreamResponse:
+        sub = self._subscribe(request)
+        response = web.StreamResponse(
+            headers={
+                "Content-Type": "text/event-stream",
+                "Cache-Control": "no-cache",
+                "X-Accel-Buffering": "no",
+            }
+        )
+        try:
+            await response.prepare(request)
+            while True:
+                try:
+                    message = await sub.get(self._heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    await response.write(b": keepalive\n\n")
+                    continue
+                if message is _CLOSED:
+                    break
+                topic, data = message
+                await response.write(f"event: {topic}\ndata: {data}\n\n".encode())
+        except ConnectionResetError:
+            pass
+        finally:
+            self._hub.unsubscribe(sub)
+        return response
+
+    async def websocket(self, request: web.Request) -> web.WebSocketResponse:
+        sub = self._subscribe(request)
+        ws = web.WebSocketResponse(heartbeat=self._heartbeat_seconds)
+
+        async def drain_incoming() -> None:
+            async for msg in ws:
+                if msg.type in (WSMsgType.CLOSE, WSMsgType.ERROR):
+                    break
+            sub.close()
+
+        reader: asyncio.Task[None] | None = None
+        try:
+            # Inside the try so a failed handshake still releases the subscriber slot.
+            await ws.prepare(request)
+            reader = asyncio.create_task(drain_incoming())
+            while not ws.closed:
+                try:
+                    message = await sub.get(self._heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    continue
+                if message is _CLOSED:
+                    break
+                topic, data = message
+                await ws.send_str(f'{{"topic":"{topic}","data":{data}}}')
+        except ConnectionResetError:
+            pass
+        finally:
+            self._hub.unsubscribe(sub)
+            if reader is not None:
+                reader.cancel()
+            if ws.prepared:
+                await ws.close()
+        return ws
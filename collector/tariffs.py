@@ -0,0 +1,512 @@
+from __future__ import annotations
+
+import calendar
+from array import array
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Sequence
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from psycopg_pool import AsyncConnectionPool
+
+from .db import fetch_energy_rows, fetch_tariff_definition, fetch_tariff_revision
+
+MINUTES_PER_DAY = 1440
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+_OFFSET_SLOT_SECONDS = 900
+
+UNIT_KWH = "kwh"
+UNIT_KW = "kw"
+UNIT_DAY = "day"
+UNIT_MONTH = "month"
+UNIT_FLAT = "flat"
+UNIT_PERCENT = "percent"
+
+
+@dataclass(frozen=True)
+class TariffComponent:
+    id: int
+    name: str
+    kind: str
+    direction: str
+    unit: str
+    billing_period: str
+    priority: int
+
+
+@dataclass(frozen=True)
+class TariffRule:
+    id: int
+    component_id: int
+    day_type_id: int | None
+    season_id: int | None
+    effective_from: date | None
+    effective_to: date | None
+    rate: float
+    min_kw: float | None
+    max_kw: float | None
+    priority: int
+    windows: tuple[tuple[int, int], ...]
+
+    def applies_on(self, day: date, day_type_id: int | None, season_id: int | None) -> bool:
+        if self.day_type_id is not None and self.day_type_id != day_type_id:
+            return False
+        if self.season_id is not None and self.season_id != season_id:
+            return False
+        if self.effective_from is not None and day < self.effective_from:
+            return False
+        if self.effective_to is not None and day > self.effective_to:
+            return False
+        return True
+
+
+@dataclass
+class TariffCost:
+    tariff_id: int
+    name: str
+    currency: str | None
+    energy_kwh: float = 0.0
+    unpriced_kwh: float = 0.0
+    components: dict[str, float] = field(default_factory=dict)
+
+    @property
+    def total(self) -> float:
+        return sum(self.components.values())
+
+    def as_dict(self) -> dict[str, Any]:
+        return {
+            "tariff_id": self.tariff_id,
+            "name": self.name,
+            "currency": self.currency,
+            "energy_kwh": round(self.energy_kwh, 6),
+            "unpriced_kwh": round(self.unpriced_kwh, 6),
+            "components": {name: round(value, 6) for name, value in self.components.items()},
+            "total": round(self.total, 6),
+        }
+
+
+@dataclass
+class _DayProfile:
+    # Minute-of-day rates per energy component and their prefix sums (MINUTES_PER_DAY + 1
+    # entries), plus the same pair for minutes covered by at least one rule.
+    rates: list[array]
+    cumulative: list[array]
+    coverage: array
+    covered: array
+
+
+def _minute_of(value: time, round_up: bool = False) -> int:
+    seconds = value.hour * 3600 + value.minute * 60 + value.second
+    return -(-seconds // 60) if round_up else seconds // 60
+
+
+def _window_ranges(start: time, end: time) -> list[tuple[int, int]]:
+    start_minute = _minute_of(start)
+    # Rounding up makes the seed data's 23:59:59 end mean "until midnight".
+    end_minute = _minute_of(end, round_up=True)
+    if end_minute > start_minute:
+        return [(start_minute, end_minute)]
+    return [(start_minute, MINUTES_PER_DAY), (0, end_minute)]
+
+
+def _parse_md(value: str) -> tuple[int, int]:
+    month, day = value.strip().split("-")
+    return int(month), int(day)
+
+
+def device_zone(name: str | None) -> ZoneInfo:
+    try:
+        return ZoneInfo(name or "UTC")
+    except (ZoneInfoNotFoundError, ValueError):
+        return ZoneInfo("UTC")
+
+
+def _utc_offset(zone: ZoneInfo, offsets: dict[int, int], epoch: int) -> int:
+    slot = epoch // _OFFSET_SLOT_SECONDS
+    offset = offsets.get(slot)
+    if offset is None:
+        utc = datetime.fromtimestamp(slot * _OFFSET_SLOT_SECONDS, tz=timezone.utc)
+        offset = offsets[slot] = int(utc.astimezone(zone).utcoffset().total_seconds())
+    return offset
+
+
+def build_load_matrix(
+    epochs: Sequence[int],
+    energy_wh: Sequence[float],
+    bucket_seconds: int,
+    timezone_name: str,
+) -> dict[int, array]:
+    # One row of MINUTES_PER_DAY Wh values per local day (keyed by days since epoch); buckets
+    # longer than a minute are spread evenly, which matches price_epochs' mean-rate pricing.
+    zone = ZoneInfo(timezone_name)
+    offsets: dict[int, int] = {}
+    length = max(1, int(bucket_seconds) // 60)
+    matrix: dict[int, array] = {}
+    for epoch, wh in zip(epochs, energy_wh):
+        if not wh:
+            continue
+        offset = offsets.get(epoch // _OFFSET_SLOT_SECONDS)
+        if offset is None:
+            offset = _utc_offset(zone, offsets, epoch)
+        day_number, second = divmod(epoch + offset, 86400)
+        minute = second // 60
+        share = wh / length
+        remaining = length
+        while remaining > 0:
+            row = matrix.get(day_number)
+            if row is None:
+                row = matrix[day_number] = array("d", [0.0]) * MINUTES_PER_DAY
+            take = min(remaining, MINUTES_PER_DAY - minute)
+            for m in range(minute, minute + take):
+                row[m] += share
+            remaining -= take
+            day_number += 1
+            minute = 0
+    return matrix
+
+
+def _prefix(values: list[float]) -> array:
+    out = array("d", [0.0]) * (len(values) + 1)
+    total = 0.0
+    for i, value in enumerate(values):
+        total += value
+        out[i + 1] = total
+    return out
+
+
+class CompiledTariff:
+    def __init__(self, definition: dict[str, list[tuple[Any, ...]]]) -> None:
+        tariff_id, name, currency, tz_name, valid_from, valid_to, revision = definition["tariff"][0]
+        self.id = int(tariff_id)
+        self.name = name or f"tariff {tariff_id}"
+        self.currency = currency
+        self.timezone = tz_name or "UTC"
+        self.valid_from = valid_from
+        self.valid_to = valid_to
+        self.revision = int(revision)
+        self._zone = ZoneInfo(self.timezone)
+
+        self.components = [TariffComponent(*row) for row in definition["components"]]
+        windows: dict[int, list[tuple[int, int]]] = {}
+        for rule_id, start, end in definition["windows"]:
+            windows.setdefault(rule_id, []).extend(_window_ranges(start, end))
+
+        self.rules: dict[int, list[TariffRule]] = {c.id: [] for c in self.components}
+        self.skipped_rules: list[int] = []
+        for (
+            rule_id, component_id, day_type_id, season_id, effective_from, effective_to,
+            rate, min_kwh, max_kwh, min_kw, max_kw, priority,
+        ) in definition["rules"]:
+            if min_kwh is not None or max_kwh is not None:
+                # Consumption tiers depend on the billing-period total, not on the minute of day.
+                self.skipped_rules.append(rule_id)
+                continue
+            self.rules.setdefault(component_id, []).append(
+                TariffRule(
+                    id=rule_id,
+                    component_id=component_id,
+                    day_type_id=day_type_id,
+                    season_id=season_id,
+                    effective_from=effective_from,
+                    effective_to=effective_to,
+                    rate=float(rate),
+                    min_kw=min_kw,
+                    max_kw=max_kw,
+                    priority=priority,
+                    windows=tuple(windows.get(rule_id) or [(0, MINUTES_PER_DAY)]),
+                )
+            )
+
+        self._day_types = [(dt_id, int(mask), bool(holidays)) for dt_id, _, mask, holidays in definition["day_types"]]
+        self._seasons = [
+            (season_id, _parse_md(start_md), _parse_md(end_md), year)
+            for season_id, _, start_md, end_md, year in definition["seasons"]
+        ]
+        self._holidays = {row[0] for row in definition["holidays"]}
+
+        self.energy_components = [
+            c for c in self.components if c.unit == UNIT_KWH and c.direction in ("import", "both")
+        ]
+        self._profiles: list[_DayProfile] = []
+        self._profile_keys: dict[tuple[int, ...], int] = {}
+        self._day_profiles: dict[int, int] = {}
+        self._offsets: dict[int, int] = {}
+
+    def day_type_id(self, day: date) -> int | None:
+        if day in self._holidays:
+            for dt_id, _, include_holidays in self._day_types:
+                if include_holidays:
+                    return dt_id
+        bit = 1 << (day.isoweekday() - 1)
+        for dt_id, mask, _ in self._day_types:
+            if mask & bit:
+                return dt_id
+        return None
+
+    def season_id(self, day: date) -> int | None:
+        md = (day.month, day.day)
+        for season_id, start, end, year in self._seasons:
+            if year is not None and year != day.year:
+                continue
+            if start <= end:
+                if start <= md <= end:
+                    return season_id
+            elif md >= start or md <= end:
+                return season_id
+        return None
+
+    def applicable_rules(self, component_id: int, day: date) -> list[TariffRule]:
+        day_type_id = self.day_type_id(day)
+        season_id = self.season_id(day)
+        return [rule for rule in self.rules.get(component_id, []) if rule.applies_on(day, day_type_id, season_id)]
+
+    def minute_rates(self, component: TariffComponent, day: date) -> list[float | None]:
+        rates: list[float | None] = [None] * MINUTES_PER_DAY
+        for rule in self.applicable_rules(component.id, day):
+            for start, end in rule.windows:
+                for minute in range(start, end):
+                    if rates[minute] is None:
+                        rates[minute] = rule.rate
+        return rates
+
+    def _profile(self, day_number: int) -> _DayProfile:
+        index = self._day_profiles.get(day_number)
+        if index is None:
+            day = date.fromordinal(_EPOCH_ORDINAL + day_number)
+            per_component = [self.minute_rates(c, day) for c in self.energy_components]
+            key = tuple(tuple(rates) for rates in per_component)
+            index = self._profile_keys.get(key)
+            if index is None:
+                covered = [
+                    1.0 if any(rates[m] is not None for rates in per_component) else 0.0
+                    for m in range(MINUTES_PER_DAY)
+                ]
+                rates = [array("d", [r or 0.0 for r in values]) for values in per_component]
+                profile = _DayProfile(
+                    rates=rates,
+                    cumulative=[_prefix(list(values)) for values in rates],
+                    coverage=array("d", covered),
+                    covered=_prefix(covered),
+                )
+                index = self._profile_keys[key] = len(self._profiles)
+                self._profiles.append(profile)
+            self._day_profiles[day_number] = index
+        return self._profiles[index]
+
+    def price_energy(
+        self,
+        starts: Sequence[datetime],
+        energy_wh: Sequence[float],
+        bucket_seconds: int = 60,
+    ) -> tuple[list[array], float]:
+        return self.price_epochs([int(ts.timestamp()) for ts in starts], energy_wh, bucket_seconds)
+
+    def price_epochs(
+        self,
+        epochs: Sequence[int],
+        energy_wh: Sequence[float],
+        bucket_seconds: int = 60,
+    ) -> tuple[list[array], float]:
+        length = max(1, int(bucket_seconds) // 60)
+        count = len(self.energy_components)
+        costs = [array("d", [0.0]) * len(epochs) for _ in range(count)]
+        unpriced_kwh = 0.0
+        offsets = self._offsets
+        day_profiles = self._day_profiles
+        profiles = self._profiles
+        for i, (epoch, wh) in enumerate(zip(epochs, energy_wh)):
+            if not wh:
+                continue
+            kwh = float(wh) / 1000.0
+            offset = offsets.get(epoch // _OFFSET_SLOT_SECONDS)
+            if offset is None:
+                offset = _utc_offset(self._zone, offsets, epoch)
+            day_number, second = divmod(epoch + offset, 86400)
+            minute = second // 60
+            index = day_profiles.get(day_number)
+            profile = profiles[index] if index is not None else self._profile(day_number)
+            if minute + length <= MINUTES_PER_DAY:
+                end = minute + length
+                for c in range(count):
+                    cumulative = profile.cumulative[c]
+                    costs[c][i] = kwh * (cumulative[end] - cumulative[minute]) / length
+                unpriced_kwh += kwh * (1.0 - (profile.covered[end] - profile.covered[minute]) / length)
+                continue
+            # Buckets that cross local midnight are split across the two day profiles.
+            remaining = length
+            covered = 0.0
+            while remaining > 0:
+                take = min(remaining, MINUTES_PER_DAY - minute)
+                for c in range(count):
+                    cumulative = profile.cumulative[c]
+                    costs[c][i] += kwh * (cumulative[minute + take] - cumulative[minute]) / length
+                covered += profile.covered[minute + take] - profile.covered[minute]
+                remaining -= take
+                day_number += 1
+                minute = 0
+                profile = self._profile(day_number)
+            unpriced_kwh += kwh * (1.0 - covered / length)
+        return costs, unpriced_kwh
+
+    def _local_date(self, ts: datetime) -> date:
+        return ts.astimezone(self._zone).date()
+
+    def _fixed_rate(self, component: TariffComponent, day: date) -> float | None:
+        rules = self.applicable_rules(component.id, day)
+        return rules[0].rate if rules else None
+
+    def fixed_charges(self, start_ts: datetime, end_ts: datetime) -> dict[str, float]:
+        charges: dict[str, float] = {}
+        if end_ts <= start_ts:
+            return charges
+        start_day = self._local_date(start_ts)
+        days = (end_ts - start_ts).total_seconds() / 86400.0
+        for component in self.components:
+            if component.unit == UNIT_DAY:
+                rate = self._fixed_rate(component, start_day)
+                if rate is not None:
+                    charges[component.name] = rate * days
+            elif component.unit == UNIT_FLAT:
+                rate = self._fixed_rate(component, start_day)
+                if rate is not None:
+                    charges[component.name] = rate
+            elif component.unit == UNIT_MONTH:
+                # Monthly fees are prorated by the share of each local month inside the range.
+                total = 0.0
+                cursor = start_ts
+                while cursor < end_ts:
+                    local = cursor.astimezone(self._zone)
+                    month_days = calendar.monthrange(local.year, local.month)[1]
+                    next_month = (local.replace(day=1) + timedelta(days=32)).replace(
+                        day=1, hour=0, minute=0, second=0, microsecond=0
+                    )
+                    month_end = min(end_ts, next_month.astimezone(timezone.utc))
+                    rate = self._fixed_rate(component, local.date())
+                    if rate is not None:
+                        total += rate * ((month_end - cursor).total_seconds() / 86400.0) / month_days
+                    cursor = month_end
+                charges[component.name] = total
+        return charges
+
+    def demand_charges(self, peak_kw: float, day: date) -> dict[str, float]:
+        # kW components are billed on the period peak; min_kw/max_kw select the matching band.
+        charges: dict[str, float] = {}
+        for component in self.components:
+            if component.unit != UNIT_KW:
+                continue
+            for rule in self.applicable_rules(component.id, day):
+                if rule.min_kw is not None and peak_kw < float(rule.min_kw):
+                    continue
+                if rule.max_kw is not None and peak_kw > float(rule.max_kw):
+                    continue
+                charges[component.name] = rule.rate * peak_kw
+                break
+        return charges
+
+    def cost(
+        self,
+        starts: Sequence[datetime],
+        energy_wh: Sequence[float],
+        bucket_seconds: int,
+        start_ts: datetime,
+        end_ts: datetime,
+    ) -> TariffCost:
+        epochs = [int(ts.timestamp()) for ts in starts]
+        return self.cost_epochs(epochs, energy_wh, bucket_seconds, start_ts, end_ts)
+
+    def cost_epochs(
+        self,
+        epochs: Sequence[int],
+        energy_wh: Sequence[float],
+        bucket_seconds: int,
+        start_ts: datetime,
+        end_ts: datetime,
+    ) -> TariffCost:
+        result = TariffCost(tariff_id=self.id, name=self.name, currency=self.currency)
+        costs, result.unpriced_kwh = self.price_epochs(epochs, energy_wh, bucket_seconds)
+        result.energy_kwh = sum(float(wh) for wh in energy_wh if wh) / 1000.0
+        for component, column in zip(self.energy_components, costs):
+            result.components[component.name] = result.components.get(component.name, 0.0) + sum(column)
+        return self.add_period_charges(result, start_ts, end_ts)
+
+    def cost_matrix(self, matrix: dict[int, array], start_ts: datetime, end_ts: datetime) -> TariffCost:
+        # Days sharing a rate profile are summed first, so pricing is one dot product per
+        # profile instead of one lookup per interval. The matrix must be in this tariff's timezone.
+        sums: dict[int, list[float]] = {}
+        for day_number, row in matrix.items():
+            self._profile(day_number)
+            index = self._day_profiles[day_number]
+            acc = sums.get(index)
+            sums[index] = list(row) if acc is None else [a + b for a, b in zip(acc, row)]
+
+        result = TariffCost(tariff_id=self.id, name=self.name, currency=self.currency)
+        for index, load in sums.items():
+            profile = self._profiles[index]
+            total_wh = sum(load)
+            result.energy_kwh += total_wh / 1000.0
+            priced_wh = sum(w * c for w, c in zip(load, profile.coverage))
+            result.unpriced_kwh += (total_wh - priced_wh) / 1000.0
+            for component, rates in zip(self.energy_components, profile.rates):
+                value = sum(w * r for w, r in zip(load, rates)) / 1000.0
+                result.components[component.name] = result.components.get(component.name, 0.0) + value
+        return self.add_period_charges(result, start_ts, end_ts)
+
+    def add_period_charges(self, result: TariffCost, start_ts: datetime, end_ts: datetime) -> TariffCost:
+        for name, value in self.fixed_charges(start_ts, end_ts).items():
+            result.components[name] = result.components.get(name, 0.0) + value
+        subtotal = result.total
+        start_day = self._local_date(start_ts)
+        for component in self.components:
+            if component.unit == UNIT_PERCENT:
+                rate = self._fixed_rate(component, start_day)
+                if rate is not None:
+                    result.components[component.name] = subtotal * rate / 100.0
+        return result
+
+
+class TariffCache:
+    def __init__(self) -> None:
+        self._compiled: dict[int, CompiledTariff] = {}
+
+    def invalidate(self, tariff_id: int | None = None) -> None:
+        if tariff_id is None:
+            self._compiled.clear()
+        else:
+            self._compiled.pop(tariff_id, None)
+
+    async def get(self, pool: AsyncConnectionPool, tariff_id: int) -> CompiledTariff | None:
+        revision = await fetch_tariff_revision(pool, tariff_id)
+        if revision is None:
+            self._compiled.pop(tariff_id, None)
+            return None
+        compiled = self._compiled.get(tariff_id)
+        if compiled is None or compiled.revision != revision:
+            definition = await fetch_tariff_definition(pool, tariff_id)
+            if definition is None:
+                self._compiled.pop(tariff_id, None)
+                return None
+            compiled = self._compiled[tariff_id] = CompiledTariff(definition)
+        return compiled
+
+
+async def price_energy_range(
+    pool: AsyncConnectionPool,
+    cache: TariffCache,
+    tariff_id: int,
+    device_id: str,
+    channel: int,
+    start_ts: datetime,
+    end_ts: datetime,
+    hourly: bool = True,
+) -> TariffCost | None:
+    tariff = await cache.get(pool, tariff_id)
+    if tariff is None:
+        return None
+    rows = await fetch_energy_rows(pool, device_id, channel, start_ts, end_ts, hourly)
+    return tariff.cost(
+        [row[0] for row in rows],
+        [row[1] for row in rows],
+        3600 if hourly else 60,
+        start_ts,
+        end_ts,
+    )
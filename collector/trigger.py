@@ -1,14 +1,70 @@
 from __future__ import annotations
 
 import asyncio
-from typing import Any
+import math
+import time
+from dataclasses import dataclass
+from typing import Any, Coroutine
 
 import httpx
 
 from .logger import log
+from .metrics import ERRORS
 
 
-class HttpTrigger:
+@dataclass
+class _Target:
+    on_url: str
+    off_url: str
+    lock: asyncio.Lock
+    off_at: float | None = None
+
+
+class TimerWheel:
+    # Hashed timing wheel: deadlines land in tick slots, one scheduler task advances the cursor.
+    # Rescheduling a key moves it, so an extended pulse never leaves a stale OFF behind.
+
+    def __init__(self, tick_seconds: float = 1.0, slots: int = 64) -> None:
+        self.tick = tick_seconds
+        self._slots: list[dict[Any, int]] = [{} for _ in range(slots)]
+        self._where: dict[Any, int] = {}
+        self._origin = time.monotonic()
+        self._cursor = 0
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def schedule(self, key: Any, deadline: float) -> None:
+        self.cancel(key)
+        if not self._where:
+            self._cursor = max(self._cursor, math.floor((time.monotonic() - self._origin) / self.tick))
+        ticks = max(self._cursor + 1, math.ceil((deadline - self._origin) / self.tick))
+        slot = ticks % len(self._slots)
+        self._slots[slot][key] = (ticks - self._cursor - 1) // len(self._slots)
+        self._where[key] = slot
+
+    def cancel(self, key: Any) -> None:
+        slot = self._where.pop(key, None)
+        if slot is not None:
+            self._slots[slot].pop(key, None)
+
+    def advance(self, now: float) -> list[Any]:
+        expired: list[Any] = []
+        target = math.floor((now - self._origin) / self.tick)
+        while self._cursor < target:
+            self._cursor += 1
+            bucket = self._slots[self._cursor % len(self._slots)]
+            for key, rounds in list(bucket.items()):
+                if rounds > 0:
+                    bucket[key] = rounds - 1
+                    continue
+                del bucket[key]
+                del self._where[key]
+                expired.append(key)
+        return expired
+
+
+class TriggerDispatcher:
     def __init__(
         self,
         base_url: str | None,
@@ -16,29 +72,122 @@ class HttpTrigger:
         off_url: str | None,
         method: str,
         pulse_seconds: int,
+        max_concurrency: int = 4,
+        retries: int = 3,
+        timeout_seconds: float = 5.0,
     ) -> None:
         self._method = method.upper()
         self._pulse_seconds = pulse_seconds
-        self._on_url, self._off_url = self._resolve_urls(base_url, on_url, off_url)
+        self._retries = max(0, int(retries))
+        self._timeout = timeout_seconds
+        self._max_concurrency = max(1, int(max_concurrency))
+        self._default = self._resolve_urls(base_url, on_url, off_url)
+        self._targets: dict[tuple[str, str], _Target] = {}
+        self._wheel = TimerWheel()
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        self._tasks: set[asyncio.Task[Any]] = set()
+        self._scheduler: asyncio.Task[None] | None = None
+        self._client: httpx.AsyncClient | None = None
+        self._closing = False
 
     def enabled(self) -> bool:
-        return self._on_url is not None and self._off_url is not None
-
-    async def pulse(self) -> None:
-        if not self.enabled():
-            log("trigger.disabled")
-            return
-        await self._send(self._on_url)
-        await asyncio.sleep(self._pulse_seconds)
-        await self._send(self._off_url)
-
-    async def _send(self, url: str) -> None:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            if self._method == "GET":
-                resp = await client.get(url)
-            else:
-                resp = await client.post(url)
-            resp.raise_for_status()
+        return self._default[0] is not None and self._default[1] is not None
+
+    def pulse(self, seconds: float | None = None, urls: tuple[str, str] | None = None) -> bool:
+        # Overlapping pulses to the same endpoint coalesce into one ON window that ends at the
+        # latest requested OFF time; only the first pulse sends ON.
+        if urls is None:
+            if not self.enabled():
+                log("trigger.disabled")
+                return False
+            urls = self._default  # type: ignore[assignment]
+        if self._closing:
+            return False
+        target = self._targets.get(urls)
+        if target is None:
+            target = self._targets[urls] = _Target(urls[0], urls[1], asyncio.Lock())
+        off_at = time.monotonic() + (self._pulse_seconds if seconds is None else seconds)
+        if target.off_at is None:
+            self._spawn(self._send(target, target.on_url, "on"))
+        elif off_at <= target.off_at:
+            return True
+        target.off_at = off_at
+        self._wheel.schedule(urls, off_at)
+        self._ensure_scheduler()
+        return True
+
+    async def close(self, timeout: float = 10.0) -> None:
+        self._closing = True
+        if self._scheduler is not None:
+            self._scheduler.cancel()
+            await asyncio.gather(self._scheduler, return_exceptions=True)
+        # Do not leave a sensor stuck ON across a restart.
+        for key, target in self._targets.items():
+            if target.off_at is not None:
+                self._wheel.cancel(key)
+                target.off_at = None
+                self._spawn(self._send(target, target.off_url, "off"))
+        if self._tasks:
+            _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _spawn(self, coro: Coroutine[Any, Any, None]) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _ensure_scheduler(self) -> None:
+        self._wakeup.set()
+        if self._scheduler is None or self._scheduler.done():
+            self._scheduler = asyncio.create_task(self._run_scheduler())
+
+    async def _run_scheduler(self) -> None:
+        while True:
+            if not len(self._wheel):
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            await asyncio.sleep(self._wheel.tick)
+            for key in self._wheel.advance(time.monotonic()):
+                target = self._targets[key]
+                target.off_at = None
+                self._spawn(self._send(target, target.off_url, "off"))
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                timeout=self._timeout,
+                limits=httpx.Limits(
+                    max_connections=self._max_concurrency,
+                    max_keepalive_connections=self._max_concurrency,
+                ),
+            )
+        return self._client
+
+    async def _send(self, target: _Target, url: str, state: str) -> None:
+        # The per-target lock keeps ON and OFF for one endpoint in order.
+        async with target.lock:
+            for attempt in range(self._retries + 1):
+                try:
+                    async with self._semaphore:
+                        if self._method == "GET":
+                            resp = await self._http().get(url)
+                        else:
+                            resp = await self._http().post(url)
+                    resp.raise_for_status()
+                    log("trigger.sent", state=state, attempt=attempt + 1)
+                    return
+                except httpx.HTTPError as exc:
+                    if attempt >= self._retries:
+                        ERRORS.inc("trigger")
+                        log("trigger.error", state=state, attempts=attempt + 1, error=str(exc))
+                        return
+                    await asyncio.sleep(min(10.0, 0.5 * 2**attempt))
 
     @staticmethod
     def _resolve_urls(
@@ -0,0 +1,9 @@
+CREATE TABLE IF NOT EXISTS rollup_watermarks (
+    rollup text NOT NULL,
+    device_id text NOT NULL,
+    watermark_ts timestamptz NOT NULL,
+    updated_ts timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (rollup, device_id)
+);
+
+CREATE INDEX IF NOT EXISTS energy_intervals_start_ts_idx ON energy_intervals (start_ts);
@@ -0,0 +1,34 @@
+CREATE TABLE IF NOT EXISTS power_rollups (
+    level text NOT NULL,
+    ts_bucket timestamptz NOT NULL,
+    device_id text NOT NULL,
+    avg_total_power_w numeric,
+    avg_phase_a_power_w numeric,
+    avg_phase_b_power_w numeric,
+    avg_phase_c_power_w numeric,
+    avg_phase_a_voltage_v numeric,
+    avg_phase_b_voltage_v numeric,
+    avg_phase_c_voltage_v numeric,
+    avg_phase_a_current_a numeric,
+    avg_phase_b_current_a numeric,
+    avg_phase_c_current_a numeric,
+    min_total_power_w numeric,
+    max_total_power_w numeric,
+    samples int NOT NULL,
+    PRIMARY KEY (device_id, level, ts_bucket)
+);
+
+CREATE INDEX IF NOT EXISTS power_rollups_level_ts_idx ON power_rollups (level, ts_bucket);
+
+CREATE TABLE IF NOT EXISTS energy_rollups (
+    level text NOT NULL,
+    ts_bucket timestamptz NOT NULL,
+    device_id text NOT NULL,
+    channel int NOT NULL,
+    energy_wh numeric NOT NULL,
+    avg_power_w numeric,
+    samples int NOT NULL,
+    PRIMARY KEY (device_id, channel, level, ts_bucket)
+);
+
+CREATE INDEX IF NOT EXISTS energy_rollups_level_ts_idx ON energy_rollups (level, ts_bucket);
@@ -0,0 +1,69 @@
+CREATE TABLE IF NOT EXISTS energy_local_daily (
+    device_id text NOT NULL,
+    channel int NOT NULL,
+    local_day date NOT NULL,
+    timezone text NOT NULL,
+    energy_wh numeric NOT NULL,
+    samples int NOT NULL,
+    updated_ts timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (device_id, channel, local_day)
+);
+
+CREATE INDEX IF NOT EXISTS energy_local_daily_day_idx ON energy_local_daily (local_day);
+
+CREATE TABLE IF NOT EXISTS energy_local_monthly (
+    device_id text NOT NULL,
+    channel int NOT NULL,
+    local_month date NOT NULL,
+    timezone text NOT NULL,
+    energy_wh numeric NOT NULL,
+    days int NOT NULL,
+    updated_ts timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (device_id, channel, local_month)
+);
+
+-- Keep the old view name working on top of the materialized table.
+DROP VIEW IF EXISTS energy_daily_local;
+CREATE VIEW energy_daily_local AS
+SELECT device_id, channel, timezone, local_day, energy_wh
+FROM energy_local_daily;
+
+-- Backfill from the raw intervals still stored, so the view keeps its history. Same local-day
+-- grouping as upsert_energy_local_days_range; re-running never lowers a day's stored totals.
+INSERT INTO energy_local_daily (device_id, channel, local_day, timezone, energy_wh, samples, updated_ts)
+SELECT
+    COALESCE(e.device_id, 'unknown'),
+    e.channel,
+    (e.start_ts AT TIME ZONE COALESCE(ds.timezone, 'UTC'))::date,
+    COALESCE(ds.timezone, 'UTC'),
+    sum(e.energy_wh),
+    count(*),
+    now()
+FROM energy_intervals e
+LEFT JOIN device_settings ds ON ds.device_id = COALESCE(e.device_id, 'unknown')
+WHERE e.channel IS NOT NULL
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (device_id, channel, local_day) DO UPDATE SET
+    timezone = EXCLUDED.timezone,
+    energy_wh = EXCLUDED.energy_wh,
+    samples = EXCLUDED.samples,
+    updated_ts = EXCLUDED.updated_ts
+WHERE EXCLUDED.samples >= energy_local_daily.samples
+   OR EXCLUDED.timezone <> energy_local_daily.timezone;
+
+INSERT INTO energy_local_monthly (device_id, channel, local_month, timezone, energy_wh, days, updated_ts)
+SELECT
+    device_id,
+    channel,
+    date_trunc('month', local_day)::date,
+    max(timezone),
+    sum(energy_wh),
+    count(*),
+    now()
+FROM energy_local_daily
+GROUP BY 1, 2, 3
+ON CONFLICT (device_id, channel, local_month) DO UPDATE SET
+    timezone = EXCLUDED.timezone,
+    energy_wh = EXCLUDED.energy_wh,
+    days = EXCLUDED.days,
+    updated_ts = EXCLUDED.updated_ts;
@@ -0,0 +1,108 @@
+ALTER TABLE tariffs
+    ADD COLUMN IF NOT EXISTS revision bigint NOT NULL DEFAULT 1,
+    ADD COLUMN IF NOT EXISTS updated_ts timestamptz NOT NULL DEFAULT now();
+
+CREATE OR REPLACE FUNCTION bump_tariff_revision(p_tariff_id bigint) RETURNS void AS $$
+BEGIN
+    IF p_tariff_id IS NOT NULL THEN
+        UPDATE tariffs SET revision = revision + 1, updated_ts = now() WHERE id = p_tariff_id;
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Direct edits to a tariff row bump its revision; bumps issued by child triggers already changed it.
+CREATE OR REPLACE FUNCTION tariffs_revision_trg() RETURNS trigger AS $$
+BEGIN
+    IF NEW.revision = OLD.revision THEN
+        NEW.revision := OLD.revision + 1;
+        NEW.updated_ts := now();
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION tariff_child_revision_trg() RETURNS trigger AS $$
+DECLARE
+    row_data record;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        row_data := OLD;
+    ELSE
+        row_data := NEW;
+    END IF;
+    PERFORM bump_tariff_revision(row_data.tariff_id);
+    IF TG_OP = 'UPDATE' AND OLD.tariff_id IS DISTINCT FROM NEW.tariff_id THEN
+        PERFORM bump_tariff_revision(OLD.tariff_id);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION tariff_rules_revision_trg() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM bump_tariff_revision((SELECT tariff_id FROM tariff_components WHERE id = OLD.component_id));
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM bump_tariff_revision((SELECT tariff_id FROM tariff_components WHERE id = NEW.component_id));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION tariff_rule_windows_revision_trg() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP <> 'INSERT' THEN
+        PERFORM bump_tariff_revision((
+            SELECT c.tariff_id
+            FROM tariff_rules r
+            JOIN tariff_components c ON c.id = r.component_id
+            WHERE r.id = OLD.rule_id
+        ));
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        PERFORM bump_tariff_revision((
+            SELECT c.tariff_id
+            FROM tariff_rules r
+            JOIN tariff_components c ON c.id = r.component_id
+            WHERE r.id = NEW.rule_id
+        ));
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tariffs_revision ON tariffs;
+CREATE TRIGGER tariffs_revision
+    BEFORE UPDATE ON tariffs
+    FOR EACH ROW EXECUTE FUNCTION tariffs_revision_trg();
+
+DROP TRIGGER IF EXISTS tariff_components_revision ON tariff_components;
+CREATE TRIGGER tariff_components_revision
+    AFTER INSERT OR UPDATE OR DELETE ON tariff_components
+    FOR EACH ROW EXECUTE FUNCTION tariff_child_revision_trg();
+
+DROP TRIGGER IF EXISTS tariff_day_types_revision ON tariff_day_types;
+CREATE TRIGGER tariff_day_types_revision
+    AFTER INSERT OR UPDATE OR DELETE ON tariff_day_types
+    FOR EACH ROW EXECUTE FUNCTION tariff_child_revision_trg();
+
+DROP TRIGGER IF EXISTS tariff_seasons_revision ON tariff_seasons;
+CREATE TRIGGER tariff_seasons_revision
+    AFTER INSERT OR UPDATE OR DELETE ON tariff_seasons
+    FOR EACH ROW EXECUTE FUNCTION tariff_child_revision_trg();
+
+DROP TRIGGER IF EXISTS tariff_holidays_revision ON tariff_holidays;
+CREATE TRIGGER tariff_holidays_revision
+    AFTER INSERT OR UPDATE OR DELETE ON tariff_holidays
+    FOR EACH ROW EXECUTE FUNCTION tariff_child_revision_trg();
+
+DROP TRIGGER IF EXISTS tariff_rules_revision ON tariff_rules;
+CREATE TRIGGER tariff_rules_revision
+    AFTER INSERT OR UPDATE OR DELETE ON tariff_rules
+    FOR EACH ROW EXECUTE FUNCTION tariff_rules_revision_trg();
+
+DROP TRIGGER IF EXISTS tariff_rule_windows_revision ON tariff_rule_windows;
+CREATE TRIGGER tariff_rule_windows_revision
+    AFTER INSERT OR UPDATE OR DELETE ON tariff_rule_windows
+    FOR EACH ROW EXECUTE FUNCTION tariff_rule_windows_revision_trg();
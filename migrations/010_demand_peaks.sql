@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS demand_peaks (
+    device_id text NOT NULL,
+    window_minutes int NOT NULL,
+    period_start date NOT NULL,
+    rank smallint NOT NULL,
+    peak_ts timestamptz NOT NULL,
+    demand_kw numeric NOT NULL,
+    updated_ts timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (device_id, window_minutes, period_start, rank)
+);
@@ -0,0 +1,49 @@
+-- Which tariff prices a device's consumption, by device-local day (valid_to inclusive, NULL = open).
+CREATE TABLE IF NOT EXISTS device_tariffs (
+    device_id text NOT NULL,
+    tariff_id bigint NOT NULL REFERENCES tariffs(id) ON DELETE CASCADE,
+    valid_from date NOT NULL DEFAULT DATE '1970-01-01',
+    valid_to date,
+    PRIMARY KEY (device_id, valid_from)
+);
+
+CREATE TABLE IF NOT EXISTS energy_costs (
+    device_id text NOT NULL,
+    ts_hour timestamptz NOT NULL,
+    component text NOT NULL,
+    tariff_id bigint NOT NULL,
+    energy_wh numeric NOT NULL,
+    cost numeric NOT NULL,
+    updated_ts timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (device_id, ts_hour, component)
+);
+
+CREATE INDEX IF NOT EXISTS energy_costs_ts_hour_idx ON energy_costs (ts_hour);
+
+CREATE TABLE IF NOT EXISTS energy_costs_daily (
+    device_id text NOT NULL,
+    local_day date NOT NULL,
+    timezone text NOT NULL,
+    tariff_id bigint NOT NULL,
+    tariff_revision bigint NOT NULL,
+    currency text,
+    energy_wh numeric NOT NULL,
+    cost numeric NOT NULL,
+    components jsonb NOT NULL,
+    updated_ts timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (device_id, local_day)
+);
+
+CREATE INDEX IF NOT EXISTS energy_costs_daily_tariff_idx ON energy_costs_daily (tariff_id);
+
+CREATE TABLE IF NOT EXISTS energy_costs_monthly (
+    device_id text NOT NULL,
+    local_month date NOT NULL,
+    currency text,
+    energy_wh numeric NOT NULL,
+    cost numeric NOT NULL,
+    components jsonb NOT NULL,
+    days int NOT NULL,
+    updated_ts timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (device_id, local_month)
+);
@@ -0,0 +1,13 @@
+-- Alert rules evaluated against every live reading (see collector/alert.py METRICS for metric names).
+-- Rows here override ALERT_RULES / ALERT_POWER_W rules with the same name.
+CREATE TABLE IF NOT EXISTS alert_rules (
+    name text PRIMARY KEY,
+    metric text NOT NULL,
+    op text NOT NULL DEFAULT '>=' CHECK (op IN ('>=', '<=')),
+    threshold double precision NOT NULL,
+    sustain_seconds int NOT NULL DEFAULT 0,
+    cooldown_seconds int NOT NULL DEFAULT 900,
+    trigger boolean NOT NULL DEFAULT false,
+    enabled boolean NOT NULL DEFAULT true,
+    updated_ts timestamptz NOT NULL DEFAULT now()
+);
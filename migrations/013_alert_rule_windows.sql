@@ -0,0 +1,8 @@
+-- Rolling-window alert conditions: aggregate over the last window_seconds of live readings.
+ALTER TABLE alert_rules
+    ADD COLUMN IF NOT EXISTS aggregate text NOT NULL DEFAULT 'last',
+    ADD COLUMN IF NOT EXISTS window_seconds int NOT NULL DEFAULT 0;
+
+ALTER TABLE alert_rules DROP CONSTRAINT IF EXISTS alert_rules_aggregate_check;
+ALTER TABLE alert_rules ADD CONSTRAINT alert_rules_aggregate_check
+    CHECK (aggregate IN ('last', 'mean', 'max', 'min', 'energy_wh', 'rate'));
@@ -0,0 +1,11 @@
+-- Time-of-week load profile per device (collector/baseline.py), checkpointed periodically.
+-- Arrays are indexed by local time-of-week bucket starting Monday 00:00.
+CREATE TABLE IF NOT EXISTS load_baseline (
+    device_id text PRIMARY KEY,
+    bucket_minutes int NOT NULL,
+    timezone text,
+    mean_w double precision[] NOT NULL,
+    var_w double precision[] NOT NULL,
+    weight int[] NOT NULL,
+    updated_ts timestamptz NOT NULL DEFAULT now()
+);
@@ -0,0 +1,9 @@
+-- Last ingested EMData record per device and EMData id, so the interval loop resumes after a restart
+-- instead of re-reading EMDATA_LOOKBACK_RECORDS from the device.
+CREATE TABLE IF NOT EXISTS emdata_watermarks (
+    device_id text NOT NULL,
+    emdata_id int NOT NULL,
+    last_record_ts timestamptz NOT NULL,
+    updated_ts timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (device_id, emdata_id)
+);
@@ -0,0 +1,10 @@
+-- Coverage index for energy_intervals: one bit per EMData record slot per UTC day ('1' = stored),
+-- maintained at write time by the interval loop and the gap filler.
+CREATE TABLE IF NOT EXISTS emdata_coverage (
+    device_id text NOT NULL,
+    period int NOT NULL,
+    day date NOT NULL,
+    bits varbit NOT NULL,
+    updated_ts timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (device_id, period, day)
+);
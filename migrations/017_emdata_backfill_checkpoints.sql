@@ -0,0 +1,11 @@
+-- Records already requested from the device by scripts/backfill_emdata_window.py, one bit per EMData record
+-- slot per UTC day (same layout as emdata_coverage). Lets an interrupted backfill resume and stops later runs
+-- from asking again for records the device no longer holds.
+CREATE TABLE IF NOT EXISTS emdata_backfill_checkpoints (
+    device_id text NOT NULL,
+    period int NOT NULL,
+    day date NOT NULL,
+    bits varbit NOT NULL,
+    updated_ts timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (device_id, period, day)
+);
@@ -0,0 +1,11 @@
+-- Completed slices of scripts/rebuild_rollups.py runs, so an interrupted rebuild resumes.
+-- Rows of a run are removed when it finishes.
+CREATE TABLE IF NOT EXISTS rollup_rebuild_progress (
+    run_key text NOT NULL,
+    step text NOT NULL,
+    slice_start timestamptz NOT NULL,
+    slice_end timestamptz NOT NULL,
+    rows_written bigint NOT NULL DEFAULT 0,
+    completed_ts timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (run_key, step, slice_start)
+);
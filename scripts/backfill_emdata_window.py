@@ -2,94 +2,133 @@ from __future__ import annotations
 
 import argparse
 import asyncio
-from datetime import datetime, timezone, timedelta
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
 
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from collector.backfill import BackfillEngine, BackfillProgress
 from collector.config import Settings
-from collector.db import create_pool, upsert_energy_interval, upsert_energy_intervals_1h_range
-from collector.intervals import parse_emdata_data
+from collector.costs import CostAccrual
+from collector.db import (
+    create_pool,
+    energy_rollup_key,
+    rewind_rollup_watermarks,
+    upsert_energy_intervals_1h_range,
+    upsert_energy_local_days_range,
+)
+from collector.main import _device_id_from_sys_config, _timezone_from_sys_config
+from collector.rollups import base_level, parse_levels
 from collector.shelly_rpc import ShellyRpc
 
 
 def _parse_dt(value: str) -> datetime:
     value = value.strip().replace(" ", "T")
-    dt = datetime.fromisoformat(value)
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
     if dt.tzinfo is None:
         return dt.replace(tzinfo=timezone.utc)
     return dt.astimezone(timezone.utc)
 
 
-def _device_id_from_sys_config(payload: dict) -> str | None:
-    device = payload.get("device")
-    if isinstance(device, dict):
-        for key in ("mac", "id", "name"):
-            val = device.get(key)
-            if isinstance(val, str) and val.strip():
-                return val
-    return None
-
-
 def parse_args() -> argparse.Namespace:
-    parser = argparse.ArgumentParser(description="Backfill EMData for a specific UTC window.")
-    parser.add_argument("--start", required=True, help="Start timestamp (UTC), e.g. 2026-02-03T23:00:00Z")
-    parser.add_argument("--end", required=True, help="End timestamp (UTC), e.g. 2026-02-04T08:59:00Z")
+    parser = argparse.ArgumentParser(
+        description="Backfill EMData records from the device into energy_intervals (resumable, skips stored ranges)."
+    )
+    parser.add_argument("--start", default=None, help="Start timestamp (UTC, default: oldest record on the device)")
+    parser.add_argument("--end", default=None, help="End timestamp (UTC, default: newest record on the device)")
     parser.add_argument("--emdata-id", type=int, default=None, help="EMData id (default from .env)")
-    parser.add_argument("--max-records", type=int, default=500, help="Max records per EMData.GetData call")
+    parser.add_argument("--max-records", type=int, default=None, help="Max records per EMData.GetData call")
+    parser.add_argument("--concurrency", type=int, default=3, help="EMData.GetData calls in flight")
+    parser.add_argument(
+        "--recheck",
+        action="store_true",
+        help="Forget earlier checkpoints and ask the device again for records it did not return before",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="Print the plan without fetching")
     return parser.parse_args()
 
 
+def _reporter(every_seconds: float = 2.0):
+    last = [0.0]
+
+    def report(progress: BackfillProgress) -> None:
+        now = time.monotonic()
+        if now - last[0] < every_seconds and progress.chunks_done < progress.chunks_total:
+            return
+        last[0] = now
+        eta = f"{progress.eta_seconds:,.0f}s" if progress.eta_seconds is not None else "-"
+        print(
+            f"{progress.chunks_done}/{progress.chunks_total} chunks"
+            f"  {progress.records_fetched:,}/{progress.records_total:,} records"
+            f"  {progress.records_per_second:,.0f} rec/s  eta {eta}",
+            flush=True,
+        )
+
+    return report
+
+
 async def main() -> None:
     args = parse_args()
     settings = Settings()
     emdata_id = settings.EM_DATA_ID if args.emdata_id is None else args.emdata_id
-
-    start_ts = _parse_dt(args.start)
-    end_ts = _parse_dt(args.end)
+    max_records = settings.EMDATA_MAX_RECORDS if args.max_records is None else args.max_records
+    start_ts = _parse_dt(args.start) if args.start else datetime.min.replace(tzinfo=timezone.utc)
+    end_ts = _parse_dt(args.end) if args.end else datetime.now(timezone.utc)
     if start_ts > end_ts:
         raise SystemExit("start must be <= end")
+    energy_base = base_level(
+        f"{settings.RETENTION_INTERVAL_LOW_RES_HOURS}h",
+        max(1, settings.RETENTION_INTERVAL_LOW_RES_HOURS) * 3600,
+    )
+    energy_levels = [energy_base, *parse_levels(settings.ROLLUP_ENERGY_LEVELS, energy_base)]
 
     rpc = ShellyRpc(settings.shelly_base_url, settings.SHELLY_TIMEOUT_MS)
-    pool = create_pool(settings.DATABASE_URL)
+    pool = create_pool(settings.DATABASE_URL, settings.DATABASE_TIMEOUT_SECONDS)
     await pool.open()
     try:
         sys_cfg = await rpc.get_sys_config()
         device_id = _device_id_from_sys_config(sys_cfg)
-
-        period = 60
-        max_records = max(1, int(args.max_records))
-        bucket_seconds = max(1, int(settings.RETENTION_INTERVAL_LOW_RES_HOURS)) * 3600
-
-        total = 0
-        chunk_start = start_ts
-        while chunk_start <= end_ts:
-            chunk_end = min(end_ts, chunk_start + timedelta(seconds=period * (max_records - 1)))
-            payload = await rpc.get_emdata_data(
-                {"id": emdata_id, "ts": int(chunk_start.timestamp()), "end_ts": int(chunk_end.timestamp())}
-            )
-            intervals = list(parse_emdata_data(payload, device_id))
-            if not intervals:
-                print(f"Empty chunk: {chunk_start.isoformat()} -> {chunk_end.isoformat()}")
-                break
-
-            for interval in intervals:
-                await upsert_energy_interval(
-                    pool,
-                    interval.device_id,
-                    interval.channel,
-                    interval.start_ts,
-                    interval.end_ts,
-                    interval.energy_wh,
-                    interval.avg_power_w,
-                    interval.meta,
-                )
-            total += len(intervals)
-
-            last_interval_ts = max(i.start_ts for i in intervals)
-            hour_start = chunk_start.replace(minute=0, second=0, microsecond=0)
-            hour_end = last_interval_ts.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
-            await upsert_energy_intervals_1h_range(pool, hour_start, hour_end, bucket_seconds)
-            chunk_start = last_interval_ts + timedelta(seconds=period)
-
-        print(f"Inserted intervals: {total}")
+        if not device_id:
+            raise SystemExit("Device id missing from Sys.GetConfig")
+        engine = BackfillEngine(
+            rpc, pool, device_id, emdata_id, max_records, args.concurrency, on_progress=_reporter()
+        )
+        chunks = await engine.plan(start_ts, end_ts, args.recheck and not args.dry_run)
+        if engine.span is None:
+            print("The device holds no records in the window")
+            return
+        records = sum(chunk.records for chunk in chunks)
+        print(
+            f"{device_id}: {records:,} records to fetch in {len(chunks)} chunks"
+            f" (window {engine.span[0].isoformat()} .. {engine.span[1].isoformat()})"
+        )
+        if args.dry_run:
+            return
+
+        progress = await engine.run(chunks)
+
+        # Derived tables once over the whole window rather than per chunk, so chunks stored by an earlier,
+        # interrupted run are aggregated too.
+        span_start, span_end = engine.span
+        hour_start = span_start.replace(minute=0, second=0, microsecond=0)
+        hour_end = span_end.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+        await upsert_energy_intervals_1h_range(pool, hour_start, hour_end, energy_base.seconds or 3600)
+        await rewind_rollup_watermarks(pool, [energy_rollup_key(level) for level in energy_levels[1:]], hour_start)
+        await upsert_energy_local_days_range(pool, span_start, span_end)
+        if settings.COSTS_ENABLED:
+            await CostAccrual(pool).accrue(device_id, _timezone_from_sys_config(sys_cfg), span_start, span_end)
+
+        print(
+            f"Inserted {progress.rows_inserted:,} rows from {progress.records_fetched:,} records"
+            f" in {progress.elapsed:.1f}s ({progress.records_per_second:,.0f} rec/s);"
+            f" {progress.records_absent:,} records not on the device, {progress.chunks_failed} chunks failed"
+        )
+        if progress.chunks_failed:
+            raise SystemExit(1)
     finally:
         await pool.close()
 
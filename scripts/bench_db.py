@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from psycopg_pool import AsyncConnectionPool
+
+from collector.config import Settings
+from collector.db import (
+    create_pool,
+    delete_power_readings_older_than,
+    downsample_energy_intervals,
+    downsample_power_readings,
+    get_database_size_bytes,
+    prune_power_storage_by_size,
+    rollup_energy_level,
+    rollup_power_level,
+    upsert_energy_intervals_1h_range,
+    upsert_energy_local_days_range,
+    upsert_power_readings_1m_range,
+)
+from collector.rollups import base_level, parse_levels
+
+TABLES = (
+    "power_readings",
+    "power_readings_1m",
+    "power_rollups",
+    "energy_intervals",
+    "energy_intervals_1h",
+    "energy_rollups",
+    "energy_local_daily",
+    "energy_local_monthly",
+)
+
+
+@dataclass
+class StepResult:
+    name: str
+    seconds: float
+    rows: int | None
+    rows_per_sec: float | None
+    wal_bytes: int
+    tables: dict[str, dict[str, int]] = field(default_factory=dict)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Time retention, rollup and rebuild work against the current database (see gen_synthetic_data.py)."
+    )
+    parser.add_argument("--only", default=None, help="Comma-separated step names to run (default: all)")
+    parser.add_argument("--window-days", type=int, default=1, help="Range for the *_range and rebuild steps")
+    parser.add_argument(
+        "--prune-fraction",
+        type=float,
+        default=None,
+        help="Also run prune_power_storage_by_size with a cap this fraction below the current size (destructive)",
+    )
+    parser.add_argument("--delete-raw", action="store_true", help="Also run delete_power_readings_older_than")
+    parser.add_argument("--json", type=Path, default=None, help="Write results to this JSON file")
+    return parser.parse_args()
+
+
+async def _scalar(pool: AsyncConnectionPool, query: str, params: dict[str, Any] | None = None) -> Any:
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            row = await cur.fetchone()
+            return row[0] if row else None
+
+
+async def _table_stats(pool: AsyncConnectionPool) -> dict[str, dict[str, int]]:
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            try:
+                # PG15+: make this backend's counters visible to pg_stat_user_tables right away.
+                await cur.execute("SELECT pg_stat_force_next_flush()")
+            except Exception:  # noqa: BLE001
+                await conn.rollback()
+            await cur.execute(
+                """
+                SELECT relname, n_live_tup, n_dead_tup, pg_total_relation_size(relid)
+                FROM pg_stat_user_tables
+                WHERE relname = ANY(%(tables)s)
+                """,
+                {"tables": list(TABLES)},
+            )
+            return {
+                name: {"live": int(live), "dead": int(dead), "bytes": int(size)}
+                for name, live, dead, size in await cur.fetchall()
+            }
+
+
+async def _run_step(
+    pool: AsyncConnectionPool,
+    name: str,
+    step: Callable[[], Awaitable[int | None]],
+) -> StepResult:
+    wal_before = await _scalar(pool, "SELECT pg_current_wal_lsn()::text")
+    started = time.perf_counter()
+    rows = await step()
+    seconds = time.perf_counter() - started
+    wal_bytes = await _scalar(
+        pool,
+        "SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), %(lsn)s::pg_lsn)::bigint",
+        {"lsn": wal_before},
+    )
+    result = StepResult(
+        name=name,
+        seconds=round(seconds, 3),
+        rows=rows,
+        rows_per_sec=round(rows / seconds, 1) if rows and seconds > 0 else None,
+        wal_bytes=int(wal_bytes or 0),
+        tables=await _table_stats(pool),
+    )
+    rate = f"{result.rows_per_sec:>12,.0f}" if result.rows_per_sec else f"{'-':>12}"
+    print(
+        f"{name:40} {seconds:>9.2f}s {rows if rows is not None else '-':>12} {rate}"
+        f" {result.wal_bytes / 1048576:>10.1f}",
+        flush=True,
+    )
+    return result
+
+
+async def _script(path: str, start: datetime, end: datetime, source_rows: int, *extra: str) -> int:
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable,
+        str(ROOT / "scripts" / path),
+        "--start",
+        start.isoformat(),
+        "--end",
+        end.isoformat(),
+        *extra,
+        stdout=asyncio.subprocess.DEVNULL,
+    )
+    if await proc.wait() != 0:
+        raise RuntimeError(f"{path} exited with {proc.returncode}")
+    # The scripts do not report row counts; rows/sec is over the source rows in the window.
+    return source_rows
+
+
+async def main() -> None:
+    args = parse_args()
+    settings = Settings()
+    power_base = base_level(
+        f"{settings.RETENTION_LOW_RES_MINUTES}m",
+        max(60, settings.RETENTION_LOW_RES_MINUTES * 60),
+    )
+    energy_base = base_level(
+        f"{settings.RETENTION_INTERVAL_LOW_RES_HOURS}h",
+        max(1, settings.RETENTION_INTERVAL_LOW_RES_HOURS) * 3600,
+    )
+    power_levels = [power_base, *parse_levels(settings.ROLLUP_POWER_LEVELS, power_base)]
+    energy_levels = [energy_base, *parse_levels(settings.ROLLUP_ENERGY_LEVELS, energy_base)]
+    downsample_hours = settings.RETENTION_DOWNSAMPLE_AFTER_HOURS or 24
+
+    pool = create_pool(settings.DATABASE_URL)
+    await pool.open()
+    try:
+        data_end = await _scalar(pool, "SELECT max(ts) FROM power_readings") or await _scalar(
+            pool, "SELECT max(start_ts) FROM energy_intervals"
+        )
+        if data_end is None:
+            raise SystemExit("No data; load some with scripts/gen_synthetic_data.py first")
+        window_end = data_end.replace(minute=0, second=0, microsecond=0)
+        window_start = window_end - timedelta(days=args.window_days)
+        raw_rows = await _scalar(
+            pool,
+            "SELECT count(*) FROM power_readings WHERE ts >= %(start)s AND ts < %(end)s",
+            {"start": window_start, "end": window_end},
+        )
+        interval_rows = await _scalar(
+            pool,
+            "SELECT count(*) FROM energy_intervals WHERE start_ts >= %(start)s AND start_ts < %(end)s",
+            {"start": window_start, "end": window_end},
+        )
+        size_before = await get_database_size_bytes(pool)
+        print(f"Database {size_before / 1048576:,.0f} MiB, data up to {data_end}, window {window_start} .. {window_end}")
+        print(f"{'step':40} {'time':>10} {'rows':>12} {'rows/s':>12} {'WAL MiB':>10}")
+
+        steps: list[tuple[str, Callable[[], Awaitable[int | None]]]] = [
+            (
+                "downsample_power_readings",
+                lambda: downsample_power_readings(pool, downsample_hours, power_base.seconds or 60),
+            ),
+            (
+                "upsert_power_readings_1m_range",
+                lambda: upsert_power_readings_1m_range(pool, window_start, window_end, power_base.seconds or 60),
+            ),
+            (
+                "downsample_energy_intervals",
+                lambda: downsample_energy_intervals(pool, 0, energy_base.seconds or 3600),
+            ),
+            (
+                "upsert_energy_intervals_1h_range",
+                lambda: upsert_energy_intervals_1h_range(pool, window_start, window_end, energy_base.seconds or 3600),
+            ),
+            (
+                "upsert_energy_local_days_range",
+                lambda: upsert_energy_local_days_range(pool, window_start, window_end),
+            ),
+        ]
+        for kind, levels, rollup in (
+            ("power", power_levels, rollup_power_level),
+            ("energy", energy_levels, rollup_energy_level),
+        ):
+            cutoff_box = [levels[0].floor(datetime.now(timezone.utc))]
+            for source, level in zip(levels, levels[1:]):
+
+                async def step(source=source, level=level, rollup=rollup, levels=levels, box=cutoff_box) -> int:
+                    inserted, box[0] = await rollup(pool, level, source, box[0], source is levels[0])
+                    return inserted
+
+                steps.append((f"rollup_{kind}_level[{level.name}]", step))
+        steps.extend(
+            [
+                (
+                    "script:rebuild_rollups",
+                    lambda: _script("rebuild_rollups.py", window_start, window_end, raw_rows + interval_rows),
+                ),
+                (
+                    "script:rebuild_rollups[energy_local_days]",
+                    lambda: _script(
+                        "rebuild_rollups.py", window_start, window_end, interval_rows, "--only", "energy_local_days"
+                    ),
+                ),
+            ]
+        )
+        if args.delete_raw:
+            steps.append(
+                ("delete_power_readings_older_than", lambda: delete_power_readings_older_than(pool, downsample_hours))
+            )
+        if args.prune_fraction:
+            cap = int(size_before * (1.0 - args.prune_fraction))
+
+            async def prune() -> int:
+                deleted = await prune_power_storage_by_size(pool, cap)
+                return int(deleted["raw"] or 0) + int(deleted["low"] or 0)
+
+            steps.append((f"prune_power_storage_by_size[-{args.prune_fraction:.0%}]", prune))
+
+        only = {name.strip() for name in args.only.split(",")} if args.only else None
+        results = [await _run_step(pool, name, step) for name, step in steps if only is None or name in only]
+
+        print(f"\n{'table':24} {'live':>14} {'dead':>12} {'dead %':>8} {'MiB':>10}")
+        for name, stats in (await _table_stats(pool)).items():
+            total = stats["live"] + stats["dead"]
+            dead_pct = stats["dead"] * 100.0 / total if total else 0.0
+            print(
+                f"{name:24} {stats['live']:>14,} {stats['dead']:>12,} {dead_pct:>7.1f}%"
+                f" {stats['bytes'] / 1048576:>10,.1f}"
+            )
+    finally:
+        await pool.close()
+
+    if args.json is not None:
+        args.json.write_text(json.dumps([asdict(result) for result in results], indent=2, default=str) + "\n")
+        print(f"Wrote {args.json}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,305 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import gc
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from collector import db
+from collector.alert import AlertEngine, AlertRule
+from collector.ingest import extract_power_reading
+from collector.intervals import parse_emdata_data
+from collector.main import _bucket_start
+
+DEFAULT_BASELINE = ROOT / "scripts" / "bench_baseline.json"
+
+# Shelly.GetStatus from a Pro 3EM (Gen3 firmware) with every component the device reports.
+GEN3_STATUS: dict[str, Any] = {
+    "ble": {},
+    "bthome": {"errors": ["bluetooth_disabled"]},
+    "cloud": {"connected": True},
+    "em:0": {
+        "id": 0,
+        "a_current": 4.029,
+        "a_voltage": 236.1,
+        "a_act_power": 951.2,
+        "a_aprt_power": 951.9,
+        "a_pf": 1.0,
+        "a_freq": 50.0,
+        "b_current": 4.027,
+        "b_voltage": 236.2,
+        "b_act_power": -951.1,
+        "b_aprt_power": 951.8,
+        "b_pf": 1.0,
+        "b_freq": 50.0,
+        "c_current": 3.03,
+        "c_voltage": 236.4,
+        "c_act_power": 715.0,
+        "c_aprt_power": 716.3,
+        "c_pf": 1.0,
+        "c_freq": 50.0,
+        "n_current": None,
+        "total_current": 11.087,
+        "total_act_power": 715.113,
+        "total_aprt_power": 2620.061,
+        "user_calibrated_phase": [],
+    },
+    "emdata:0": {
+        "id": 0,
+        "a_total_act_energy": 4125.35,
+        "a_total_act_ret_energy": 0.0,
+        "b_total_act_energy": 1322.48,
+        "b_total_act_ret_energy": 2.51,
+        "c_total_act_energy": 2890.09,
+        "c_total_act_ret_energy": 0.0,
+        "total_act": 8337.92,
+        "total_act_ret": 2.51,
+    },
+    "eth": {"ip": None},
+    "modbus": {},
+    "mqtt": {"connected": False},
+    "sys": {
+        "mac": "ECDA3BC1D2E3",
+        "restart_required": False,
+        "time": "14:02",
+        "unixtime": 1770645720,
+        "last_sync_ts": 1770645600,
+        "uptime": 863211,
+        "ram_size": 247160,
+        "ram_free": 117152,
+        "ram_min_free": 98604,
+        "fs_size": 524288,
+        "fs_free": 204800,
+        "cfg_rev": 27,
+        "kvs_rev": 1,
+        "schedule_rev": 0,
+        "webhook_rev": 2,
+        "btrelay_rev": 0,
+        "available_updates": {},
+        "reset_reason": 3,
+        "utc_offset": 3600,
+    },
+    "temperature:0": {"id": 0, "tC": 42.7, "tF": 108.9},
+    "wifi": {"sta_ip": "192.168.1.41", "status": "got ip", "ssid": "home", "rssi": -61},
+    "ws": {"connected": False},
+}
+
+# EMData.GetData key set of a Pro 3EM: per-phase energy, min/max/avg power, voltage and current, plus neutral.
+EMDATA_KEYS = [
+    f"{phase}_{name}"
+    for phase in ("a", "b", "c")
+    for name in (
+        "total_act_energy",
+        "fund_act_energy",
+        "total_act_ret_energy",
+        "fund_act_ret_energy",
+        "lag_react_energy",
+        "lead_react_energy",
+        "max_act_power",
+        "min_act_power",
+        "max_aprt_power",
+        "min_aprt_power",
+        "max_voltage",
+        "min_voltage",
+        "avg_voltage",
+        "max_current",
+        "min_current",
+        "avg_current",
+    )
+] + ["n_max_current", "n_min_current", "n_avg_current"]
+
+
+def emdata_payload(records: int) -> dict[str, Any]:
+    row = [round(0.5 + (i % 7) * 0.31, 3) for i in range(len(EMDATA_KEYS))]
+    return {
+        "keys": EMDATA_KEYS,
+        "data": [{"ts": 1770645600, "period": 60, "values": [list(row) for _ in range(records)]}],
+        "next_record_ts": 1770645600 + records * 60,
+    }
+
+
+def alert_rules() -> list[AlertRule]:
+    return [
+        AlertRule("HIGH_POWER", "total_power_w", 4500, sustain_seconds=120, trigger=True),
+        AlertRule("OVERLOAD", "max_phase_current_a", 25, sustain_seconds=60),
+        AlertRule("VOLTAGE_SAG", "min_voltage_v", 207, op="<=", sustain_seconds=10),
+        AlertRule("VOLTAGE_SWELL", "max_voltage_v", 253, sustain_seconds=10),
+        AlertRule("CURRENT_IMBALANCE", "current_imbalance_pct", 60, sustain_seconds=300),
+        AlertRule("HIGH_MEAN_POWER", "total_power_w", 4000, aggregate="mean", window_seconds=600),
+        AlertRule("HOURLY_ENERGY", "total_power_w", 5000, aggregate="energy_wh", window_seconds=3600),
+        AlertRule("PEAK_PHASE", "max_phase_power_w", 3500, aggregate="max", window_seconds=300),
+    ]
+
+
+async def _noop(*args: Any, **kwargs: Any) -> None:
+    return None
+
+
+def bench_alert_engine() -> Callable[[int], None]:
+    # State writes go to a no-op so only in-memory evaluation is measured.
+    db.upsert_alert_states = _noop
+    engine = AlertEngine(alert_rules(), pool=None, persist_seconds=1e9)
+    reading = extract_power_reading(GEN3_STATUS)
+    base = datetime(2026, 2, 9, tzinfo=timezone.utc)
+    step = timedelta(seconds=1)
+    clock = [0]
+    loop = asyncio.new_event_loop()
+
+    async def run(n: int) -> None:
+        i = clock[0]
+        for _ in range(n):
+            i += 1
+            reading.ts = base + step * i
+            await engine.process(reading)
+        clock[0] = i
+
+    return lambda n: loop.run_until_complete(run(n))
+
+
+def _looped(func: Callable[[], Any]) -> Callable[[int], None]:
+    def run(n: int) -> None:
+        for _ in range(n):
+            func()
+
+    return run
+
+
+def cases() -> dict[str, Callable[[int], None]]:
+    payloads = {records: emdata_payload(records) for records in (1, 100, 500)}
+    ts = datetime(2026, 2, 9, 14, 2, 37, tzinfo=timezone.utc)
+    return {
+        "extract_power_reading[gen3]": _looped(lambda: extract_power_reading(GEN3_STATUS)),
+        "parse_emdata_data[1]": _looped(lambda: parse_emdata_data(payloads[1], "dev")),
+        "parse_emdata_data[100]": _looped(lambda: parse_emdata_data(payloads[100], "dev")),
+        "parse_emdata_data[500]": _looped(lambda: parse_emdata_data(payloads[500], "dev")),
+        "alert_engine.process[8 rules]": bench_alert_engine(),
+        "_bucket_start[60s]": _looped(lambda: _bucket_start(ts, 60)),
+    }
+
+
+def measure(run: Callable[[int], None], min_seconds: float, repeat: int) -> dict[str, float]:
+    run(1)
+    number = 1
+    while True:
+        started = time.perf_counter()
+        run(number)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds / 4:
+            break
+        number *= 4
+    number = max(1, int(number * min_seconds / max(elapsed, 1e-9)))
+
+    # Median, not best: a single lucky repeat would set a baseline later runs rarely reach.
+    timings = []
+    gc.collect()
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        run(number)
+        timings.append((time.perf_counter() - started) / number)
+    median = statistics.median(timings)
+
+    # Allocations in a separate pass so tracing does not skew timing: transient peak of one call and
+    # blocks still alive after many calls (a leak shows up as a growing count).
+    tracemalloc.start()
+    run(1)
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    run(1)
+    _, peak = tracemalloc.get_traced_memory()
+    blocks = sys.getallocatedblocks()
+    run(100)
+    gc.collect()
+    retained = sys.getallocatedblocks() - blocks
+    tracemalloc.stop()
+
+    return {
+        "ops_per_sec": round(1.0 / median, 1),
+        "us_per_op": round(median * 1e6, 3),
+        "peak_alloc_bytes": max(0, peak - before),
+        "retained_blocks_per_100": max(0, retained),
+    }
+
+
+def compare(results: dict[str, dict[str, float]], baseline: dict[str, Any], threshold: float) -> list[str]:
+    regressions = []
+    print(f"{'case':34} {'ops/sec':>12} {'base':>12} {'delta':>8} {'peak B':>9} {'base B':>9}")
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            print(f"{name:34} {result['ops_per_sec']:>12,.0f} {'-':>12} {'new':>8} {result['peak_alloc_bytes']:>9}")
+            continue
+        delta = result["ops_per_sec"] / base["ops_per_sec"] - 1.0
+        flag = ""
+        if delta < -threshold:
+            flag = "  SLOWER"
+            regressions.append(name)
+        if base["peak_alloc_bytes"] and result["peak_alloc_bytes"] > base["peak_alloc_bytes"] * (1 + threshold):
+            flag += "  MORE ALLOC"
+            if name not in regressions:
+                regressions.append(name)
+        print(
+            f"{name:34} {result['ops_per_sec']:>12,.0f} {base['ops_per_sec']:>12,.0f} {delta:>+8.1%}"
+            f" {result['peak_alloc_bytes']:>9} {base['peak_alloc_bytes']:>9}{flag}"
+        )
+    return regressions
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the collector's hot paths.")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE, help="Baseline JSON to compare against")
+    parser.add_argument("--save", action="store_true", help="Write results as the new baseline")
+    parser.add_argument("--filter", default=None, help="Only run cases whose name contains this text")
+    parser.add_argument("--min-seconds", type=float, default=1.0, help="Target duration of each timed repeat")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed repeats per case (median is kept)")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Relative change reported as a regression")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    results = {}
+    for name, run in cases().items():
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(run, args.min_seconds, args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    if args.save:
+        payload = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "results": results,
+        }
+        args.baseline.write_text(json.dumps(payload, indent=2) + "\n")
+        print(f"Saved baseline to {args.baseline}")
+        return
+    if not args.baseline.exists():
+        print(f"No baseline at {args.baseline}; run with --save first")
+        return
+    baseline = json.loads(args.baseline.read_text())
+    print(f"Baseline: python {baseline.get('python')} on {baseline.get('machine')} ({baseline.get('created')})")
+    if (baseline.get("python"), baseline.get("machine")) != (platform.python_version(), platform.machine()):
+        print("Warning: baseline was recorded on a different Python or machine; re-run with --save on this host")
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"Regressions beyond {args.threshold:.0%}: {', '.join(regressions)}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from collector.compare import compare_tariffs, load_shape
+from collector.config import Settings
+from collector.db import create_pool
+
+
+def _parse_dt(value: str) -> datetime:
+    value = value.strip().replace(" ", "T")
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare tariffs against historical consumption.")
+    parser.add_argument("--start", required=True, help="Start timestamp (UTC), e.g. 2025-01-01T00:00:00Z")
+    parser.add_argument("--end", required=True, help="End timestamp (UTC), e.g. 2026-01-01T00:00:00Z")
+    parser.add_argument("--device-id", required=True, help="Device id as stored in energy_intervals")
+    parser.add_argument("--channel", type=int, default=3, help="EMData channel (default 3 = total)")
+    parser.add_argument("--tariff", action="append", help="Tariff name (repeatable, default: all tariffs)")
+    parser.add_argument("--minute", action="store_true", help="Use 1-minute energy_intervals instead of hourly")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--cache-dir", default=None, help="Load-shape cache dir (default: TARIFF_SHAPE_CACHE_DIR)")
+    parser.add_argument("--json", action="store_true", help="Print JSON instead of a table")
+    return parser.parse_args()
+
+
+async def main() -> None:
+    args = parse_args()
+    settings = Settings()
+
+    start_ts = _parse_dt(args.start)
+    end_ts = _parse_dt(args.end)
+    if start_ts >= end_ts:
+        raise SystemExit("start must be < end")
+
+    pool = create_pool(settings.DATABASE_URL)
+    await pool.open()
+    try:
+        started = time.perf_counter()
+        shape = await load_shape(
+            pool,
+            args.device_id,
+            args.channel,
+            start_ts,
+            end_ts,
+            hourly=not args.minute,
+            cache_dir=args.cache_dir or settings.TARIFF_SHAPE_CACHE_DIR,
+        )
+        loaded = time.perf_counter()
+        results = await compare_tariffs(pool, shape, args.tariff, args.workers or settings.TARIFF_COMPARE_WORKERS)
+        priced = time.perf_counter()
+    finally:
+        await pool.close()
+
+    if args.json:
+        print(json.dumps([cost.as_dict() for cost in results], indent=2))
+        return
+
+    components: list[str] = []
+    for cost in results:
+        components.extend(name for name in cost.components if name not in components)
+    header = ["tariff", "kwh", *components, "total", "currency"]
+    rows = [
+        [
+            cost.name,
+            f"{cost.energy_kwh:.3f}",
+            *(f"{cost.components[name]:.2f}" if name in cost.components else "-" for name in components),
+            f"{cost.total:.2f}",
+            cost.currency or "",
+        ]
+        for cost in results
+    ]
+    widths = [max(len(str(row[i])) for row in [header, *rows]) for i in range(len(header))]
+    for row in [header, *rows]:
+        print("  ".join(str(value).ljust(width) for value, width in zip(row, widths)))
+    unpriced = max((cost.unpriced_kwh for cost in results), default=0.0)
+    if unpriced:
+        print(f"Warning: up to {unpriced:.3f} kWh fell outside every rule of at least one tariff")
+    print(f"{len(shape.epochs)} rows loaded in {loaded - started:.2f}s, {len(results)} tariffs priced in {priced - loaded:.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
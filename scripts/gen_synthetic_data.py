@@ -0,0 +1,266 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import math
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from collector.config import Settings
+from collector.db import create_pool, upsert_device_settings
+
+READING_COLUMNS = (
+    "ts, device_id, total_power_w, phase_a_power_w, phase_b_power_w, phase_c_power_w, "
+    "phase_a_voltage_v, phase_b_voltage_v, phase_c_voltage_v, "
+    "phase_a_current_a, phase_b_current_a, phase_c_current_a"
+)
+INTERVAL_COLUMNS = "device_id, channel, start_ts, end_ts, energy_wh, avg_power_w, meta"
+
+# Appliance events: (power W, minutes, expected starts per day).
+APPLIANCES = ((2200.0, 4, 3.0), (2500.0, 45, 0.4), (1800.0, 90, 0.5), (3500.0, 120, 0.2))
+
+
+def _parse_dt(value: str) -> datetime:
+    value = value.strip().replace(" ", "T")
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Fill Postgres with synthetic power_readings and energy_intervals using COPY."
+    )
+    parser.add_argument("--devices", type=int, default=1, help="Number of simulated devices")
+    parser.add_argument("--years", type=float, default=1.0, help="Years of history per device")
+    parser.add_argument("--end", default=None, help="End timestamp (UTC, default: now rounded to the day)")
+    parser.add_argument("--reading-seconds", type=int, default=10, help="Live reading cadence")
+    parser.add_argument("--interval-seconds", type=int, default=60, help="EMData interval period")
+    parser.add_argument("--no-readings", action="store_true", help="Only generate energy_intervals")
+    parser.add_argument("--no-intervals", action="store_true", help="Only generate power_readings")
+    parser.add_argument(
+        "--meta",
+        choices=("full", "none"),
+        default="full",
+        help="Store the full EMData record in energy_intervals.meta like the collector does (default) or NULL",
+    )
+    parser.add_argument("--timezone", default="Europe/Warsaw", help="device_settings timezone for the devices")
+    parser.add_argument("--device-prefix", default="synth", help="Device id prefix")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed")
+    return parser.parse_args()
+
+
+class DeviceModel:
+    # Base load with a daily shape plus randomly placed appliance runs, split unevenly over phases.
+
+    def __init__(self, rng: random.Random) -> None:
+        self.rng = rng
+        self.base_w = rng.uniform(120.0, 400.0)
+        self.shares = [rng.uniform(0.2, 0.5) for _ in range(3)]
+        total = sum(self.shares)
+        self.shares = [share / total for share in self.shares]
+
+    def day(self, step_seconds: int) -> list[float]:
+        steps = 86400 // step_seconds
+        per_hour = 3600 / step_seconds
+        power = []
+        for i in range(steps):
+            hour = i / per_hour
+            shape = 1.0 + 0.6 * math.exp(-((hour - 7.5) ** 2) / 2.0) + 1.1 * math.exp(-((hour - 19.5) ** 2) / 4.0)
+            power.append(self.base_w * shape + self.rng.gauss(0.0, 15.0))
+        for watts, minutes, per_day in APPLIANCES:
+            for _ in range(self._poisson(per_day)):
+                start = self.rng.randrange(steps)
+                for i in range(start, min(steps, start + int(minutes * 60 / step_seconds))):
+                    power[i] += watts
+        return [max(0.0, value) for value in power]
+
+    def _poisson(self, mean: float) -> int:
+        count = 0
+        threshold = math.exp(-mean)
+        product = self.rng.random()
+        while product > threshold:
+            count += 1
+            product *= self.rng.random()
+        return count
+
+
+def _times_of_day(step_seconds: int) -> list[str]:
+    return [
+        f"{s // 3600:02d}:{s % 3600 // 60:02d}:{s % 60:02d}+00"
+        for s in range(0, 86400, step_seconds)
+    ]
+
+
+def _meta_template() -> str:
+    names = (
+        "total_act_energy",
+        "fund_act_energy",
+        "total_act_ret_energy",
+        "fund_act_ret_energy",
+        "lag_react_energy",
+        "lead_react_energy",
+        "max_act_power",
+        "min_act_power",
+        "max_aprt_power",
+        "min_aprt_power",
+        "max_voltage",
+        "min_voltage",
+        "avg_voltage",
+        "max_current",
+        "min_current",
+        "avg_current",
+    )
+    parts = []
+    for phase in "abc":
+        for name in names:
+            if name in ("total_act_energy", "fund_act_energy"):
+                value = f"%({phase}_energy).4f"
+            elif name.endswith("act_power"):
+                value = f"%({phase}_power).1f"
+            elif name.endswith("voltage"):
+                value = "230.4"
+            elif name.endswith("current"):
+                value = f"%({phase}_current).3f"
+            else:
+                value = "0.0"
+            parts.append(f'"{phase}_{name}": {value}')
+    parts.extend(['"n_max_current": 0.0', '"n_min_current": 0.0', '"n_avg_current": 0.0'])
+    return "{" + ", ".join(parts) + "}"
+
+
+def reading_rows(device_id: str, day: date, power: list[float], shares: list[float], times: list[str]) -> str:
+    prefix = f"{day.isoformat()} "
+    lines = []
+    for clock, total in zip(times, power):
+        pa, pb, pc = (total * share for share in shares)
+        lines.append(
+            f"{prefix}{clock}\t{device_id}\t{total:.2f}\t{pa:.2f}\t{pb:.2f}\t{pc:.2f}"
+            f"\t230.1\t231.4\t229.8\t{pa / 230.1:.3f}\t{pb / 231.4:.3f}\t{pc / 229.8:.3f}\n"
+        )
+    return "".join(lines)
+
+
+def interval_rows(
+    device_id: str,
+    day: date,
+    power: list[float],
+    shares: list[float],
+    reading_seconds: int,
+    interval_seconds: int,
+    times: list[str],
+    meta: str | None,
+) -> str:
+    per_interval = max(1, interval_seconds // reading_seconds)
+    day_start = f"{day.isoformat()} "
+    next_day = f"{(day + timedelta(days=1)).isoformat()} "
+    lines = []
+    for n, clock in enumerate(times):
+        window = power[n * per_interval : (n + 1) * per_interval]
+        total_w = sum(window) / len(window)
+        end_clock = times[n + 1] if n + 1 < len(times) else None
+        start = day_start + clock
+        end = day_start + end_clock if end_clock is not None else next_day + times[0]
+        phase_w = [total_w * share for share in shares]
+        phase_wh = [w * interval_seconds / 3600.0 for w in phase_w]
+        record = "\\N"
+        if meta is not None:
+            record = meta % {
+                "a_energy": phase_wh[0],
+                "b_energy": phase_wh[1],
+                "c_energy": phase_wh[2],
+                "a_power": phase_w[0],
+                "b_power": phase_w[1],
+                "c_power": phase_w[2],
+                "a_current": phase_w[0] / 230.4,
+                "b_current": phase_w[1] / 230.4,
+                "c_current": phase_w[2] / 230.4,
+            }
+        for channel in range(3):
+            lines.append(
+                f"{device_id}\t{channel}\t{start}\t{end}\t{phase_wh[channel]:.4f}\t{phase_w[channel]:.3f}\t{record}\n"
+            )
+        lines.append(f"{device_id}\t3\t{start}\t{end}\t{sum(phase_wh):.4f}\t{total_w:.3f}\t{record}\n")
+    return "".join(lines)
+
+
+async def main() -> None:
+    args = parse_args()
+    settings = Settings()
+    if 86400 % args.reading_seconds or 86400 % args.interval_seconds:
+        raise SystemExit("--reading-seconds and --interval-seconds must divide a day")
+    if args.interval_seconds % args.reading_seconds:
+        raise SystemExit("--interval-seconds must be a multiple of --reading-seconds")
+
+    end = _parse_dt(args.end) if args.end else datetime.now(timezone.utc)
+    end_day = end.date()
+    days = max(1, int(round(args.years * 365)))
+    start_day = end_day - timedelta(days=days)
+    reading_times = _times_of_day(args.reading_seconds)
+    interval_times = _times_of_day(args.interval_seconds)
+    meta = _meta_template() if args.meta == "full" else None
+
+    pool = create_pool(settings.DATABASE_URL)
+    await pool.open()
+    started = time.perf_counter()
+    readings = intervals = 0
+    try:
+        for n in range(args.devices):
+            device_id = f"{args.device_prefix}{n:04d}"
+            model = DeviceModel(random.Random(args.seed * 100003 + n))
+            await upsert_device_settings(pool, device_id, args.timezone, None, {"synthetic": True})
+            for offset in range(days):
+                day = start_day + timedelta(days=offset)
+                power = model.day(args.reading_seconds)
+                # One transaction per device-day keeps COPY batches around a few MB.
+                async with pool.connection() as conn:
+                    async with conn.cursor() as cur:
+                        if not args.no_readings:
+                            async with cur.copy(f"COPY power_readings ({READING_COLUMNS}) FROM STDIN") as copy:
+                                await copy.write(reading_rows(device_id, day, power, model.shares, reading_times))
+                            readings += len(power)
+                        if not args.no_intervals:
+                            async with cur.copy(f"COPY energy_intervals ({INTERVAL_COLUMNS}) FROM STDIN") as copy:
+                                await copy.write(
+                                    interval_rows(
+                                        device_id,
+                                        day,
+                                        power,
+                                        model.shares,
+                                        args.reading_seconds,
+                                        args.interval_seconds,
+                                        interval_times,
+                                        meta,
+                                    )
+                                )
+                            intervals += len(interval_times) * 4
+                if offset % 30 == 29 or offset == days - 1:
+                    elapsed = time.perf_counter() - started
+                    print(
+                        f"{device_id} {day}: {readings:,} readings, {intervals:,} intervals"
+                        f" ({(readings + intervals) / elapsed:,.0f} rows/s)",
+                        flush=True,
+                    )
+        async with pool.connection() as conn:
+            await conn.execute("ANALYZE power_readings")
+            await conn.execute("ANALYZE energy_intervals")
+    finally:
+        await pool.close()
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"Loaded {readings:,} readings and {intervals:,} intervals for {args.devices} devices"
+        f" ({start_day} .. {end_day}) in {elapsed:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from collector.config import Settings
+from collector.coverage import missing_ranges, range_records
+from collector.db import create_pool, get_emdata_coverage
+
+
+def _parse_dt(value: str) -> datetime:
+    value = value.strip().replace(" ", "T")
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="List EMData records missing from energy_intervals, read from the emdata_coverage index."
+    )
+    parser.add_argument("--device-id", required=True, help="Device id")
+    parser.add_argument("--start", required=True, help="Start timestamp (UTC), e.g. 2026-02-01T00:00:00Z")
+    parser.add_argument("--end", default=None, help="End timestamp (UTC, default: now)")
+    parser.add_argument("--period", type=int, default=60, help="EMData record period in seconds")
+    return parser.parse_args()
+
+
+async def main() -> None:
+    args = parse_args()
+    settings = Settings()
+    start_ts = _parse_dt(args.start)
+    end_ts = _parse_dt(args.end) if args.end else datetime.now(timezone.utc)
+    if start_ts > end_ts:
+        raise SystemExit("start must be <= end")
+    # Last whole record slot before end.
+    end_ts -= timedelta(seconds=int(end_ts.timestamp()) % args.period + args.period)
+
+    pool = create_pool(settings.DATABASE_URL)
+    await pool.open()
+    try:
+        bitmaps = await get_emdata_coverage(pool, args.device_id, args.period, start_ts.date(), end_ts.date())
+    finally:
+        await pool.close()
+
+    gaps = missing_ranges(bitmaps, start_ts, end_ts, args.period)
+    for first, last in gaps:
+        print(f"{first.isoformat()} .. {last.isoformat()}  {range_records(first, last, args.period)} records")
+    missing = sum(range_records(first, last, args.period) for first, last in gaps)
+    print(f"Missing records: {missing} in {len(gaps)} gaps")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,314 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+import random
+import resource
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from aiohttp import web
+
+from collector import logger
+from collector import main as collector_main
+from collector.alert import AlertEngine, AlertRule
+from collector.config import Settings
+from collector.db import create_pool
+from collector.health import HealthState
+from collector.main import DeviceContext, interval_poll_loop, live_poll_loop
+from collector.rollups import base_level, parse_levels
+from collector.shelly_rpc import ShellyRpc
+from collector.trigger import TriggerDispatcher
+
+EMDATA_PERIOD = 60
+EMDATA_KEYS = [f"{phase}_total_act_energy" for phase in "abc"] + [f"{phase}_fund_act_energy" for phase in "abc"]
+
+
+class SimulatedFleet:
+    # One HTTP server answering for every simulated device under /dev/<n>/rpc/<method>; records when
+    # each device last answered Shelly.GetStatus so the harness can time response -> committed row.
+
+    def __init__(self, latency_ms: float = 0.0, history_minutes: int = 30) -> None:
+        self._latency = latency_ms / 1000.0
+        self._history = history_minutes * 60
+        self._booted = int(time.time()) // EMDATA_PERIOD * EMDATA_PERIOD - self._history
+        self.responded: dict[str, float] = {}
+
+    def device_id(self, n: int) -> str:
+        return f"loadtest{n:05d}"
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route("*", "/dev/{n}/rpc/{method}", self.rpc)
+        return app
+
+    async def rpc(self, request: web.Request) -> web.Response:
+        n = int(request.match_info["n"])
+        method = request.match_info["method"]
+        params: dict[str, Any] = await request.json() if request.can_read_body else {}
+        if self._latency:
+            await asyncio.sleep(self._latency * random.uniform(0.5, 1.5))
+        if method == "Shelly.GetStatus":
+            body = self._status(n)
+            self.responded[self.device_id(n)] = time.perf_counter()
+        elif method == "Sys.GetConfig":
+            body = {"device": {"mac": self.device_id(n)}, "location": {"tz": "Europe/Warsaw"}}
+        elif method == "EMData.GetRecords":
+            records = (int(time.time()) - self._booted) // EMDATA_PERIOD
+            body = {"data_blocks": [{"ts": self._booted, "period": EMDATA_PERIOD, "records": records}]}
+        elif method == "EMData.GetData":
+            body = self._emdata(int(params.get("ts", self._booted)), int(params.get("end_ts", time.time())))
+        else:
+            return web.json_response({"code": 404, "message": f"No handler for {method}"}, status=404)
+        return web.json_response(body)
+
+    def _status(self, n: int) -> dict[str, Any]:
+        phases = [random.uniform(50.0, 1500.0) for _ in range(3)]
+        em = {"id": 0, "total_act_power": sum(phases)}
+        for phase, power in zip("abc", phases):
+            em[f"{phase}_act_power"] = power
+            em[f"{phase}_voltage"] = random.uniform(228.0, 234.0)
+            em[f"{phase}_current"] = power / 230.0
+        return {"em:0": em, "sys": {"mac": self.device_id(n), "unixtime": int(time.time())}}
+
+    def _emdata(self, start: int, end: int) -> dict[str, Any]:
+        start = max(self._booted, start - start % EMDATA_PERIOD)
+        end = min(end, int(time.time()) - EMDATA_PERIOD)
+        count = max(0, (end - start) // EMDATA_PERIOD + 1)
+        values = [[round(random.uniform(0.5, 25.0), 3) for _ in EMDATA_KEYS] for _ in range(count)]
+        return {"keys": EMDATA_KEYS, "data": [{"ts": start, "period": EMDATA_PERIOD, "values": values}]}
+
+
+@dataclass
+class StepStats:
+    devices: int
+    polls: int = 0
+    expected_polls: int = 0
+    latencies: list[float] = field(default_factory=list)
+    writes: list[float] = field(default_factory=list)
+    cpu_seconds: float = 0.0
+    wall_seconds: float = 0.0
+    rss_bytes: int = 0
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as fh:
+            return int(fh.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # ru_maxrss is the peak, in KiB on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Probe:
+    # Wraps the live loop's row insert: write latency, and device response -> commit latency.
+
+    def __init__(self, fleet: SimulatedFleet) -> None:
+        self._fleet = fleet
+        self._insert = collector_main.insert_power_reading
+        self.stats: StepStats | None = None
+
+    def install(self) -> None:
+        collector_main.insert_power_reading = self._timed_insert
+
+    async def _timed_insert(self, pool: Any, ts: Any, device_id: str | None, *args: Any) -> None:
+        started = time.perf_counter()
+        await self._insert(pool, ts, device_id, *args)
+        committed = time.perf_counter()
+        stats = self.stats
+        if stats is None:
+            return
+        stats.polls += 1
+        stats.writes.append(committed - started)
+        responded = self._fleet.responded.get(device_id or "")
+        if responded is not None:
+            stats.latencies.append(committed - responded)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Ramp simulated Shelly devices against the collector loops until polls fall behind."
+    )
+    parser.add_argument("--start-devices", type=int, default=5, help="Devices in the first step")
+    parser.add_argument("--max-devices", type=int, default=2000, help="Stop ramping at this many devices")
+    parser.add_argument("--ramp-factor", type=float, default=2.0, help="Multiply the device count each step")
+    parser.add_argument("--poll-seconds", type=float, default=10.0, help="Live poll cadence per device")
+    parser.add_argument("--interval-poll-seconds", type=float, default=60.0, help="EMData poll cadence per device")
+    parser.add_argument("--step-seconds", type=float, default=60.0, help="Measured time per step")
+    parser.add_argument("--warmup-seconds", type=float, default=15.0, help="Unmeasured time after devices start")
+    parser.add_argument("--device-latency-ms", type=float, default=20.0, help="Simulated device response time")
+    parser.add_argument("--min-poll-ratio", type=float, default=0.95, help="Completed/expected polls below this fails")
+    parser.add_argument("--max-write-p99-ms", type=float, default=250.0, help="DB insert p99 above this fails")
+    return parser.parse_args()
+
+
+async def _run_step(
+    args: argparse.Namespace,
+    settings: Settings,
+    pool: Any,
+    base_url: str,
+    fleet: SimulatedFleet,
+    probe: Probe,
+    devices: int,
+) -> StepStats:
+    energy_base = base_level(
+        f"{settings.RETENTION_INTERVAL_LOW_RES_HOURS}h",
+        max(1, settings.RETENTION_INTERVAL_LOW_RES_HOURS) * 3600,
+    )
+    energy_levels = [energy_base, *parse_levels(settings.ROLLUP_ENERGY_LEVELS, energy_base)]
+    trigger = TriggerDispatcher(None, None, None, "POST", 0)
+    rule = AlertRule("LOADTEST_HIGH_POWER", "total_power_w", settings.ALERT_POWER_W, sustain_seconds=120)
+    stop = asyncio.Event()
+    tasks = []
+    for n in range(devices):
+        rpc = ShellyRpc(f"{base_url}/dev/{n}", settings.SHELLY_TIMEOUT_MS)
+        ctx = DeviceContext(device_id=fleet.device_id(n), timezone="Europe/Warsaw")
+        health = HealthState()
+        engine = AlertEngine([rule], pool, None, settings.ALERT_STATE_PERSIST_SECONDS)
+        tasks.append(
+            asyncio.create_task(
+                live_poll_loop(
+                    rpc,
+                    pool,
+                    engine,
+                    None,
+                    trigger,
+                    settings.RETENTION_LOW_RES_MINUTES,
+                    args.poll_seconds,
+                    health,
+                    ctx,
+                    None,
+                    None,
+                    stop,
+                )
+            )
+        )
+        tasks.append(
+            asyncio.create_task(
+                interval_poll_loop(
+                    rpc,
+                    pool,
+                    ctx,
+                    settings.EM_DATA_ID,
+                    settings.EMDATA_LOOKBACK_RECORDS,
+                    settings.EMDATA_MAX_RECORDS,
+                    settings.EMDATA_MAX_CHUNKS_PER_POLL,
+                    settings.RETENTION_INTERVAL_LOW_RES_HOURS,
+                    energy_levels,
+                    args.interval_poll_seconds,
+                    health,
+                    None,
+                    None,
+                    stop,
+                )
+            )
+        )
+        # Spread first polls over one cadence like independently started devices.
+        await asyncio.sleep(args.poll_seconds / devices)
+
+    await asyncio.sleep(args.warmup_seconds)
+    stats = StepStats(devices=devices)
+    probe.stats = stats
+    cpu_started = time.process_time()
+    wall_started = time.perf_counter()
+    await asyncio.sleep(args.step_seconds)
+    stats.cpu_seconds = time.process_time() - cpu_started
+    stats.wall_seconds = time.perf_counter() - wall_started
+    stats.rss_bytes = _rss_bytes()
+    stats.expected_polls = int(devices * stats.wall_seconds / args.poll_seconds)
+    probe.stats = None
+
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await trigger.close()
+    return stats
+
+
+async def main() -> None:
+    args = parse_args()
+    settings = Settings()
+    logger.configure("error", settings.LOG_SUPPRESS_SECONDS)
+
+    fleet = SimulatedFleet(args.device_latency_ms)
+    runner = web.AppRunner(fleet.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    base_url = f"http://{host}:{port}"
+
+    probe = Probe(fleet)
+    probe.install()
+    pool = create_pool(settings.DATABASE_URL)
+    await pool.open()
+    idle_rss = _rss_bytes()
+    print(
+        f"Simulator {base_url}, poll every {args.poll_seconds:g}s, device latency ~{args.device_latency_ms:g} ms;"
+        " CPU and memory include the in-process simulator"
+    )
+    print(
+        f"{'devices':>8} {'samples/s':>10} {'polls':>9} {'e2e p50':>9} {'e2e p99':>9} {'write p99':>10}"
+        f" {'CPU %':>7} {'CPU ms/dev/s':>13} {'RSS/dev KiB':>12}"
+    )
+    sustainable: StepStats | None = None
+    devices = args.start_devices
+    try:
+        while devices <= args.max_devices:
+            stats = await _run_step(args, settings, pool, base_url, fleet, probe, devices)
+            ratio = stats.polls / stats.expected_polls if stats.expected_polls else 0.0
+            p50 = _percentile(stats.latencies, 0.50)
+            p99 = _percentile(stats.latencies, 0.99)
+            write_p99 = _percentile(stats.writes, 0.99)
+            cpu_pct = stats.cpu_seconds * 100.0 / stats.wall_seconds
+            print(
+                f"{devices:>8} {stats.polls / stats.wall_seconds:>10.1f} {ratio:>8.0%}"
+                f" {(p50 or 0) * 1000:>7.1f}ms {(p99 or 0) * 1000:>7.1f}ms {(write_p99 or 0) * 1000:>8.1f}ms"
+                f" {cpu_pct:>6.1f}% {stats.cpu_seconds * 1000 / stats.wall_seconds / devices:>13.2f}"
+                f" {max(0, stats.rss_bytes - idle_rss) / 1024 / devices:>12.1f}",
+                flush=True,
+            )
+            failed = []
+            if ratio < args.min_poll_ratio:
+                failed.append(f"polls at {ratio:.0%} of schedule")
+            if write_p99 is None or write_p99 * 1000 > args.max_write_p99_ms:
+                failed.append(f"write p99 {(write_p99 or 0) * 1000:.0f} ms")
+            if p99 is not None and p99 > args.poll_seconds:
+                failed.append("e2e p99 above the poll interval")
+            if failed:
+                print(f"Degraded at {devices} devices: {', '.join(failed)}")
+                break
+            sustainable = stats
+            devices = max(devices + 1, int(devices * args.ramp_factor))
+    finally:
+        await pool.close()
+        await runner.cleanup()
+
+    if sustainable is None:
+        print("No sustainable step; lower --start-devices or raise --poll-seconds")
+        return
+    print(
+        f"Max sustainable: {sustainable.devices} devices x {1 / args.poll_seconds:g} samples/s"
+        f" = {sustainable.devices / args.poll_seconds:.1f} samples/s"
+        f" (next step degraded; bisect with --start-devices/--ramp-factor for a tighter bound)"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -3,6 +3,7 @@ from __future__ import annotations
 import argparse
 import asyncio
 import sys
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 ROOT = Path(__file__).resolve().parents[1]
@@ -18,6 +19,7 @@ except ModuleNotFoundError as exc:
         print("  python3 -m pip install -r requirements.txt")
         raise SystemExit(1) from exc
     raise
+from collector.archive import archive_and_delete, require_pyarrow
 from collector.db import (
     create_pool,
     delete_energy_intervals_older_than,
@@ -43,7 +45,7 @@ async def run() -> None:
     args = parse_args()
     settings = Settings()
 
-    print("WARNING: This operation is irreversible.")
+    print("WARNING: This operation is irreversible (unless ARCHIVE_DIR is set).")
     print("If you increased resolution/retention recently, deleted data cannot be restored.")
     print("Settings used:")
     print(f"- RETENTION_DOWNSAMPLE_AFTER_HOURS={settings.RETENTION_DOWNSAMPLE_AFTER_HOURS}")
@@ -53,6 +55,9 @@ async def run() -> None:
     print(f"- RETENTION_INTERVAL_RAW_MAX_DAYS={settings.RETENTION_INTERVAL_RAW_MAX_DAYS}")
     print(f"- RETENTION_MAX_DB_MB={settings.RETENTION_MAX_DB_MB}")
     print(f"- RETENTION_PRUNE_INCLUDE_INTERVALS={settings.RETENTION_PRUNE_INCLUDE_INTERVALS}")
+    print(f"- ARCHIVE_DIR={settings.ARCHIVE_DIR}")
+    if settings.ARCHIVE_DIR:
+        require_pyarrow()
 
     if not args.yes:
         try:
@@ -78,22 +83,43 @@ async def run() -> None:
         print(f"Raw rows deleted: {deleted}")
 
     if settings.RETENTION_LOW_RES_MAX_DAYS and settings.RETENTION_LOW_RES_MAX_DAYS > 0:
-        low_deleted = await delete_power_readings_1m_older_than(pool, settings.RETENTION_LOW_RES_MAX_DAYS)
+        if settings.ARCHIVE_DIR:
+            cutoff = datetime.now(timezone.utc) - timedelta(days=settings.RETENTION_LOW_RES_MAX_DAYS)
+            archived, low_deleted = await archive_and_delete(
+                pool, settings.ARCHIVE_DIR, "power_readings_1m", cutoff
+            )
+            print(f"Low-res rows archived: {archived}")
+        else:
+            low_deleted = await delete_power_readings_1m_older_than(pool, settings.RETENTION_LOW_RES_MAX_DAYS)
         print(f"Low-res rows deleted: {low_deleted}")
 
     if settings.RETENTION_INTERVAL_RAW_MAX_DAYS and settings.RETENTION_INTERVAL_RAW_MAX_DAYS > 0:
-        interval_deleted = await delete_energy_intervals_older_than(
-            pool, settings.RETENTION_INTERVAL_RAW_MAX_DAYS
-        )
+        if settings.ARCHIVE_DIR:
+            cutoff = datetime.now(timezone.utc) - timedelta(days=settings.RETENTION_INTERVAL_RAW_MAX_DAYS)
+            archived, interval_deleted = await archive_and_delete(
+                pool, settings.ARCHIVE_DIR, "energy_intervals", cutoff
+            )
+            print(f"Interval raw rows archived: {archived}")
+        else:
+            interval_deleted = await delete_energy_intervals_older_than(
+                pool, settings.RETENTION_INTERVAL_RAW_MAX_DAYS
+            )
         print(f"Interval raw rows deleted: {interval_deleted}")
 
     if settings.RETENTION_MAX_DB_MB and settings.RETENTION_MAX_DB_MB > 0:
         max_bytes = int(settings.RETENTION_MAX_DB_MB * 1024 * 1024)
         before = await get_database_size_bytes(pool)
+
+        async def archive(table: str, cutoff: datetime) -> int:
+            archived, deleted = await archive_and_delete(pool, settings.ARCHIVE_DIR, table, cutoff)
+            print(f"Archived {table}: {archived}")
+            return deleted
+
         deleted = await prune_power_storage_by_size(
             pool,
             max_bytes=max_bytes,
             include_intervals=settings.RETENTION_PRUNE_INCLUDE_INTERVALS,
+            archive_delete=archive if settings.ARCHIVE_DIR else None,
         )
         after = await get_database_size_bytes(pool)
         print(
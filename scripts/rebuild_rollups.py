@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Awaitable, Callable
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from collector.config import Settings
+from collector.db import (
+    clear_rebuild_progress,
+    create_pool,
+    get_rebuild_progress,
+    mark_rebuild_slice,
+    upsert_energy_intervals_1h_range,
+    upsert_energy_local_days_range,
+    upsert_energy_rollups_range,
+    upsert_power_readings_1m_range,
+    upsert_power_rollups_range,
+)
+from collector.rollups import RollupLevel, base_level, parse_levels
+
+DAY = base_level("1d", 86400)
+
+
+@dataclass
+class Step:
+    name: str
+    align: RollupLevel
+    run: Callable[[datetime, datetime], Awaitable[int]]
+    # energy_local_days also refreshes the local months its days fall in, so slices touching the same
+    # month must not run concurrently.
+    parallel: bool = True
+
+
+def _parse_dt(value: str) -> datetime:
+    value = value.strip().replace(" ", "T")
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Rebuild rollup tables from their sources in parallel time slices (resumable)."
+    )
+    parser.add_argument("--start", required=True, help="Start timestamp (UTC), e.g. 2025-01-01T00:00:00Z")
+    parser.add_argument("--end", default=None, help="End timestamp (UTC, default: now)")
+    parser.add_argument(
+        "--only",
+        default=None,
+        help="Comma-separated steps or chains to run: power, energy, power_readings_1m, power_rollups:15m,"
+        " energy_intervals_1h, energy_rollups:1d, energy_local_days (default: all)",
+    )
+    parser.add_argument("--slice-hours", type=int, default=24, help="Slice length (rounded up to the level's bucket)")
+    parser.add_argument("--workers", type=int, default=4, help="Slices processed concurrently")
+    parser.add_argument("--fresh", action="store_true", help="Ignore progress saved by an interrupted run")
+    parser.add_argument("--list", action="store_true", help="List the steps and their slice counts, then exit")
+    return parser.parse_args()
+
+
+def _next_bucket(level: RollupLevel, ts: datetime) -> datetime:
+    if level.seconds is None:
+        return datetime(ts.year + ts.month // 12, ts.month % 12 + 1, 1, tzinfo=timezone.utc)
+    return ts + timedelta(seconds=level.seconds)
+
+
+def slices(level: RollupLevel, start: datetime, end: datetime, slice_seconds: int) -> list[tuple[datetime, datetime]]:
+    # Whole buckets only, so no bucket is aggregated by two slices.
+    out = []
+    current = level.floor(start)
+    while current < end:
+        following = max(level.floor(current + timedelta(seconds=slice_seconds)), _next_bucket(level, current))
+        out.append((current, following))
+        current = following
+    return out
+
+
+def build_steps(pool, settings: Settings) -> list[Step]:
+    power_base = base_level(
+        f"{settings.RETENTION_LOW_RES_MINUTES}m",
+        max(60, settings.RETENTION_LOW_RES_MINUTES * 60),
+    )
+    energy_base = base_level(
+        f"{settings.RETENTION_INTERVAL_LOW_RES_HOURS}h",
+        max(1, settings.RETENTION_INTERVAL_LOW_RES_HOURS) * 3600,
+    )
+    power_levels = [power_base, *parse_levels(settings.ROLLUP_POWER_LEVELS, power_base)]
+    energy_levels = [energy_base, *parse_levels(settings.ROLLUP_ENERGY_LEVELS, energy_base)]
+
+    # Source levels first: each level is built from the one below it.
+    steps = [
+        Step(
+            "power_readings_1m",
+            power_base,
+            lambda start, end: upsert_power_readings_1m_range(pool, start, end, power_base.seconds or 60),
+        )
+    ]
+    for source, level in zip(power_levels, power_levels[1:]):
+        steps.append(
+            Step(
+                f"power_rollups:{level.name}",
+                level,
+                lambda start, end, source=source, level=level: upsert_power_rollups_range(
+                    pool, level, source, start, end, source is power_base
+                ),
+            )
+        )
+    steps.append(
+        Step(
+            "energy_intervals_1h",
+            energy_base,
+            lambda start, end: upsert_energy_intervals_1h_range(pool, start, end, energy_base.seconds or 3600),
+        )
+    )
+    for source, level in zip(energy_levels, energy_levels[1:]):
+        steps.append(
+            Step(
+                f"energy_rollups:{level.name}",
+                level,
+                lambda start, end, source=source, level=level: upsert_energy_rollups_range(
+                    pool, level, source, start, end, source is energy_base
+                ),
+            )
+        )
+    steps.append(
+        Step("energy_local_days", DAY, lambda start, end: upsert_energy_local_days_range(pool, start, end), False)
+    )
+    return steps
+
+
+def _selected(step: Step, only: set[str] | None) -> bool:
+    if only is None:
+        return True
+    chain = "power" if step.name.startswith("power") else "energy"
+    return step.name in only or chain in only
+
+
+async def run_step(
+    pool,
+    run_key: str,
+    step: Step,
+    parts: list[tuple[datetime, datetime]],
+    done: set[tuple[str, datetime]],
+    workers: int,
+) -> int:
+    pending = [part for part in parts if (step.name, part[0]) not in done]
+    queue: asyncio.Queue[tuple[datetime, datetime]] = asyncio.Queue()
+    for part in pending:
+        queue.put_nowait(part)
+    started = time.monotonic()
+    state = {"done": 0, "rows": 0, "failed": 0, "printed": 0.0}
+
+    def report(final: bool = False) -> None:
+        now = time.monotonic()
+        if not final and now - state["printed"] < 2.0:
+            return
+        state["printed"] = now
+        elapsed = now - started
+        rate = state["done"] / elapsed if elapsed > 0 else 0.0
+        eta = (len(pending) - state["done"]) / rate if rate > 0 else 0.0
+        print(
+            f"{step.name:28} {state['done'] + len(parts) - len(pending):>6}/{len(parts):<6} slices"
+            f" {state['rows']:>12,} rows {elapsed:>8.1f}s  eta {eta:,.0f}s"
+            + (f"  {state['failed']} failed" if state["failed"] else ""),
+            flush=True,
+        )
+
+    async def worker() -> None:
+        while not queue.empty():
+            start, end = queue.get_nowait()
+            try:
+                # Each slice is its own transaction: row locks are held for one slice, never the whole range.
+                rows = await step.run(start, end)
+                await mark_rebuild_slice(pool, run_key, step.name, start, end, rows)
+                state["rows"] += rows
+            except Exception as exc:  # noqa: BLE001
+                state["failed"] += 1
+                print(f"{step.name} {start.isoformat()} .. {end.isoformat()} failed: {exc}", flush=True)
+            state["done"] += 1
+            report()
+
+    await asyncio.gather(*(worker() for _ in range(max(1, workers if step.parallel else 1))))
+    report(final=True)
+    return state["failed"]
+
+
+async def main() -> None:
+    args = parse_args()
+    settings = Settings()
+    start_ts = _parse_dt(args.start)
+    end_ts = _parse_dt(args.end) if args.end else datetime.now(timezone.utc)
+    if start_ts >= end_ts:
+        raise SystemExit("start must be < end")
+    only = {name.strip() for name in args.only.split(",") if name.strip()} if args.only else None
+    slice_seconds = max(1, args.slice_hours) * 3600
+    # Slices are aligned from --start, so an open-ended run resumes under the same key.
+    run_key = f"{start_ts.isoformat()}/{end_ts.isoformat() if args.end else 'now'}/{args.slice_hours}h"
+
+    pool = create_pool(settings.DATABASE_URL, settings.DATABASE_TIMEOUT_SECONDS, max(4, args.workers))
+    await pool.open()
+    try:
+        steps = [step for step in build_steps(pool, settings) if _selected(step, only)]
+        if not steps:
+            raise SystemExit("No steps selected")
+        plan = [(step, slices(step.align, start_ts, end_ts, slice_seconds)) for step in steps]
+        if args.list:
+            for step, parts in plan:
+                print(f"{step.name:28} {len(parts):>6} slices{'' if step.parallel else ' (serial)'}")
+            return
+        if args.fresh:
+            await clear_rebuild_progress(pool, run_key)
+        done = await get_rebuild_progress(pool, run_key)
+        if done:
+            print(f"Resuming {run_key}: {len(done)} slices already done")
+        started = time.monotonic()
+        for step, parts in plan:
+            failed = await run_step(pool, run_key, step, parts, done, args.workers)
+            if failed:
+                # Later levels read this one; rerun the same command to retry the failed slices first.
+                raise SystemExit(f"{step.name}: {failed} slices failed; progress kept under {run_key}")
+        await clear_rebuild_progress(pool, run_key)
+        print(f"Rebuilt {', '.join(step.name for step in steps)} in {time.monotonic() - started:.1f}s")
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from collector.config import Settings
+from collector.costs import CostAccrual
+from collector.db import create_pool, fetch_device_timezone
+
+
+def _parse_dt(value: str) -> datetime:
+    value = value.strip().replace(" ", "T")
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Recompute energy_costs and daily/monthly cost totals.")
+    parser.add_argument("--start", required=True, help="Start timestamp (UTC), e.g. 2026-01-01T00:00:00Z")
+    parser.add_argument("--end", required=True, help="End timestamp (UTC), e.g. 2026-02-01T00:00:00Z")
+    parser.add_argument("--device-id", required=True, help="Device id as stored in energy_intervals")
+    parser.add_argument("--timezone", default=None, help="Device timezone (default: device_settings, then UTC)")
+    return parser.parse_args()
+
+
+async def main() -> None:
+    args = parse_args()
+    settings = Settings()
+
+    start_ts = _parse_dt(args.start)
+    end_ts = _parse_dt(args.end)
+    if start_ts >= end_ts:
+        raise SystemExit("start must be < end")
+
+    pool = create_pool(settings.DATABASE_URL)
+    await pool.open()
+    try:
+        tz = args.timezone or await fetch_device_timezone(pool, args.device_id)
+        priced = await CostAccrual(pool).accrue(args.device_id, tz, start_ts, end_ts)
+    finally:
+        await pool.close()
+
+    print(f"Priced {priced} local days for {args.device_id} ({tz or 'UTC'})")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
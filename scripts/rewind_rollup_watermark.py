@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from collector.config import Settings
+from collector.db import (
+    ENERGY_INTERVALS_1H_ROLLUP,
+    POWER_READINGS_1M_ROLLUP,
+    create_pool,
+    get_rollup_watermarks,
+    rewind_rollup_watermark,
+)
+
+
+def _parse_dt(value: str) -> datetime:
+    value = value.strip().replace(" ", "T")
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Rewind a downsampling watermark so the next retention run recomputes from --since."
+    )
+    parser.add_argument(
+        "--rollup",
+        required=True,
+        choices=(POWER_READINGS_1M_ROLLUP, ENERGY_INTERVALS_1H_ROLLUP),
+        help="Rollup table whose watermark should be rewound",
+    )
+    parser.add_argument("--since", required=True, help="Recompute from this timestamp (UTC), e.g. 2026-02-01T00:00:00Z")
+    parser.add_argument("--device-id", default=None, help="Only rewind this device (default: all devices)")
+    return parser.parse_args()
+
+
+async def main() -> None:
+    args = parse_args()
+    settings = Settings()
+    since_ts = _parse_dt(args.since)
+
+    pool = create_pool(settings.DATABASE_URL)
+    await pool.open()
+    try:
+        rewound = await rewind_rollup_watermark(pool, args.rollup, since_ts, args.device_id)
+        print(f"Rewound watermarks: {rewound}")
+        for device_id, watermark_ts in sorted((await get_rollup_watermarks(pool, args.rollup)).items()):
+            print(f"- {device_id}: {watermark_ts.isoformat()}")
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())